@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # SQL queries and timings per request, see backend.profiling
+    'backend.profiling.RequestProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -82,6 +84,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # SQLite пишет в базу по одному соединению: параллельные импорты ждут
+        # блокировку записи до timeout секунд, заранее её берут только
+        # транзакции импорта (backend.db.write_transaction). Для большого
+        # числа параллельных импортов нужен Postgres
+        'OPTIONS': {'timeout': 20},
+        # тестовая база в файле, а не в памяти: иначе параллельные импорты
+        # в тестах получают "database table is locked" без ожидания
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -145,4 +155,76 @@ EMAIL_PORT = 8025
 EMAIL_HOST_USER = 'noreply@goods_service.com'
 EMAIL_HOST_PASSWORD = ''
 EMAIL_USE_TLS = False
-EMAIL_USE_SSL = False
\ No newline at end of file
+EMAIL_USE_SSL = False
+
+
+# Import of price lists
+# reference tables are written in chunks, but a shop's ProductInfo,
+# ProductParameter and CatalogEntry rows are swapped in one write transaction,
+# so readers see either the old or the new price list; SQLite writers wait for
+# it meanwhile
+FEED_CONNECT_TIMEOUT = 5  # seconds
+FEED_READ_TIMEOUT = 60  # seconds
+FEED_MAX_SIZE = 200 * 1024 * 1024  # bytes
+FEED_DOWNLOAD_TIMEOUT = 300  # seconds for the whole download
+FEED_RETRIES = 3
+FEED_RETRY_BACKOFF = 0.5  # seconds, doubles on every retry
+FEED_POOL_SIZE = 10
+# share Category/Parameter name -> id lookups between imports of one process
+IMPORT_SHARED_NAME_CACHE = False
+# background import jobs running longer than this are treated as abandoned by
+# a dead worker and failed, so the shop's queue moves on; keep it above the
+# longest import
+IMPORT_JOB_TIMEOUT = 60 * 60  # seconds
+
+# Catalog
+PRODUCTS_PAGE_SIZE = 100
+PRODUCTS_MAX_PAGE_SIZE = 1000
+# catalog responses live until an import or a shop state change bumps the version
+CATALOG_CACHE = 'catalog'
+CATALOG_CACHE_TIMEOUT = 300  # seconds
+# catalog versions: two keys per changed shop, kept apart from the responses
+CATALOG_VERSION_CACHE = 'catalog_versions'
+
+# Request profiling: requests over budget are logged as warnings
+REQUEST_QUERY_BUDGET = 50
+REQUEST_TIME_BUDGET = 1.0  # seconds
+
+# Metrics at /metrics: with several processes (web workers, import worker) set a
+# directory shared by all of them, otherwise each process reports only its own
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5  # seconds
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # file-based, so imports run by the background worker invalidate it too
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'catalog',
+    },
+    # holds only catalog versions, so with this limit culling never evicts them
+    'catalog_versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'catalog_versions',
+        'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+    },
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        # per-stage import timings from backend.serializers
+        'backend': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
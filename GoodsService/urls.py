@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from backend.views import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('backend.urls')),
+    path('metrics', metrics, name='metrics'),
 ]
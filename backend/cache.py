@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from hashlib import sha256
+from time import time
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import caches
+from django.views.decorators.http import condition
+
+##########################################
+# Кэш ответов каталога
+#
+# Ключ ответа включает версию каталога: общую для выборок по всем магазинам и
+# отдельную для каждого магазина. Импорт прайса и смена статуса магазина
+# записывают новую версию, и старые ответы просто перестают запрашиваться, а
+# вытесняются из кэша по таймауту. Та же версия служит ETag для условных
+# запросов (catalog_condition).
+# Версии хранятся в отдельном кэше CATALOG_VERSION_CACHE, где кроме них ничего
+# нет, поэтому их не вытесняют ответы. Версия - случайное значение, а не
+# счётчик: одновременные изменения из разных процессов не могут записать одну
+# и ту же версию. Ключ версии магазина появляется только при его изменении, до
+# этого выборки магазина используют общую версию.
+
+
+def get_catalog_cache():
+    return caches[settings.CATALOG_CACHE]
+
+
+def get_catalog_version_cache():
+    return caches[settings.CATALOG_VERSION_CACHE]
+
+
+def _shop_key(shop_id):
+    # id магазина приходит и из параметров запроса: посторонние значения
+    # не должны порождать ключи
+    if shop_id is None or not str(shop_id).isdecimal() or not int(shop_id):
+        return None
+    return int(shop_id)
+
+
+def _version_key(shop_id=None):
+    return f"catalog:version:{shop_id if shop_id else 'all'}"
+
+
+def _modified_key(shop_id=None):
+    return f"catalog:modified:{shop_id if shop_id else 'all'}"
+
+
+def _new_version():
+    return uuid4().hex
+
+
+def catalog_version(shop_id=None):
+    """
+    Текущая версия каталога магазина (или всего каталога, если магазин не указан)
+    """
+    cache = get_catalog_version_cache()
+    shop_id = _shop_key(shop_id)
+    if shop_id is not None:
+        version = cache.get(_version_key(shop_id))
+        if version is not None:
+            return version
+    version = cache.get(_version_key())
+    if version is None:
+        cache.add(_version_key(), _new_version(), timeout=None)
+        version = cache.get(_version_key())
+    return version
+
+
+def bump_catalog_version(shop_id):
+    """
+    Сбрасывает закэшированные ответы каталога магазина и всего каталога
+    """
+    shop_id = _shop_key(shop_id)
+    now = time()
+    versions = {_version_key(): _new_version(), _modified_key(): now}
+    if shop_id is not None:
+        versions[_version_key(shop_id)] = _new_version()
+        versions[_modified_key(shop_id)] = now
+    get_catalog_version_cache().set_many(versions, timeout=None)
+
+
+def catalog_modified(shop_id=None):
+    """
+    Время последнего изменения каталога магазина (или всего каталога), если известно
+    """
+    cache = get_catalog_version_cache()
+    shop_id = _shop_key(shop_id)
+    modified = None
+    if shop_id is not None:
+        modified = cache.get(_modified_key(shop_id))
+    if modified is None:
+        modified = cache.get(_modified_key())
+    if modified is None:
+        return None
+    return datetime.fromtimestamp(modified, tz=timezone.utc)
+
+
+def catalog_cache_key(name, params, shop_id=None):
+    """
+    Ключ ответа по имени выборки, её параметрам и версии каталога
+    """
+    query = urlencode(sorted(params.lists()), doseq=True)
+    digest = sha256(query.encode()).hexdigest()
+    return f"catalog:{name}:{catalog_version(shop_id)}:{digest}"
+
+
+def catalog_condition(name, shop_param="shop_id"):
+    """
+    Условный GET для выборок каталога: ETag строится по версии каталога и
+    параметрам запроса, Last-Modified - по времени последнего изменения.
+    Если клиент прислал актуальные валидаторы, ответ 304 отдаётся без вызова
+    представления. shop_param - параметр пути или запроса с id магазина выборки
+    """
+
+    def shop_id(request, kwargs):
+        return kwargs.get(shop_param) or request.GET.get(shop_param)
+
+    def etag(request, *args, **kwargs):
+        key = catalog_cache_key(name, request.GET, shop_id(request, kwargs))
+        return sha256(f"{key}:{kwargs}".encode()).hexdigest()[:32]
+
+    def last_modified(request, *args, **kwargs):
+        return catalog_modified(shop_id(request, kwargs))
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
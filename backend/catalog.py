@@ -0,0 +1,226 @@
+from django.conf import settings
+
+from backend.cache import catalog_version, get_catalog_cache
+from backend.models import (
+    CatalogEntry,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+)
+
+##########################################
+# Денормализованный каталог
+#
+# CatalogEntry хранит каждую позицию прайса одной строкой вместе с магазином,
+# товаром, категорией и параметрами (JSON в том же виде, что в ответе API).
+# Строки магазина пересобираются при импорте прайса, строка удаляется вместе
+# с позицией прайса, а названия и статус магазина, товара, категории и
+# параметров переписываются при их изменении.
+
+CATALOG_BATCH_SIZE = 1000
+
+
+def product_parameters_data(product_infos_id):
+    """
+    Параметры позиций в виде ответа API: {id позиции: [{"parameter", "value"}]}
+    """
+    parameters = {}
+    rows = (
+        ProductParameter.objects.filter(product_info_id__in=product_infos_id)
+        .order_by("id")
+        .values_list("product_info_id", "parameter__name", "value")
+    )
+    for product_info_id, name, value in rows:
+        parameters.setdefault(product_info_id, []).append(
+            {"parameter": name, "value": value}
+        )
+    return parameters
+
+
+def iter_id_batches(rows, ids=None, batch_size=CATALOG_BATCH_SIZE):
+    """
+    Строки values_list() с id первым столбцом пачками по возрастанию id: все
+    (без OFFSET, по последнему id) или только с перечисленными в ids
+    """
+    rows = rows.order_by("id")
+    if ids is not None:
+        ids = sorted(ids)
+        for start in range(0, len(ids), batch_size):
+            batch = list(rows.filter(id__in=ids[start : start + batch_size]))
+            if batch:
+                yield batch
+        return
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1][0]
+        yield batch
+
+
+def refresh_shop_catalog(shop_id, product_infos_id=None, deleted_id=()):
+    """
+    Пересобирает строки каталога магазина, возвращает их число. Если указаны
+    product_infos_id и deleted_id, переписываются только строки этих позиций
+    """
+    if product_infos_id is None:
+        CatalogEntry.objects.filter(shop_id=shop_id).delete()
+    else:
+        stale = sorted(set(product_infos_id) | set(deleted_id))
+        for start in range(0, len(stale), CATALOG_BATCH_SIZE):
+            CatalogEntry.objects.filter(
+                id__in=stale[start : start + CATALOG_BATCH_SIZE]
+            ).delete()
+    product_infos = ProductInfo.objects.filter(shop_id=shop_id).values_list(
+        "id",
+        "shop__name",
+        "shop__state",
+        "product_id",
+        "product__name",
+        "product__category_id",
+        "product__category__name",
+        "model",
+        "quantity",
+        "price",
+        "price_rrc",
+    )
+    rows = 0
+    for batch in iter_id_batches(product_infos, product_infos_id):
+        parameters = product_parameters_data([row[0] for row in batch])
+        CatalogEntry.objects.bulk_create(
+            CatalogEntry(
+                id_id=id_,
+                shop_id=shop_id,
+                shop_name=shop_name,
+                shop_state=shop_state,
+                product_id=product_id,
+                product_name=product_name,
+                category_id=category_id,
+                category_name=category_name,
+                model=model,
+                quantity=quantity,
+                price=price,
+                price_rrc=price_rrc,
+                parameters=parameters.get(id_, []),
+            )
+            for (
+                id_,
+                shop_name,
+                shop_state,
+                product_id,
+                product_name,
+                category_id,
+                category_name,
+                model,
+                quantity,
+                price,
+                price_rrc,
+            ) in batch
+        )
+        rows += len(batch)
+    return rows
+
+
+def sync_shop_catalog(shop):
+    """
+    Переносит в каталог название и статус магазина
+    """
+    CatalogEntry.objects.filter(shop_id=shop.id).update(
+        shop_name=shop.name, shop_state=shop.state
+    )
+
+
+def _entries_shops(entries):
+    return set(entries.values_list("shop_id", flat=True).distinct())
+
+
+def catalog_shops(instance):
+    """
+    id магазинов, в каталоге которых есть позиции товара или категории
+    """
+    column = "product_id" if isinstance(instance, Product) else "category_id"
+    return _entries_shops(CatalogEntry.objects.filter(**{column: instance.id}))
+
+
+def sync_category_catalog(category):
+    """
+    Переносит в каталог название категории, возвращает id затронутых магазинов
+    """
+    entries = CatalogEntry.objects.filter(category_id=category.id)
+    shops_id = _entries_shops(entries)
+    entries.update(category_name=category.name)
+    return shops_id
+
+
+def sync_product_catalog(product):
+    """
+    Переносит в каталог название и категорию товара, возвращает id затронутых
+    магазинов
+    """
+    entries = CatalogEntry.objects.filter(product_id=product.id)
+    shops_id = _entries_shops(entries)
+    entries.update(
+        product_name=product.name,
+        category_id=product.category_id,
+        category_name=product.category.name,
+    )
+    return shops_id
+
+
+def sync_parameter_catalog(parameter):
+    """
+    Пересобирает параметры строк каталога с параметром parameter, возвращает
+    id затронутых магазинов
+    """
+    product_infos_id = ProductParameter.objects.filter(
+        parameter_id=parameter.id
+    ).values_list("product_info_id", flat=True)
+    shops_id = set()
+    for batch in iter_id_batches(
+        CatalogEntry.objects.values_list("id", "shop_id"), list(product_infos_id)
+    ):
+        parameters = product_parameters_data([id_ for id_, _ in batch])
+        CatalogEntry.objects.bulk_update(
+            [
+                CatalogEntry(id_id=id_, parameters=parameters.get(id_, []))
+                for id_, _ in batch
+            ],
+            ["parameters"],
+        )
+        shops_id.update(shop_id for _, shop_id in batch)
+    return shops_id
+
+
+##########################################
+# Справочник магазинов
+#
+# Список включённых магазинов с контактами читается одним запросом и хранится
+# в кэше каталога под общей версией, которую увеличивают изменение магазина,
+# его статуса и email его пользователя.
+
+
+def shop_directory():
+    """
+    Включённые магазины в виде ответа API, в порядке Shop.Meta.ordering
+    """
+    cache = get_catalog_cache()
+    key = f"catalog:shops:{catalog_version()}"
+    shops = cache.get(key)
+    if shops is None:
+        shops = [
+            {
+                "id": id_,
+                "name": name,
+                "state": state,
+                "url": url,
+                # у магазина без пользователя email пустой
+                "contact": {"email": email or ""},
+            }
+            for id_, name, state, url, email in Shop.objects.filter(
+                state=True
+            ).values_list("id", "name", "state", "url", "user__email")
+        ]
+        cache.set(key, shops, settings.CATALOG_CACHE_TIMEOUT)
+    return shops
@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+##########################################
+# Транзакции записи
+#
+# В SQLite транзакция по умолчанию (DEFERRED) берёт блокировку записи только при
+# первом изменении. Если до него транзакция успела читать, а запись уже ведёт
+# другое соединение, SQLite сразу отвечает "database is locked", не дожидаясь
+# timeout. Импорт и захват задач сначала читают, потом пишут, поэтому их
+# транзакции начинаются с BEGIN IMMEDIATE и ждут блокировку заранее. Остальные
+# транзакции проекта остаются DEFERRED и не блокируют запись без надобности.
+
+
+@contextmanager
+def write_transaction():
+    """
+    transaction.atomic(), который в SQLite сразу берёт блокировку записи
+    """
+    if connection.vendor != "sqlite" or connection.in_atomic_block:
+        with transaction.atomic():
+            yield
+        return
+
+    connection.ensure_connection()
+    # режим читается при BEGIN внешнего atomic, то есть при входе в блок;
+    # connection.transaction_mode есть в Django 5.1+, см. requirements.txt
+    mode = connection.transaction_mode
+    connection.transaction_mode = "IMMEDIATE"
+    try:
+        with transaction.atomic():
+            connection.transaction_mode = mode
+            yield
+    finally:
+        connection.transaction_mode = mode
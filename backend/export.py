@@ -0,0 +1,206 @@
+from itertools import islice
+from json import dumps as dump_json
+
+from django.db.models import Q
+from yaml import dump as dump_yaml
+
+from backend.feeds import FeedDumper
+from backend.models import CatalogEntry, Category, Shop
+from backend.serializers import catalog_entry_columns, serialize_catalog_entries
+
+##########################################
+# Потоковая выгрузка каталога
+#
+# Каталог читается из CatalogEntry итератором пачками по EXPORT_CHUNK_SIZE строк
+# и отдаётся по мере сериализации, поэтому память не зависит от числа позиций.
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "yaml": "application/yaml",
+}
+
+
+def _dump(value):
+    # так же, как JSONRenderer в DRF
+    return dump_json(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def catalog_query(shop_id=None, category_id=None):
+    query = Q(shop_state=True)
+    if shop_id:
+        query = query & Q(shop_id=shop_id)
+    if category_id:
+        query = query & Q(category_id=category_id)
+    return query
+
+
+def iter_catalog_batches(query, chunk_size=None):
+    """
+    Сериализованные позиции каталога пачками в порядке id
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    rows = (
+        CatalogEntry.objects.filter(query)
+        .order_by("id")
+        .values(*catalog_entry_columns())
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            return
+        yield serialize_catalog_entries(batch)
+
+
+def iter_catalog_json(query, chunk_size=None):
+    """
+    Каталог одним JSON-документом {"Status": true, "products": [...]} по частям
+    """
+    yield b'{"Status":true,"products":['
+    separator = ""
+    for batch in iter_catalog_batches(query, chunk_size):
+        yield (separator + ",".join(_dump(item) for item in batch)).encode()
+        separator = ","
+    yield b"]}"
+
+
+def iter_catalog_ndjson(query, chunk_size=None):
+    """
+    Каталог в формате JSON Lines: одна позиция на строку
+    """
+    for batch in iter_catalog_batches(query, chunk_size):
+        yield "".join(_dump(item) + "\n" for item in batch).encode()
+
+
+EXPORT_WRITERS = {
+    "json": iter_catalog_json,
+    "ndjson": iter_catalog_ndjson,
+}
+
+
+##########################################
+# Выгрузка прайсов в формате импорта
+#
+# Прайс магазина выгружается в той же схеме, что принимает импорт (shop,
+# categories, goods с parameters), в YAML или JSON Lines, и может быть
+# загружен обратно через partner/update. id товаров и категорий - их id в
+# базе. Весь каталог выгружается YAML-потоком с отдельным документом на
+# каждый включённый магазин. Такой поток только для выгрузки: импорт принимает
+# один документ, поэтому обратно загружается каждый документ по отдельности
+# (или прайс магазина из export_shop_feed).
+
+
+def _dump_feed_yaml(value):
+    return dump_yaml(
+        value,
+        Dumper=FeedDumper,
+        allow_unicode=True,
+        sort_keys=False,
+        default_flow_style=False,
+    )
+
+
+def _shop_categories(shop):
+    return [
+        {"id": category_id, "name": name}
+        for category_id, name in Category.objects.filter(shops=shop)
+        .order_by("id")
+        .values_list("id", "name")
+    ]
+
+
+def iter_shop_goods(shop, chunk_size=None):
+    """
+    Товары прайса магазина пачками в схеме импорта
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    rows = (
+        CatalogEntry.objects.filter(shop_id=shop.id)
+        .order_by("id")
+        .values_list(
+            "product_id",
+            "category_id",
+            "model",
+            "product_name",
+            "price",
+            "price_rrc",
+            "quantity",
+            "parameters",
+        )
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            return
+        yield [
+            {
+                "id": product_id,
+                "category": category_id,
+                "model": model,
+                "name": name,
+                "price": price,
+                "price_rrc": price_rrc,
+                "quantity": quantity,
+                "parameters": {
+                    parameter["parameter"]: parameter["value"]
+                    for parameter in parameters
+                },
+            }
+            for (
+                product_id,
+                category_id,
+                model,
+                name,
+                price,
+                price_rrc,
+                quantity,
+                parameters,
+            ) in batch
+        ]
+
+
+def iter_shop_feed_yaml(shop, chunk_size=None):
+    """
+    Прайс магазина YAML-документом по частям
+    """
+    yield _dump_feed_yaml(
+        {"shop": shop.name, "categories": _shop_categories(shop)}
+    ).encode()
+    empty = True
+    for batch in iter_shop_goods(shop, chunk_size):
+        # элементы списка на уровне ключа goods - допустимый блочный YAML
+        yield (("goods:\n" if empty else "") + _dump_feed_yaml(batch)).encode()
+        empty = False
+    if empty:
+        yield b"goods: []\n"
+
+
+def iter_shop_feed_ndjson(shop, chunk_size=None):
+    """
+    Прайс магазина в JSON Lines: заголовок {"shop", "categories"}, затем товары
+    """
+    yield (
+        _dump({"shop": shop.name, "categories": _shop_categories(shop)}) + "\n"
+    ).encode()
+    for batch in iter_shop_goods(shop, chunk_size):
+        yield "".join(_dump(good) + "\n" for good in batch).encode()
+
+
+def iter_catalog_feeds_yaml(chunk_size=None):
+    """
+    Прайсы всех включённых магазинов YAML-потоком, по документу на магазин.
+    Каждый документ - прайс в формате импорта, весь поток импорт не принимает
+    """
+    for shop in Shop.objects.filter(state=True).order_by("id").iterator():
+        yield b"---\n"
+        yield from iter_shop_feed_yaml(shop, chunk_size)
+
+
+FEED_WRITERS = {
+    "yaml": iter_shop_feed_yaml,
+    "ndjson": iter_shop_feed_ndjson,
+}
@@ -0,0 +1,94 @@
+from django.db.models import Count, Q, Sum
+
+from backend.models import ParameterFacet, ProductParameter
+
+##########################################
+# Фильтры каталога по значениям параметров
+#
+# Число позиций с каждым значением параметра заранее сгруппировано по магазину
+# и категории в ParameterFacet и пересчитывается при импорте прайса магазина,
+# поэтому запрос счётчиков суммирует небольшую таблицу, а не группирует все
+# параметры товаров.
+
+
+def refresh_shop_facets(shop_id, categories_id=None):
+    """
+    Пересчитывает счётчики значений параметров магазина (или только его
+    категорий categories_id), возвращает число строк
+    """
+    stale = ParameterFacet.objects.filter(shop_id=shop_id)
+    parameters = ProductParameter.objects.filter(product_info__shop_id=shop_id)
+    if categories_id is not None:
+        stale = stale.filter(category_id__in=categories_id)
+        parameters = parameters.filter(
+            product_info__product__category_id__in=categories_id
+        )
+    stale.delete()
+    counts = (
+        parameters.values(
+            "product_info__product__category_id", "parameter_id", "value"
+        )
+        .annotate(count=Count("id"))
+        .order_by()
+    )
+    facets = [
+        ParameterFacet(
+            shop_id=shop_id,
+            category_id=row["product_info__product__category_id"],
+            parameter_id=row["parameter_id"],
+            value=row["value"],
+            count=row["count"],
+        )
+        for row in counts
+    ]
+    ParameterFacet.objects.bulk_create(facets, batch_size=1000)
+    return len(facets)
+
+
+def facet_counts(shop_id=None, category_id=None):
+    """
+    Счётчики значений параметров включённых магазинов: {параметр: {значение: число}}
+    """
+    query = Q(shop__state=True)
+    if shop_id:
+        query = query & Q(shop_id=shop_id)
+    if category_id:
+        query = query & Q(category_id=category_id)
+
+    facets = {}
+    rows = (
+        ParameterFacet.objects.filter(query)
+        .values("parameter__name", "value")
+        .annotate(total=Sum("count"))
+        .order_by("parameter__name", "value")
+    )
+    for row in rows:
+        facets.setdefault(row["parameter__name"], {})[row["value"]] = row["total"]
+    return facets
+
+
+def parse_parameter_filters(values):
+    """
+    Разбирает фильтры вида "Имя параметра=значение" в {имя: [значения]}
+    """
+    filters = {}
+    for item in values:
+        name, sep, value = item.partition("=")
+        if not sep or not name:
+            raise ValueError(f"Некорректный фильтр по параметру: {item}")
+        filters.setdefault(name, []).append(value)
+    return filters
+
+
+def parameter_filters_query(filters):
+    """
+    Условие на позиции: для каждого параметра - одно из перечисленных значений
+    """
+    query = Q()
+    for name, values in filters.items():
+        query = query & Q(
+            id__in=ProductParameter.objects.filter(
+                parameter__name=name, value__in=values
+            ).values("product_info_id")
+        )
+    return query
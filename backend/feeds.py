@@ -0,0 +1,366 @@
+from hashlib import sha256
+from json import loads as load_json
+from tempfile import TemporaryFile
+from time import monotonic
+
+from django.conf import settings
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from yaml import load as load_yaml
+from yaml.events import (
+    AliasEvent,
+    MappingEndEvent,
+    MappingStartEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+    StreamEndEvent,
+)
+from yaml.nodes import MappingNode, ScalarNode, SequenceNode
+
+from backend.models import Shop
+from backend.profiling import ImportProfile
+from backend.serializers import import_shop_records
+
+# libyaml ускоряет разбор и запись прайсов в разы, без него используем чистый
+# python. FeedDumper нужен выгрузке каталога (backend.export)
+try:
+    from yaml import CSafeDumper as FeedDumper
+    from yaml import CSafeLoader as FeedLoader
+except ImportError:
+    from yaml import SafeDumper as FeedDumper
+    from yaml import SafeLoader as FeedLoader
+
+##########################################
+# Потоковый разбор прайсов поставщиков
+#
+# Парсеры ниже отдают прайс последовательностью пар (раздел, значение) для
+# backend.serializers.import_shop_records: ("shop", имя), ("categories", список)
+# и по одной паре ("goods", товар) на каждый товар, поэтому в памяти находится
+# только текущий товар, а не весь документ.
+
+
+def _compose_node(loader, anchors):
+    """
+    Собирает узел YAML из событий парсера (аналог Composer.compose_node,
+    который работает и с CParser из libyaml)
+    """
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        if event.anchor not in anchors:
+            raise ValueError(f"Неизвестный якорь {event.anchor}")
+        return anchors[event.anchor]
+
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(
+            tag, event.value, event.start_mark, event.end_mark, style=event.style
+        )
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(
+            tag, [], event.start_mark, None, flow_style=event.flow_style
+        )
+        while not loader.check_event(MappingEndEvent):
+            key = _compose_node(loader, anchors)
+            node.value.append((key, _compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise ValueError(f"Неожиданное событие YAML {event}")
+
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def _load_node(loader, anchors):
+    return loader.construct_document(_compose_node(loader, anchors))
+
+
+def load_yaml_feed(stream):
+    """
+    Загружает YAML-прайс целиком безопасным загрузчиком
+    """
+    return load_yaml(stream, Loader=FeedLoader)
+
+
+def iter_yaml_records(stream, loader_class=FeedLoader):
+    """
+    Разбирает YAML-прайс по событиям, отдавая товары раздела goods по одному
+    """
+    loader = loader_class(stream)
+    # якоря действуют до конца документа, как у yaml.safe_load: товар может
+    # ссылаться на якорь из другого раздела или предыдущего товара
+    anchors = {}
+    try:
+        loader.get_event()  # StreamStart
+        loader.get_event()  # DocumentStart
+        if not loader.check_event(MappingStartEvent):
+            raise ValueError("Прайс должен быть словарём")
+        loader.get_event()
+        while not loader.check_event(MappingEndEvent):
+            key = _load_node(loader, anchors)
+            if key == "goods" and loader.check_event(SequenceStartEvent):
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield key, _load_node(loader, anchors)
+                loader.get_event()
+            else:
+                yield key, _load_node(loader, anchors)
+        loader.get_event()  # MappingEnd
+        loader.get_event()  # DocumentEnd
+        # как yaml.safe_load, не принимаем поток из нескольких документов,
+        # например выгрузку shops/export/
+        if not loader.check_event(StreamEndEvent):
+            raise ValueError("Прайс должен состоять из одного документа YAML")
+    finally:
+        loader.dispose()
+
+
+def iter_ndjson_records(lines):
+    """
+    Разбирает прайс в формате JSON Lines: первая строка - заголовок
+    {"shop": ..., "categories": [...]}, каждая следующая - один товар
+    """
+    header = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        value = load_json(line)
+        if header is None:
+            header = value
+            yield "shop", header["shop"]
+            yield "categories", header["categories"]
+        else:
+            yield "goods", value
+
+
+def timed_records(records, profile, stage="parse"):
+    """
+    Пропускает через себя записи прайса, относя время их разбора к этапу
+    stage профиля импорта
+    """
+    records = iter(records)
+    while True:
+        with profile.stage(stage):
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+        yield record
+
+
+def load_feed(stream, data_format="yaml"):
+    """
+    Загружает прайс целиком в виде словаря {"shop", "categories", "goods"}
+    """
+    if data_format != "ndjson":
+        return load_yaml_feed(stream)
+    data = {"goods": []}
+    for key, value in iter_ndjson_records(stream):
+        if key == "goods":
+            data["goods"].append(value)
+        else:
+            data[key] = value
+    return data
+
+
+##########################################
+# Загрузка прайсов с условными запросами
+#
+# Для каждого магазина запоминаются ETag, Last-Modified и хэш содержимого
+# последнего импортированного прайса: поставщик ответит 304 или пришлёт то же
+# самое, и тогда разбор и импорт не выполняются вовсе.
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_session = None
+
+
+class FeedTooLargeError(ValueError):
+    pass
+
+
+class FeedTimeoutError(ValueError):
+    pass
+
+
+def get_session():
+    """
+    Общая для всех импортов сессия: соединения с поставщиками переиспользуются
+    из пула, а сбои соединения и 5xx повторяются с нарастающей паузой
+    """
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=settings.FEED_RETRIES,
+            backoff_factor=settings.FEED_RETRY_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=settings.FEED_POOL_SIZE,
+            pool_maxsize=settings.FEED_POOL_SIZE,
+            max_retries=retry,
+        )
+        session = Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _session = session
+    return _session
+
+
+def get(url, **kwargs):
+    kwargs.setdefault(
+        "timeout", (settings.FEED_CONNECT_TIMEOUT, settings.FEED_READ_TIMEOUT)
+    )
+    return get_session().get(url, **kwargs)
+
+
+class FeedDownload:
+    """
+    Результат загрузки прайса: временный файл с содержимым и его валидаторы
+    """
+
+    def __init__(
+        self, file=None, etag="", last_modified="", content_hash="", not_modified=False
+    ):
+        self.file = file
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.not_modified = not_modified
+
+    def is_unchanged(self, shop):
+        if self.not_modified:
+            return True
+        return shop is not None and shop.feed_hash == self.content_hash
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def download_feed(data_url, shop=None):
+    """
+    Скачивает прайс во временный файл, считая хэш содержимого. Если передан
+    магазин, отправляет условный запрос по валидаторам его последнего прайса.
+    Таймаут чтения ограничивает только паузу между пакетами, поэтому общее
+    время загрузки ограничено отдельно: поставщик, отдающий прайс по байту,
+    не займёт поток импорта дольше FEED_DOWNLOAD_TIMEOUT
+    """
+    headers = {}
+    if shop is not None and shop.feed_url == data_url:
+        if shop.feed_etag:
+            headers["If-None-Match"] = shop.feed_etag
+        if shop.feed_last_modified:
+            headers["If-Modified-Since"] = shop.feed_last_modified
+
+    deadline = monotonic() + settings.FEED_DOWNLOAD_TIMEOUT
+    response = get(data_url, headers=headers, stream=True)
+    with response:
+        if response.status_code == 304:
+            return FeedDownload(not_modified=True)
+        response.raise_for_status()
+
+        max_size = settings.FEED_MAX_SIZE
+        if int(response.headers.get("Content-Length") or 0) > max_size:
+            raise FeedTooLargeError("Прайс превышает допустимый размер")
+
+        file = TemporaryFile()
+        content_hash = sha256()
+        size = 0
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_size:
+                file.close()
+                raise FeedTooLargeError("Прайс превышает допустимый размер")
+            if monotonic() > deadline:
+                file.close()
+                raise FeedTimeoutError("Превышено время загрузки прайса")
+            file.write(chunk)
+            content_hash.update(chunk)
+        file.seek(0)
+        return FeedDownload(
+            file,
+            etag=response.headers.get("ETag", ""),
+            last_modified=response.headers.get("Last-Modified", ""),
+            content_hash=content_hash.hexdigest(),
+        )
+
+
+def remember_feed(user, data_url, download, data_format="yaml"):
+    """
+    Сохраняет валидаторы успешно импортированного прайса в магазине
+    """
+    Shop.objects.filter(user_id=user.id).update(
+        feed_url=data_url,
+        feed_format=data_format,
+        feed_etag=download.etag,
+        feed_last_modified=download.last_modified,
+        feed_hash=download.content_hash,
+    )
+
+
+def import_shop_from_url(
+    user, data_url, data_format="yaml", diff=False, progress=None, force=False
+):
+    """
+    Загружает прайс по ссылке и потоково импортирует его, не держа в памяти
+    ни ответ целиком, ни разобранный документ. Если прайс не изменился с
+    прошлого импорта (и не указан force), импорт пропускается
+    """
+    profile = ImportProfile()
+    shop = None if force else Shop.objects.filter(user_id=user.id).first()
+    try:
+        with profile.stage("download"):
+            download = download_feed(data_url, shop)
+    except (FeedTooLargeError, FeedTimeoutError) as e:
+        return {"Status": False, "Error": str(e)}
+    except Exception:
+        return {"Status": False, "Error": "Возникла ошибка при запросе данных"}
+
+    with download:
+        if download.is_unchanged(shop):
+            return {"Status": True, "unchanged": True, "timings": profile.report()}
+
+        if data_format == "ndjson":
+            records = iter_ndjson_records(download.file)
+        else:
+            records = iter_yaml_records(download.file)
+        result = import_shop_records(
+            user,
+            timed_records(records, profile),
+            diff=diff,
+            progress=progress,
+            profile=profile,
+        )
+    if result["Status"]:
+        remember_feed(user, data_url, download, data_format)
+    result["unchanged"] = False
+    return result
@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from backend.db import write_transaction
+from backend.feeds import import_shop_from_url
+from backend.models import ImportJob, User
+
+##########################################
+# Фоновые задачи импорта прайсов
+#
+# partner/update/ с background=true только ставит задачу в очередь (таблица
+# ImportJob), а выполняет её отдельный процесс: python manage.py run_import_worker
+
+
+def enqueue_import(
+    user, url, data_format="yaml", diff=False, with_report=False, force=False
+):
+    return ImportJob.objects.create(
+        user=user,
+        url=url,
+        format=data_format,
+        diff=diff,
+        with_report=with_report,
+        force=force,
+    )
+
+
+def _finish_job(job, result):
+    job.state = "done" if result["Status"] else "failed"
+    job.error = result.get("Error", "")
+    job.result = {
+        key: result[key] for key in ("unchanged", "summary", "timings") if key in result
+    }
+    if job.with_report and result["Status"]:
+        job.report = {
+            key: result[key]
+            for key in ("actual_categories_id", "actual_products_id")
+            if key in result
+        }
+    job.finished_at = timezone.now()
+
+
+def record_import(user, url, data_format, diff, result):
+    """
+    Сохраняет выполненный в запросе импорт, чтобы его подробный отчёт
+    можно было получить отдельным запросом
+    """
+    job = ImportJob(
+        user=user,
+        url=url,
+        format=data_format,
+        diff=diff,
+        with_report=True,
+        processed=result.get("summary", {}).get("goods", 0),
+        started_at=timezone.now(),
+    )
+    _finish_job(job, result)
+    job.save()
+    return job
+
+
+def fail_stale_jobs():
+    """
+    Завершает с ошибкой задачи, которые выполняются дольше IMPORT_JOB_TIMEOUT:
+    их воркер, скорее всего, остановился, а без этого задачи магазина навсегда
+    остались бы ждать в очереди. Возвращает число таких задач
+    """
+    now = timezone.now()
+    return ImportJob.objects.filter(
+        state="running",
+        started_at__lt=now - timedelta(seconds=settings.IMPORT_JOB_TIMEOUT),
+    ).update(
+        state="failed",
+        error="Задача не завершилась за отведённое время",
+        finished_at=now,
+    )
+
+
+def claim_next_job():
+    """
+    Забирает из очереди самую старую задачу. Задачи магазина, прайс которого
+    уже импортируется, ждут своей очереди. Проверка и захват идут в одной
+    транзакции под блокировкой пользователя (в SQLite write_transaction
+    сразу блокирует запись), поэтому несколько воркеров не возьмут одну и ту
+    же задачу или две задачи одного магазина
+    """
+    fail_stale_jobs()
+    while True:
+        busy_users = ImportJob.objects.filter(state="running").values("user_id")
+        job = (
+            ImportJob.objects.filter(state="new")
+            .exclude(user_id__in=busy_users)
+            .order_by("id")
+            .first()
+        )
+        if job is None:
+            return None
+        with write_transaction():
+            User.objects.select_for_update().filter(id=job.user_id).first()
+            is_claimed = (
+                not ImportJob.objects.filter(
+                    user_id=job.user_id, state="running"
+                ).exists()
+                and ImportJob.objects.filter(id=job.id, state="new").update(
+                    state="running", started_at=timezone.now()
+                )
+            )
+        if is_claimed:
+            job.refresh_from_db()
+            return job
+
+
+def run_import_job(job):
+    def progress(processed):
+        ImportJob.objects.filter(id=job.id).update(processed=processed)
+
+    try:
+        result = import_shop_from_url(
+            job.user,
+            job.url,
+            job.format,
+            diff=job.diff,
+            progress=progress,
+            force=job.force,
+        )
+    except Exception as e:
+        result = {"Status": False, "Error": str(e)}
+
+    job.refresh_from_db(fields=["processed"])
+    _finish_job(job, result)
+    # задачу, которую fail_stale_jobs уже сочла зависшей, не переписываем
+    is_finished = ImportJob.objects.filter(id=job.id, state="running").update(
+        state=job.state,
+        error=job.error,
+        result=job.result,
+        report=job.report,
+        finished_at=job.finished_at,
+    )
+    if not is_finished:
+        job.refresh_from_db()
+    return job
+
+
+def run_import_jobs(workers):
+    """
+    Выполняет задачи из очереди в workers потоках, пока очередь не опустеет.
+    Загрузка и разбор прайсов разных магазинов идут параллельно, а запись
+    прайса одного магазина - всегда в одном потоке
+    """
+
+    def worker():
+        finished = []
+        try:
+            while True:
+                job = claim_next_job()
+                if job is None:
+                    return finished
+                finished.append(run_import_job(job))
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(worker) for _ in range(workers)]
+    return [job for future in futures for job in future.result()]
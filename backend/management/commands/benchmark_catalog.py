@@ -0,0 +1,116 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from backend.models import CatalogEntry, ProductInfo, ProductParameter, User
+from backend.serializers import (
+    ProductInfoSerializer,
+    catalog_entry_columns,
+    import_shop,
+    serialize_catalog_entries,
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+def synthetic_shop(goods, parameters):
+    return {
+        "shop": "Тестовый магазин для замера",
+        "categories": [{"id": 1, "name": "Замер"}],
+        "goods": [
+            {
+                "id": i,
+                "category": 1,
+                "model": f"bench/model-{i}",
+                "name": f"Товар для замера {i}",
+                "price": 1000 + i,
+                "price_rrc": 1100 + i,
+                "quantity": i % 10,
+                "parameters": {
+                    f"Параметр {j}": f"значение {i % (j + 2)}"
+                    for j in range(parameters)
+                },
+            }
+            for i in range(goods)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает время ответа каталога через ProductInfoSerializer и через "
+        "денормализованный каталог на сгенерированном прайсе (данные создаются "
+        "в транзакции и откатываются)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, default=1000, help="Позиций на странице"
+        )
+        parser.add_argument(
+            "--parameters", type=int, default=5, help="Параметров у позиции"
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Число повторов")
+
+    def _time(self, build, repeat):
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            body = JSONRenderer().render(build())
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, body
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    email="benchmark@benchmark.local", type="shop"
+                )
+                data = synthetic_shop(rows, options["parameters"])
+                result = import_shop(user, data)
+                if not result["Status"]:
+                    raise RuntimeError(result["Error"])
+                product_infos = ProductInfo.objects.filter(
+                    shop__user=user
+                ).order_by("id")
+
+                def serializer():
+                    queryset = product_infos.select_related(
+                        "product__category"
+                    ).prefetch_related(
+                        Prefetch(
+                            "product_parameters",
+                            queryset=ProductParameter.objects.select_related(
+                                "parameter"
+                            ).order_by("id"),
+                        )
+                    )
+                    return ProductInfoSerializer(queryset, many=True).data
+
+                def catalog():
+                    values = (
+                        CatalogEntry.objects.filter(shop__user=user)
+                        .order_by("id")
+                        .values(*catalog_entry_columns())
+                    )
+                    return serialize_catalog_entries(list(values))
+
+                serializer_time, serializer_body = self._time(serializer, repeat)
+                catalog_time, catalog_body = self._time(catalog, repeat)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f"Позиций: {rows}, лучшее из {repeat}")
+        self.stdout.write(f"ProductInfoSerializer: {serializer_time * 1000:.1f} мс")
+        self.stdout.write(f"CatalogEntry: {catalog_time * 1000:.1f} мс")
+        self.stdout.write(f"Ускорение: {serializer_time / catalog_time:.1f}x")
+        same = serializer_body == catalog_body
+        self.stdout.write("Ответы совпадают" if same else "Ответы различаются!")
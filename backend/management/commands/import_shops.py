@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from backend.jobs import enqueue_import, run_import_jobs
+from backend.models import Shop
+
+
+class Command(BaseCommand):
+    help = (
+        "Ставит в очередь импорт прайсов магазинов по их последним ссылкам "
+        "и выполняет очередь в несколько потоков"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "shop_ids", nargs="*", type=int, help="id магазинов (по умолчанию все)"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=4, help="Число параллельных импортов"
+        )
+        parser.add_argument(
+            "--diff", action="store_true", help="Дифференциальный импорт"
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Импортировать даже не изменившиеся прайсы",
+        )
+        parser.add_argument(
+            "--enqueue-only",
+            action="store_true",
+            help="Только поставить задачи в очередь для run_import_worker",
+        )
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.exclude(feed_url="").exclude(user=None).select_related(
+            "user"
+        )
+        if options["shop_ids"]:
+            shops = shops.filter(id__in=options["shop_ids"])
+
+        for shop in shops:
+            enqueue_import(
+                shop.user,
+                shop.feed_url,
+                shop.feed_format,
+                diff=options["diff"],
+                force=options["force"],
+            )
+        if options["enqueue_only"]:
+            return
+
+        for job in run_import_jobs(options["workers"]):
+            self.stdout.write(f"Задача импорта {job.id}: {job.state} {job.error}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from backend.search import rebuild_index, search_supported
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс товаров всех магазинов"
+
+    def handle(self, *args, **options):
+        if not search_supported():
+            self.stdout.write("СУБД не поддерживает полнотекстовый индекс")
+            return
+        with transaction.atomic():
+            rows = rebuild_index()
+        self.stdout.write(f"Проиндексировано позиций: {rows}")
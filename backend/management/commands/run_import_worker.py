@@ -0,0 +1,34 @@
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from backend.jobs import claim_next_job, run_import_job
+
+
+class Command(BaseCommand):
+    help = "Выполняет фоновые задачи импорта прайсов из очереди ImportJob"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Выполнить задачи, которые уже в очереди, и завершиться",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=2.0,
+            help="Пауза в секундах между проверками пустой очереди",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    return
+                sleep(options["sleep"])
+                continue
+
+            job = run_import_job(job)
+            self.stdout.write(f"Задача импорта {job.id}: {job.state} {job.error}")
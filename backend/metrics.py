@@ -0,0 +1,380 @@
+import atexit
+import json
+import os
+from bisect import bisect_left
+from itertools import accumulate
+from pathlib import Path
+from threading import Lock
+from time import monotonic, time_ns
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+##########################################
+# Метрики сервиса в текстовом формате Prometheus
+#
+# Счётчики и гистограммы живут в памяти процесса. Если задан METRICS_DIR, каждый
+# процесс (воркеры веб-сервера, run_import_worker, import_shops) не чаще раза в
+# METRICS_FLUSH_INTERVAL секунд и при завершении записывает свои значения в
+# отдельный файл этого каталога, а /metrics складывает файлы всех процессов.
+# Значения завершившихся процессов остаются в сумме, поэтому счётчики не
+# убывают при перезапуске воркеров: /metrics переносит файлы процессов, которых
+# уже нет, в общий aggregate.json и удаляет их, так что каталог не растёт с
+# каждым перезапуском. Живость процесса проверяется по pid, поэтому каталог не
+# должен быть общим для нескольких машин или контейнеров. Без fcntl (Windows)
+# файлы не объединяются, и старые файлы нужно удалять вручную, пока сервис
+# остановлен.
+
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+IMPORT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+AGGREGATE_FILE = "aggregate.json"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # последний счётчик - значения больше всех границ
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def report(self):
+        """
+        Накопительные счётчики "не больше границы", сумма и число значений
+        """
+        cumulative = accumulate(self.counts)
+        buckets = {str(bound): count for bound, count in zip(self.buckets, cumulative)}
+        buckets["+Inf"] = self.count
+        return {"buckets": buckets, "sum": round(self.sum, 6), "count": self.count}
+
+
+_lock = Lock()
+_metrics = {}
+_process = {"pid": None, "path": None, "flushed": 0.0}
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _metrics[name] = self
+
+    def _labels(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._labels(labels)
+        with _lock:
+            _check_process()
+            self.values[key] = self.values.get(key, 0) + amount
+        _maybe_flush()
+
+    def dump(self, values):
+        return [[list(key), value] for key, value in values.items()]
+
+    def merge(self, values, rows):
+        for key, value in rows:
+            key = tuple(key)
+            values[key] = values.get(key, 0) + value
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class HistogramMetric(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._labels(labels)
+        with _lock:
+            _check_process()
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram(self.buckets)
+            histogram.observe(value)
+        _maybe_flush()
+
+    def dump(self, values):
+        return [
+            [list(key), [histogram.counts, histogram.sum, histogram.count]]
+            for key, histogram in values.items()
+        ]
+
+    def merge(self, values, rows):
+        for key, (counts, sum_, count) in rows:
+            key = tuple(key)
+            histogram = values.get(key)
+            if histogram is None:
+                histogram = values[key] = Histogram(self.buckets)
+            histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+            histogram.sum += sum_
+            histogram.count += count
+
+    def samples(self, values):
+        for key, histogram in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            report = histogram.report()
+            for bound, count in report["buckets"].items():
+                yield f"{self.name}_bucket", dict(labels, le=bound), count
+            yield f"{self.name}_sum", labels, report["sum"]
+            yield f"{self.name}_count", labels, report["count"]
+
+
+HTTP_REQUESTS = Counter(
+    "goods_http_requests_total",
+    "Запросы к API по маршруту, методу и коду ответа",
+    ("view", "method", "status"),
+)
+HTTP_REQUEST_DURATION = HistogramMetric(
+    "goods_http_request_duration_seconds",
+    "Время обработки запроса к API",
+    ("view",),
+)
+HTTP_REQUEST_QUERIES = HistogramMetric(
+    "goods_http_request_db_queries",
+    "Число SQL-запросов на запрос к API",
+    ("view",),
+    QUERY_BUCKETS,
+)
+IMPORTS = Counter("goods_imports_total", "Импорты прайсов по результату", ("status",))
+IMPORTED_GOODS = Counter("goods_imported_goods_total", "Товары успешных импортов")
+IMPORT_DURATION = HistogramMetric(
+    "goods_import_duration_seconds",
+    "Время импорта прайса по этапам, total - весь импорт",
+    ("stage",),
+    IMPORT_BUCKETS,
+)
+EMAILS_SENT = Counter("goods_emails_sent_total", "Отправленные письма", ("kind",))
+SIGNAL_HANDLER_CALLS = Counter(
+    "goods_signal_handler_calls_total", "Вызовы обработчиков сигналов", ("handler",)
+)
+
+
+def _check_process():
+    # после fork дочерний процесс не должен повторно учитывать значения родителя
+    pid = os.getpid()
+    if _process["pid"] != pid:
+        if _process["pid"] is not None:
+            for metric in _metrics.values():
+                metric.values.clear()
+        _process.update(pid=pid, path=None, flushed=monotonic())
+
+
+def _metrics_dir():
+    return Path(settings.METRICS_DIR) if settings.METRICS_DIR else None
+
+
+def flush_metrics():
+    """
+    Записывает значения процесса в его файл в METRICS_DIR
+    """
+    directory = _metrics_dir()
+    if directory is None:
+        return
+    with _lock:
+        if _process["pid"] != os.getpid():
+            # процесс ещё ничего не записал
+            return
+        if _process["path"] is None:
+            _process["path"] = directory / f"{_process['pid']}-{time_ns()}.json"
+        data = {name: metric.dump(metric.values) for name, metric in _metrics.items()}
+        _process["flushed"] = monotonic()
+        directory.mkdir(parents=True, exist_ok=True)
+        # файл заменяется целиком, чтобы /metrics не прочитал его наполовину
+        tmp = _process["path"].with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, _process["path"])
+
+
+def _maybe_flush():
+    if (
+        settings.METRICS_DIR
+        and monotonic() - _process["flushed"] >= settings.METRICS_FLUSH_INTERVAL
+    ):
+        flush_metrics()
+
+
+atexit.register(flush_metrics)
+
+
+def collect_metrics():
+    """
+    Значения метрик: {имя: {метки: значение}}, из всех процессов, если задан
+    METRICS_DIR, иначе только текущего
+    """
+    directory = _metrics_dir()
+    if directory is None:
+        with _lock:
+            return {
+                name: {key: value for key, value in metric.values.items()}
+                for name, metric in _metrics.items()
+            }
+
+    flush_metrics()
+    if fcntl is None:
+        return _read_metrics(directory)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    # объединение и чтение под одной блокировкой: иначе /metrics другого
+    # процесса может прочитать aggregate.json до переноса файла, а каталог
+    # после удаления, и счётчики на время "уменьшатся"
+    with open(directory / ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        _aggregate_finished(directory)
+        return _read_metrics(directory)
+
+
+def _read_json(path):
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(values, data):
+    for name, rows in data.items():
+        if name in _metrics:
+            _metrics[name].merge(values[name], rows)
+
+
+def _process_files(directory):
+    """
+    Файлы процессов {путь: pid}, без aggregate.json
+    """
+    files = {}
+    for path in sorted(directory.glob("*-*.json")):
+        pid = path.name.split("-", 1)[0]
+        if pid.isdecimal():
+            files[path] = int(pid)
+    return files
+
+
+def _read_aggregate(directory):
+    aggregate = _read_json(directory / AGGREGATE_FILE) or {}
+    return set(aggregate.get("merged", [])), aggregate.get("metrics", {})
+
+
+def _read_metrics(directory):
+    values = {name: {} for name in _metrics}
+    merged, aggregate = _read_aggregate(directory)
+    _merge(values, aggregate)
+    for path in _process_files(directory):
+        # файл, уже перенесённый в aggregate.json, но не удалённый из-за сбоя
+        if path.name in merged:
+            continue
+        data = _read_json(path)
+        if data is not None:
+            _merge(values, data)
+    return values
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # процесс есть, но принадлежит другому пользователю
+        return True
+    return True
+
+
+def _aggregate_finished(directory):
+    """
+    Переносит значения завершившихся процессов в aggregate.json и удаляет их
+    файлы. Перенесённые файлы перечислены в aggregate.json, так что при сбое
+    между записью и удалением они не учитываются дважды
+    """
+    merged, aggregate = _read_aggregate(directory)
+    files = _process_files(directory)
+    # файлы, перенесённые в прошлый раз
+    for path in files:
+        if path.name in merged:
+            path.unlink(missing_ok=True)
+    finished = [
+        path
+        for path, pid in files.items()
+        if path.name not in merged and pid != os.getpid() and not _pid_alive(pid)
+    ]
+    if not finished:
+        return
+
+    values = {name: {} for name in _metrics}
+    _merge(values, aggregate)
+    for path in finished:
+        data = _read_json(path)
+        if data is not None:
+            _merge(values, data)
+    metrics = {name: metric.dump(values[name]) for name, metric in _metrics.items()}
+    data = {"merged": [path.name for path in finished], "metrics": metrics}
+    tmp = directory / f"{AGGREGATE_FILE}.tmp"
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, directory / AGGREGATE_FILE)
+    for path in finished:
+        path.unlink(missing_ok=True)
+
+
+def _escape_help(value):
+    return value.replace("\\", r"\\").replace("\n", r"\n")
+
+
+def _escape(value):
+    # в значениях меток экранируются ещё и кавычки, в HELP они остаются как есть
+    return _escape_help(value).replace('"', r"\"")
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def render_metrics():
+    """
+    Метрики в текстовом формате Prometheus (version 0.0.4)
+    """
+    values = collect_metrics()
+    lines = []
+    for name, metric in _metrics.items():
+        lines.append(f"# HELP {name} {_escape_help(metric.documentation)}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for sample, labels, value in metric.samples(values[name]):
+            if labels:
+                labels = ",".join(
+                    f'{label}="{_escape(str(label_value))}"'
+                    for label, label_value in labels.items()
+                )
+                sample = f"{sample}{{{labels}}}"
+            lines.append(f"{sample} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    with _lock:
+        for metric in _metrics.values():
+            metric.values.clear()
+        _process["path"] = None
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0011_confirmemailtoken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='state',
+            field=models.CharField(choices=[('basket', 'Статус корзины'), ('processing', 'В обработке'), ('new', 'Новый'), ('confirmed', 'Подтвержден'), ('assembled', 'Собран'), ('sent', 'Отправлен'), ('delivered', 'Доставлен'), ('canceled', 'Отменен')], max_length=15, verbose_name='Статус'),
+        ),
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=500, verbose_name='Ссылка на прайс')),
+                ('format', models.CharField(choices=[('yaml', 'YAML'), ('ndjson', 'JSON Lines')], default='yaml', max_length=10, verbose_name='Формат прайса')),
+                ('diff', models.BooleanField(default=False, verbose_name='Дифференциальный импорт')),
+                ('state', models.CharField(choices=[('new', 'В очереди'), ('running', 'Выполняется'), ('done', 'Выполнен'), ('failed', 'Ошибка')], default='new', max_length=10, verbose_name='Статус')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Обработано товаров')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта',
+                'verbose_name_plural': 'Список задач импорта',
+                'ordering': ('-created_at',),
+                'indexes': [models.Index(fields=['state', 'id'], name='import_job_state_idx')],
+            },
+        ),
+    ]
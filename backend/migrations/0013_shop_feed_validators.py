@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0012_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='feed_etag',
+            field=models.CharField(blank=True, max_length=200, verbose_name='ETag прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_hash',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256 прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_last_modified',
+            field=models.CharField(blank=True, max_length=50, verbose_name='Last-Modified прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_url',
+            field=models.URLField(blank=True, max_length=500, verbose_name='Ссылка на последний прайс'),
+        ),
+    ]
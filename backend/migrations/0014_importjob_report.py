@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0013_shop_feed_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='report',
+            field=models.JSONField(blank=True, null=True, verbose_name='Подробный отчёт'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='with_report',
+            field=models.BooleanField(default=False, verbose_name='Сохранять подробный отчёт'),
+        ),
+    ]
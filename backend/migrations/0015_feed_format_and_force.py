@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0014_importjob_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='force',
+            field=models.BooleanField(default=False, verbose_name='Импортировать без проверки изменений'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='feed_format',
+            field=models.CharField(default='yaml', max_length=10, verbose_name='Формат прайса'),
+        ),
+    ]
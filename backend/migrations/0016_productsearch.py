@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:58
+
+from django.db import migrations
+
+# Поисковый индекс товаров (см. backend/search.py) зависит от СУБД, поэтому
+# создаётся SQL-запросами, а не моделью.
+SEARCH_INDEX_SQL = {
+    'sqlite': (
+        [
+            "CREATE VIRTUAL TABLE backend_productsearch USING fts5("
+            "shop_id UNINDEXED, name, model, parameters, "
+            "tokenize = 'unicode61 remove_diacritics 2')",
+        ],
+        ["DROP TABLE backend_productsearch"],
+    ),
+    'postgresql': (
+        [
+            "CREATE TABLE backend_productsearch ("
+            "product_info_id integer PRIMARY KEY "
+            "REFERENCES backend_productinfo (id) ON DELETE CASCADE "
+            "DEFERRABLE INITIALLY DEFERRED, "
+            "shop_id integer NOT NULL, "
+            "document tsvector NOT NULL)",
+            "CREATE INDEX backend_productsearch_document_idx "
+            "ON backend_productsearch USING GIN (document)",
+            "CREATE INDEX backend_productsearch_shop_idx "
+            "ON backend_productsearch (shop_id)",
+        ],
+        ["DROP TABLE backend_productsearch"],
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    create, _ = SEARCH_INDEX_SQL.get(schema_editor.connection.vendor, ([], []))
+    for sql in create:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    _, drop = SEARCH_INDEX_SQL.get(schema_editor.connection.vendor, ([], []))
+    for sql in drop:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0015_feed_format_and_force'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
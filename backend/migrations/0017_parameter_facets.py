@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_facets(apps, schema_editor):
+    # счётчики для прайсов, импортированных до их появления
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    ParameterFacet = apps.get_model('backend', 'ParameterFacet')
+
+    counts = (
+        ProductParameter.objects.values(
+            'product_info__shop_id',
+            'product_info__product__category_id',
+            'parameter_id',
+            'value',
+        )
+        .annotate(count=models.Count('id'))
+        .order_by()
+    )
+    ParameterFacet.objects.bulk_create(
+        (
+            ParameterFacet(
+                shop_id=row['product_info__shop_id'],
+                category_id=row['product_info__product__category_id'],
+                parameter_id=row['parameter_id'],
+                value=row['value'],
+                count=row['count'],
+            )
+            for row in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0016_productsearch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('count', models.PositiveIntegerField(verbose_name='Количество позиций')),
+            ],
+            options={
+                'verbose_name': 'Значение фильтра',
+                'verbose_name_plural': 'Список значений фильтров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value'], name='product_parameter_value_idx'),
+        ),
+        migrations.AddField(
+            model_name='parameterfacet',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_facets', to='backend.category', verbose_name='Категория'),
+        ),
+        migrations.AddField(
+            model_name='parameterfacet',
+            name='parameter',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_facets', to='backend.parameter', verbose_name='Параметр'),
+        ),
+        migrations.AddField(
+            model_name='parameterfacet',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parameter_facets', to='backend.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddConstraint(
+            model_name='parameterfacet',
+            constraint=models.UniqueConstraint(fields=('shop', 'category', 'parameter', 'value'), name='unique_parameter_facet'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_catalog(apps, schema_editor):
+    # каталог для прайсов, импортированных до его появления
+    ProductInfo = apps.get_model('backend', 'ProductInfo')
+    ProductParameter = apps.get_model('backend', 'ProductParameter')
+    CatalogEntry = apps.get_model('backend', 'CatalogEntry')
+
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.order_by('id').values_list(
+        'product_info_id', 'parameter__name', 'value'
+    ):
+        parameters.setdefault(product_info_id, []).append(
+            {'parameter': name, 'value': value}
+        )
+
+    product_infos = ProductInfo.objects.select_related('shop', 'product__category')
+    CatalogEntry.objects.bulk_create(
+        (
+            CatalogEntry(
+                id_id=product_info.id,
+                shop_id=product_info.shop_id,
+                shop_name=product_info.shop.name,
+                shop_state=product_info.shop.state,
+                product_id=product_info.product_id,
+                product_name=product_info.product.name,
+                category_id=product_info.product.category_id,
+                category_name=product_info.product.category.name,
+                model=product_info.model,
+                quantity=product_info.quantity,
+                price=product_info.price,
+                price_rrc=product_info.price_rrc,
+                parameters=parameters.get(product_info.id, []),
+            )
+            for product_info in product_infos.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0017_parameter_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='catalog_dirty',
+            field=models.BooleanField(default=False, verbose_name='Каталог требует пересборки'),
+        ),
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('id', models.OneToOneField(db_column='id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='backend.productinfo', verbose_name='Позиция прайса')),
+                ('shop_name', models.CharField(max_length=50, verbose_name='Название магазина')),
+                ('shop_state', models.BooleanField(verbose_name='Магазин принимает заказы')),
+                ('product_id', models.PositiveIntegerField(verbose_name='id продукта')),
+                ('product_name', models.CharField(max_length=80, verbose_name='Название продукта')),
+                ('category_id', models.PositiveIntegerField(verbose_name='id категории')),
+                ('category_name', models.CharField(max_length=40, verbose_name='Категория')),
+                ('model', models.CharField(blank=True, max_length=80, verbose_name='Модель')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество')),
+                ('price', models.PositiveIntegerField(verbose_name='Цена')),
+                ('price_rrc', models.PositiveIntegerField(verbose_name='Рекомендуемая розничная цена')),
+                ('parameters', models.JSONField(default=list, verbose_name='Параметры')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_entries', to='backend.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Позиция каталога',
+                'verbose_name_plural': 'Каталог',
+                'indexes': [models.Index(fields=['shop_state', 'id'], name='catalog_state_idx'), models.Index(fields=['shop', 'id'], name='catalog_shop_idx'), models.Index(fields=['category_id', 'id'], name='catalog_category_idx'), models.Index(fields=['shop', 'price'], name='catalog_shop_price_idx'), models.Index(fields=['price', 'id'], name='catalog_price_idx'), models.Index(fields=['product_name', 'id'], name='catalog_name_idx')],
+            },
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
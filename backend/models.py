@@ -94,6 +94,23 @@ class Shop(models.Model):
     )
     state = models.BooleanField(verbose_name="статус получения заказов", default=True)
     # filename
+    # валидаторы последнего импортированного прайса для условной загрузки
+    feed_url = models.URLField(
+        verbose_name="Ссылка на последний прайс", max_length=500, blank=True
+    )
+    feed_etag = models.CharField(verbose_name="ETag прайса", max_length=200, blank=True)
+    feed_last_modified = models.CharField(
+        verbose_name="Last-Modified прайса", max_length=50, blank=True
+    )
+    feed_hash = models.CharField(verbose_name="SHA-256 прайса", max_length=64, blank=True)
+    feed_format = models.CharField(
+        verbose_name="Формат прайса", max_length=10, default="yaml"
+    )
+    # прайс сохранён, а поисковый индекс, фильтры и каталог ещё не
+    # перестроены по нему: следующий импорт перестроит их целиком
+    catalog_dirty = models.BooleanField(
+        verbose_name="Каталог требует пересборки", default=False
+    )
 
     class Meta:
         verbose_name = "Магазин"
@@ -205,6 +222,99 @@ class ProductParameter(models.Model):
                 fields=["product_info", "parameter"], name="unique_product_parameter"
             ),
         ]
+        indexes = [
+            # фильтр каталога по значениям параметров
+            models.Index(
+                fields=["parameter", "value"], name="product_parameter_value_idx"
+            ),
+        ]
+
+
+class ParameterFacet(models.Model):
+    """
+    Число позиций магазина в категории с данным значением параметра,
+    пересчитывается при импорте прайса
+    """
+
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="parameter_facets",
+        on_delete=models.CASCADE,
+    )
+    category = models.ForeignKey(
+        Category,
+        verbose_name="Категория",
+        related_name="parameter_facets",
+        on_delete=models.CASCADE,
+    )
+    parameter = models.ForeignKey(
+        Parameter,
+        verbose_name="Параметр",
+        related_name="parameter_facets",
+        on_delete=models.CASCADE,
+    )
+    value = models.CharField(verbose_name="Значение", max_length=100)
+    count = models.PositiveIntegerField(verbose_name="Количество позиций")
+
+    class Meta:
+        verbose_name = "Значение фильтра"
+        verbose_name_plural = "Список значений фильтров"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["shop", "category", "parameter", "value"],
+                name="unique_parameter_facet",
+            ),
+        ]
+
+
+class CatalogEntry(models.Model):
+    """
+    Позиция каталога одной строкой: данные позиции прайса, магазина, товара,
+    категории и параметров. Строки магазина пересобираются при импорте прайса,
+    список товаров читается только из этой таблицы
+    """
+
+    # id позиции прайса (ProductInfo): строка удаляется вместе с позицией, в том
+    # числе при удалении её товара, категории или магазина
+    id = models.OneToOneField(
+        ProductInfo,
+        verbose_name="Позиция прайса",
+        related_name="catalog_entry",
+        primary_key=True,
+        db_column="id",
+        on_delete=models.CASCADE,
+    )
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="catalog_entries",
+        on_delete=models.CASCADE,
+    )
+    shop_name = models.CharField(max_length=50, verbose_name="Название магазина")
+    shop_state = models.BooleanField(verbose_name="Магазин принимает заказы")
+    product_id = models.PositiveIntegerField(verbose_name="id продукта")
+    product_name = models.CharField(max_length=80, verbose_name="Название продукта")
+    category_id = models.PositiveIntegerField(verbose_name="id категории")
+    category_name = models.CharField(max_length=40, verbose_name="Категория")
+    model = models.CharField(max_length=80, verbose_name="Модель", blank=True)
+    quantity = models.PositiveIntegerField(verbose_name="Количество")
+    price = models.PositiveIntegerField(verbose_name="Цена")
+    price_rrc = models.PositiveIntegerField(verbose_name="Рекомендуемая розничная цена")
+    parameters = models.JSONField(verbose_name="Параметры", default=list)
+
+    class Meta:
+        verbose_name = "Позиция каталога"
+        verbose_name_plural = "Каталог"
+        indexes = [
+            # списки товаров включённых магазинов в порядке выдачи
+            models.Index(fields=["shop_state", "id"], name="catalog_state_idx"),
+            models.Index(fields=["shop", "id"], name="catalog_shop_idx"),
+            models.Index(fields=["category_id", "id"], name="catalog_category_idx"),
+            models.Index(fields=["shop", "price"], name="catalog_shop_price_idx"),
+            models.Index(fields=["price", "id"], name="catalog_price_idx"),
+            models.Index(fields=["product_name", "id"], name="catalog_name_idx"),
+        ]
 
 
 class Contact(models.Model):
@@ -328,3 +438,66 @@ class ConfirmEmailToken(models.Model):
 
     def __str__(self):
         return "Confirmation registration token for user {user}".format(user=self.user)
+
+
+IMPORT_JOB_STATE_CHOICES = (
+    ("new", "В очереди"),
+    ("running", "Выполняется"),
+    ("done", "Выполнен"),
+    ("failed", "Ошибка"),
+)
+
+IMPORT_FORMAT_CHOICES = (
+    ("yaml", "YAML"),
+    ("ndjson", "JSON Lines"),
+)
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(
+        User,
+        verbose_name="Пользователь",
+        related_name="import_jobs",
+        on_delete=models.CASCADE,
+    )
+    # как у Shop.feed_url, чтобы поставить в очередь любой сохранённый прайс
+    url = models.URLField(verbose_name="Ссылка на прайс", max_length=500)
+    format = models.CharField(
+        verbose_name="Формат прайса",
+        choices=IMPORT_FORMAT_CHOICES,
+        max_length=10,
+        default="yaml",
+    )
+    diff = models.BooleanField(verbose_name="Дифференциальный импорт", default=False)
+    force = models.BooleanField(
+        verbose_name="Импортировать без проверки изменений", default=False
+    )
+    state = models.CharField(
+        verbose_name="Статус",
+        choices=IMPORT_JOB_STATE_CHOICES,
+        max_length=10,
+        default="new",
+    )
+    processed = models.PositiveIntegerField(
+        verbose_name="Обработано товаров", default=0
+    )
+    result = models.JSONField(verbose_name="Результат", null=True, blank=True)
+    with_report = models.BooleanField(
+        verbose_name="Сохранять подробный отчёт", default=False
+    )
+    report = models.JSONField(verbose_name="Подробный отчёт", null=True, blank=True)
+    error = models.TextField(verbose_name="Ошибка", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Задача импорта"
+        verbose_name_plural = "Список задач импорта"
+        ordering = ("-created_at",)
+        indexes = [
+            models.Index(fields=["state", "id"], name="import_job_state_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.url} ({self.state})"
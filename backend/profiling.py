@@ -0,0 +1,130 @@
+import logging
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connection
+
+from backend.metrics import HTTP_REQUEST_DURATION, HTTP_REQUEST_QUERIES, HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+##########################################
+# Профилирование импорта прайсов
+#
+# По каждому этапу (download, parse, categories, products, parameters,
+# product_infos, search_index, facets, catalog) собирается время, число
+# SQL-запросов и число записанных строк.
+# Этапы не вкладываются друг в друга, поэтому их время можно складывать.
+
+
+class ImportProfile:
+    def __init__(self):
+        self.stages = {}
+        self._current = []
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {"time": 0.0, "queries": 0, "rows": 0})
+
+    @contextmanager
+    def stage(self, name):
+        stage = self._stage(name)
+        self._current.append(name)
+        start = perf_counter()
+        try:
+            yield stage
+        finally:
+            stage["time"] += perf_counter() - start
+            self._current.pop()
+
+    def add_rows(self, name, rows):
+        self._stage(name)["rows"] += rows
+
+    def _count_query(self, execute, sql, params, many, context):
+        if self._current:
+            self._stage(self._current[-1])["queries"] += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def capture_queries(self):
+        """
+        Считает запросы, выполненные текущим потоком внутри этапов
+        """
+        with connection.execute_wrapper(self._count_query):
+            yield self
+
+    def report(self):
+        return {
+            name: dict(stage, time=round(stage["time"], 3))
+            for name, stage in self.stages.items()
+        }
+
+
+##########################################
+# Профилирование запросов к API
+#
+# RequestProfileMiddleware считает для каждого запроса число SQL-запросов,
+# время в БД и общее время обработки. В режиме DEBUG они отдаются в заголовках
+# ответа, а по имени маршрута копятся метрики HTTP-запросов (backend.metrics).
+# Запросы сверх бюджета (REQUEST_QUERY_BUDGET, REQUEST_TIME_BUDGET) пишутся в лог.
+# Для потоковых ответов время учитывается до начала отдачи тела.
+
+
+class RequestProfile:
+    def __init__(self, url_name=None):
+        self.url_name = url_name
+        self.queries = 0
+        self.db_time = 0.0
+        self.time = 0.0
+
+    def _count_query(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += perf_counter() - start
+
+
+class RequestProfileMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        start = perf_counter()
+        with connection.execute_wrapper(profile._count_query):
+            response = self.get_response(request)
+        profile.time = perf_counter() - start
+
+        # запросы, не попавшие ни в один маршрут, не копим: их имена не ограничены
+        if request.resolver_match is not None:
+            profile.url_name = request.resolver_match.view_name
+            HTTP_REQUESTS.inc(
+                view=profile.url_name,
+                method=request.method,
+                status=response.status_code,
+            )
+            HTTP_REQUEST_DURATION.observe(profile.time, view=profile.url_name)
+            HTTP_REQUEST_QUERIES.observe(profile.queries, view=profile.url_name)
+            if (
+                profile.queries > settings.REQUEST_QUERY_BUDGET
+                or profile.time > settings.REQUEST_TIME_BUDGET
+            ):
+                logger.warning(
+                    "Запрос %s %s превысил бюджет: %s SQL-запросов, БД %.3f с, "
+                    "всего %.3f с",
+                    request.method,
+                    profile.url_name,
+                    profile.queries,
+                    profile.db_time,
+                    profile.time,
+                )
+
+        if settings.DEBUG:
+            response["X-DB-Queries"] = str(profile.queries)
+            response["Server-Timing"] = (
+                f"db;dur={profile.db_time * 1000:.1f}, "
+                f"total;dur={profile.time * 1000:.1f}"
+            )
+        return response
@@ -0,0 +1,194 @@
+import re
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Q
+
+from backend.catalog import iter_id_batches
+from backend.models import ProductInfo, ProductParameter, Shop
+
+##########################################
+# Полнотекстовый поиск по товарам
+#
+# Название товара, модель и значения параметров каждой позиции прайса лежат в
+# отдельном индексе: виртуальной таблице FTS5 в SQLite или столбце tsvector с
+# GIN-индексом в PostgreSQL (таблица создаётся миграцией 0016). Индекс магазина
+# перестраивается при каждом импорте прайса. На остальных СУБД поиск работает
+# через LIKE без ранжирования.
+
+SEARCH_TABLE = "backend_productsearch"
+SEARCH_INDEX_BATCH_SIZE = 1000
+
+_SQL = {
+    "sqlite": {
+        "delete": f"DELETE FROM {SEARCH_TABLE} WHERE shop_id = %s",
+        "delete_row": f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+        "insert": (
+            f"INSERT INTO {SEARCH_TABLE} (rowid, shop_id, name, model, parameters) "
+            "VALUES (%s, %s, %s, %s, %s)"
+        ),
+        # bm25 тем меньше, чем лучше совпадение; совпадение в названии и
+        # модели весит больше, чем в параметрах
+        "search": (
+            f"SELECT {SEARCH_TABLE}.rowid AS id, "
+            f"bm25({SEARCH_TABLE}, 0, 2.0, 2.0, 1.0) AS score "
+            f"FROM {SEARCH_TABLE} "
+            "JOIN backend_productinfo "
+            f"ON backend_productinfo.id = {SEARCH_TABLE}.rowid "
+            "JOIN backend_shop ON backend_shop.id = backend_productinfo.shop_id "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND backend_shop.state"
+        ),
+        "shop": f" AND {SEARCH_TABLE}.shop_id = %s",
+    },
+    "postgresql": {
+        "delete": f"DELETE FROM {SEARCH_TABLE} WHERE shop_id = %s",
+        "delete_row": f"DELETE FROM {SEARCH_TABLE} WHERE product_info_id = %s",
+        "insert": (
+            f"INSERT INTO {SEARCH_TABLE} (product_info_id, shop_id, document) "
+            "VALUES (%s, %s, "
+            "setweight(to_tsvector('simple', %s), 'A') || "
+            "setweight(to_tsvector('simple', %s), 'A') || "
+            "setweight(to_tsvector('simple', %s), 'B'))"
+        ),
+        "search": (
+            f"SELECT {SEARCH_TABLE}.product_info_id AS id, "
+            f"-ts_rank({SEARCH_TABLE}.document, to_tsquery('simple', %s)) AS score "
+            f"FROM {SEARCH_TABLE} "
+            "JOIN backend_productinfo "
+            f"ON backend_productinfo.id = {SEARCH_TABLE}.product_info_id "
+            "JOIN backend_shop ON backend_shop.id = backend_productinfo.shop_id "
+            f"WHERE {SEARCH_TABLE}.document @@ to_tsquery('simple', %s) "
+            "AND backend_shop.state"
+        ),
+        "shop": f" AND {SEARCH_TABLE}.shop_id = %s",
+    },
+}
+
+
+def search_supported(vendor=None):
+    return (vendor or connection.vendor) in _SQL
+
+
+def search_terms(query):
+    """
+    Слова поискового запроса без операторов языка запросов СУБД
+    """
+    return re.findall(r"\w+", query.lower())
+
+
+def _match_expression(terms, vendor):
+    # каждое слово ищется как префикс, все слова обязательны
+    if vendor == "sqlite":
+        return " ".join(f'"{term}"*' for term in terms)
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def _search_rows(shop_id, product_infos_id=None):
+    """
+    Строки индекса магазина (или только позиций product_infos_id) пачками:
+    (id позиции, магазин, название, модель, значения параметров через пробел)
+    """
+    product_infos = (
+        ProductInfo.objects.filter(shop_id=shop_id)
+        .order_by("id")
+        .values_list("id", "product__name", "model")
+    )
+    for batch in iter_id_batches(
+        product_infos, product_infos_id, SEARCH_INDEX_BATCH_SIZE
+    ):
+        parameters = defaultdict(list)
+        for product_info_id, value in ProductParameter.objects.filter(
+            product_info_id__in=[row[0] for row in batch]
+        ).values_list("product_info_id", "value"):
+            parameters[product_info_id].append(value)
+
+        yield [
+            (id_, shop_id, name, model, " ".join(parameters[id_]))
+            for id_, name, model in batch
+        ]
+
+
+def index_shop(shop_id, product_infos_id=None, deleted_id=()):
+    """
+    Перестраивает поисковый индекс позиций магазина, возвращает число строк.
+    Если указаны product_infos_id и deleted_id, переписываются только строки
+    этих позиций (удалённые из прайса просто убираются из индекса)
+    """
+    sql = _SQL.get(connection.vendor)
+    if sql is None:
+        return 0
+    rows = 0
+    with connection.cursor() as cursor:
+        if product_infos_id is None:
+            cursor.execute(sql["delete"], [shop_id])
+        else:
+            cursor.executemany(
+                sql["delete_row"],
+                [[id_] for id_ in set(product_infos_id) | set(deleted_id)],
+            )
+        for batch in _search_rows(shop_id, product_infos_id):
+            cursor.executemany(sql["insert"], batch)
+            rows += len(batch)
+    return rows
+
+
+def rebuild_index():
+    """
+    Перестраивает поисковый индекс всех магазинов
+    """
+    shops_id = Shop.objects.values_list("id", flat=True)
+    return sum(index_shop(shop_id) for shop_id in shops_id)
+
+
+def search_product_infos(query, limit, after=None, shop_id=None):
+    """
+    Находит позиции включённых магазинов по запросу, лучшие совпадения первыми.
+    Возвращает не более limit пар (id позиции, ранг), следующих за парой after
+    """
+    terms = search_terms(query)
+    if not terms:
+        raise ValueError("Пустой поисковый запрос")
+
+    vendor = connection.vendor
+    sql = _SQL.get(vendor)
+    if sql is None:
+        return _search_product_infos_like(terms, limit, after, shop_id)
+
+    match = _match_expression(terms, vendor)
+    params = [match] if vendor == "sqlite" else [match, match]
+    inner = sql["search"]
+    if shop_id:
+        inner += sql["shop"]
+        params.append(shop_id)
+
+    # постраничная выдача по паре (ранг, id) без OFFSET, after - последняя
+    # выданная пара (id позиции, ранг)
+    where = ""
+    if after is not None:
+        where = " WHERE score > %s OR (score = %s AND id > %s)"
+        after_id, after_score = after
+        params += [after_score, after_score, after_id]
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id, score FROM ({inner}) AS found{where} "
+            "ORDER BY score, id LIMIT %s",
+            params,
+        )
+        return [tuple(row) for row in cursor.fetchall()]
+
+
+def _search_product_infos_like(terms, limit, after, shop_id):
+    product_infos = ProductInfo.objects.filter(shop__state=True)
+    if shop_id:
+        product_infos = product_infos.filter(shop_id=shop_id)
+    for term in terms:
+        product_infos = product_infos.filter(
+            Q(product__name__icontains=term)
+            | Q(model__icontains=term)
+            | Q(product_parameters__value__icontains=term)
+        )
+    if after is not None:
+        product_infos = product_infos.filter(id__gt=after[0])
+    product_infos = product_infos.distinct().order_by("id")
+    return [(id_, 0) for id_ in product_infos.values_list("id", flat=True)[:limit]]
@@ -1,8 +1,22 @@
+import logging
+from json import dumps as dump_json
+from json import loads as load_json
+from operator import itemgetter
+from tempfile import TemporaryFile
+
+from django.conf import settings
+from django.db import transaction
 from rest_framework import serializers
 
+from backend.cache import bump_catalog_version
+from backend.catalog import refresh_shop_catalog
+from backend.db import write_transaction
+from backend.facets import refresh_shop_facets
+from backend.metrics import IMPORT_DURATION, IMPORTED_GOODS, IMPORTS
 from backend.models import (
     Category,
     Contact,
+    ImportJob,
     Order,
     OrderItem,
     Parameter,
@@ -12,64 +26,603 @@ from backend.models import (
     Shop,
     User,
 )
+from backend.profiling import ImportProfile
+from backend.search import index_shop
 
-##########################################
-
-
-def import_shop(user, shop_data):
-    # ToDo: add format validation
-    # ToDo: add user type validation
-    try:
-        shop = shop_data["shop"]
-        categories = shop_data["categories"]
-        goods = shop_data["goods"]
-
-        # create shop
-        shop, _ = Shop.objects.get_or_create(name=shop, user_id=user.id)
+logger = logging.getLogger(__name__)
 
-        # create categories
-        actual_categories_id = {}
-        for category in categories:
-            category_object, _ = Category.objects.get_or_create(name=category["name"])
-            category_object.shops.add(shop.id)
-            category_object.save()
-            actual_categories_id[category["id"]] = category_object.id
-
-        # create products, product_infos, parameters and product_parameters
-        ProductInfo.objects.filter(shop_id=shop.id).delete()
+##########################################
 
-        actual_products_id = {}
+# размер пачки для bulk-запросов при импорте прайса
+IMPORT_BATCH_SIZE = 1000
+
+
+def _chunks(items, size=IMPORT_BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _bulk_create_chunked(model, objs):
+    """
+    Создаёт записи пачками, фиксируя каждую пачку отдельной транзакцией,
+    чтобы длинный импорт не держал блокировку на всё время работы
+    """
+    for chunk in _chunks(objs):
+        with transaction.atomic():
+            model.objects.bulk_create(chunk)
+
+
+# кэш name -> id справочников, общий для импортов процесса
+# (включается настройкой IMPORT_SHARED_NAME_CACHE)
+_shared_name_cache = {}
+
+
+def clear_name_cache(model=None):
+    """
+    Сбрасывает общий кэш справочника (или всех справочников), вызывается
+    при изменении и удалении категорий и параметров
+    """
+    if model is None:
+        _shared_name_cache.clear()
+    else:
+        _shared_name_cache.pop(model, None)
+
+
+def _get_name_cache(model):
+    """
+    Кэш name -> id справочника для одного импорта: отдельный словарь или,
+    если включено в настройках, общий для процесса
+    """
+    if settings.IMPORT_SHARED_NAME_CACHE:
+        return _shared_name_cache.setdefault(model, {})
+    return {}
+
+
+def _resolve_by_name(model, names, cache):
+    """
+    Возвращает словарь name -> id для справочника, создавая недостающие записи,
+    и число созданных записей. Уже известные имена берутся из cache без
+    обращения к базе, найденные и созданные - добавляются в него
+    """
+    names = set(names)
+    resolved = {name: cache[name] for name in names if name in cache}
+    names.difference_update(resolved)
+    for chunk in _chunks(names):
+        for obj_id, name in (
+            model.objects.filter(name__in=chunk).order_by("id").values_list("id", "name")
+        ):
+            resolved.setdefault(name, obj_id)
+
+    missing = [model(name=name) for name in names if name not in resolved]
+    if missing:
+        _bulk_create_chunked(model, missing)
+        for chunk in _chunks(obj.name for obj in missing):
+            for obj_id, name in (
+                model.objects.filter(name__in=chunk)
+                .order_by("id")
+                .values_list("id", "name")
+            ):
+                resolved.setdefault(name, obj_id)
+    for name in names:
+        cache[name] = resolved[name]
+    return resolved, len(missing)
+
+
+def _resolve_products(keys):
+    """
+    Возвращает словарь (name, category_id) -> id продукта, создавая недостающие,
+    и число созданных продуктов
+    """
+    keys = list(dict.fromkeys(keys))
+    names = {name for name, _ in keys}
+
+    def lookup():
+        found = {}
+        for chunk in _chunks(names):
+            for obj_id, name, category_id in (
+                Product.objects.filter(name__in=chunk)
+                .order_by("id")
+                .values_list("id", "name", "category_id")
+            ):
+                found.setdefault((name, category_id), obj_id)
+        return found
+
+    resolved = lookup()
+    missing = [
+        Product(name=name, category_id=category_id)
+        for name, category_id in keys
+        if (name, category_id) not in resolved
+    ]
+    if missing:
+        _bulk_create_chunked(Product, missing)
+        resolved = lookup()
+    return resolved, len(missing)
+
+
+def _spool_goods(
+    spool,
+    goods,
+    actual_categories_id,
+    actual_products_id,
+    summary,
+    parameters_cache,
+    profile,
+):
+    """
+    Разрешает продукты и параметры пачки товаров и сохраняет подготовленные
+    строки прайса во временный файл, чтобы не держать весь прайс в памяти
+    """
+    with profile.stage("products"):
+        products_by_key, products_created = _resolve_products(
+            (item["name"], actual_categories_id[item["category"]]) for item in goods
+        )
+    profile.add_rows("products", products_created)
+    with profile.stage("parameters"):
+        parameters_by_name, parameters_created = _resolve_by_name(
+            Parameter,
+            (name for item in goods for name in item["parameters"]),
+            parameters_cache,
+        )
+    profile.add_rows("parameters", parameters_created)
+    summary["goods"] += len(goods)
+    summary["products"]["created"] += products_created
+    summary["parameters"]["created"] += parameters_created
+    summary["parameters_id"].update(parameters_by_name.values())
+    with profile.stage("spool"):
         for item in goods:
-            product, _ = Product.objects.get_or_create(
-                name=item["name"], category_id=actual_categories_id[item["category"]]
-            )
-            actual_products_id[item["id"]] = product.id
-
-            product_info = ProductInfo.objects.create(
-                product_id=product.id,
-                model=item["model"],
-                price=item["price"],
-                price_rrc=item["price_rrc"],
-                quantity=item["quantity"],
+            product_id = products_by_key[
+                (item["name"], actual_categories_id[item["category"]])
+            ]
+            # позиция магазина у продукта одна: повтор отклоняем сразу, иначе
+            # полный импорт упал бы на unique (product, shop), а
+            # дифференциальный молча оставил бы последний из повторов
+            if product_id in summary["products_id"]:
+                raise ValueError(
+                    f"Товар {item['name']} (id {item['id']}) повторяется в прайсе"
+                )
+            summary["products_id"].add(product_id)
+            actual_products_id[item["id"]] = product_id
+            row = [
+                product_id,
+                item["model"],
+                item["price"],
+                item["price_rrc"],
+                item["quantity"],
+                [
+                    [parameters_by_name[name], str(value)]
+                    for name, value in item["parameters"].items()
+                ],
+            ]
+            spool.write(dump_json(row, ensure_ascii=False) + "\n")
+
+
+def _iter_spooled_batches(spool):
+    spool.seek(0)
+    batch = []
+    for line in spool:
+        batch.append(load_json(line))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _replace_product_infos(shop, batches, profile):
+    # каскадное удаление загружает удаляемые позиции - только их id
+    rows, deleted = ProductInfo.objects.filter(shop_id=shop.id).only("id").delete()
+    deleted = deleted.get(ProductInfo._meta.label, 0)
+
+    created = 0
+    for batch in batches:
+        ProductInfo.objects.bulk_create(
+            ProductInfo(
+                product_id=product_id,
+                model=model,
+                price=price,
+                price_rrc=price_rrc,
+                quantity=quantity,
                 shop_id=shop.id,
             )
-            for name, value in item["parameters"].items():
-                parameter_object, _ = Parameter.objects.get_or_create(name=name)
-                ProductParameter.objects.create(
-                    product_info_id=product_info.id,
-                    parameter_id=parameter_object.id,
-                    value=value,
+            for product_id, model, price, price_rrc, quantity, _ in batch
+        )
+        product_infos_id = dict(
+            ProductInfo.objects.filter(
+                shop_id=shop.id, product_id__in=[row[0] for row in batch]
+            ).values_list("product_id", "id")
+        )
+        ProductParameter.objects.bulk_create(
+            ProductParameter(
+                product_info_id=product_infos_id[row[0]],
+                parameter_id=parameter_id,
+                value=value,
+            )
+            for row in batch
+            for parameter_id, value in row[5]
+        )
+        created += len(batch)
+        rows += len(batch) + sum(len(row[5]) for row in batch)
+    profile.add_rows("product_infos", rows)
+    # прайс заменён целиком, производные таблицы магазина перестраиваются полностью
+    return {"created": created, "updated": 0, "deleted": deleted}, None
+
+
+PRODUCT_INFO_DIFF_FIELDS = ("price", "price_rrc", "quantity")
+
+
+def _diff_product_infos(shop, batches, profile):
+    """
+    Дифференциальный импорт: товары сопоставляются с имеющимися ProductInfo
+    по (product, shop, model), изменяются только отличающиеся цены, остатки
+    и параметры, новые товары добавляются, пропавшие из прайса удаляются.
+    Кроме итогов возвращает id затронутых позиций: changed - добавленные и
+    изменённые, indexed - добавленные и с изменёнными параметрами, deleted -
+    удалённые, а также categories - категории пропавших из прайса товаров
+    """
+    created = updated = deleted = rows = 0
+    seen_products_id = set()
+    changes = {
+        "changed": set(),
+        "indexed": set(),
+        "deleted": set(),
+        "categories": set(),
+    }
+    for batch in batches:
+        incoming = {row[0]: row for row in batch}
+        seen_products_id.update(incoming)
+
+        existing = {}
+        replaced = []
+        for product_info in ProductInfo.objects.filter(
+            shop_id=shop.id, product_id__in=list(incoming)
+        ).only("id", "product_id", "model", *PRODUCT_INFO_DIFF_FIELDS):
+            if product_info.model == incoming[product_info.product_id][1]:
+                existing[product_info.product_id] = product_info
+            else:
+                replaced.append(product_info.id)
+
+        # сменившие модель удаляем до вставки, чтобы не упереться
+        # в unique (product, shop)
+        if replaced:
+            changes["deleted"].update(replaced)
+            replaced_rows, replaced = ProductInfo.objects.filter(
+                id__in=replaced
+            ).only("id").delete()
+            deleted += replaced.get(ProductInfo._meta.label, 0)
+            rows += replaced_rows
+
+        changed_infos = []
+        new_infos = []
+        for product_id, row in incoming.items():
+            product_info = existing.get(product_id)
+            if product_info is None:
+                new_infos.append(
+                    ProductInfo(
+                        product_id=product_id,
+                        model=row[1],
+                        price=row[2],
+                        price_rrc=row[3],
+                        quantity=row[4],
+                        shop_id=shop.id,
+                    )
                 )
-    except Exception as e:
-        return {"Status": False, "Error": str(e)}
+                continue
+            is_changed = False
+            for field, value in zip(PRODUCT_INFO_DIFF_FIELDS, row[2:5]):
+                value = int(value)
+                if getattr(product_info, field) != value:
+                    setattr(product_info, field, value)
+                    is_changed = True
+            if is_changed:
+                changed_infos.append(product_info)
+
+        rows += ProductInfo.objects.bulk_update(
+            changed_infos, PRODUCT_INFO_DIFF_FIELDS
+        )
+        ProductInfo.objects.bulk_create(new_infos)
+        created += len(new_infos)
+        rows += len(new_infos)
+
+        product_infos_id = dict(
+            ProductInfo.objects.filter(
+                shop_id=shop.id, product_id__in=list(incoming)
+            ).values_list("product_id", "id")
+        )
 
+        # параметры сравниваем только у уже существовавших товаров,
+        # у новых их просто создаём
+        kept_infos_id = {product_info.id for product_info in existing.values()}
+        existing_parameters = {
+            (product_parameter.product_info_id, product_parameter.parameter_id): (
+                product_parameter
+            )
+            for product_parameter in ProductParameter.objects.filter(
+                product_info_id__in=kept_infos_id
+            ).only("id", "product_info_id", "parameter_id", "value")
+        }
+        incoming_parameters = {
+            (product_infos_id[product_id], parameter_id): value
+            for product_id, row in incoming.items()
+            for parameter_id, value in row[5]
+        }
+
+        vanished_parameters = [
+            product_parameter
+            for key, product_parameter in existing_parameters.items()
+            if key not in incoming_parameters
+        ]
+        rows += ProductParameter.objects.filter(
+            id__in=[product_parameter.id for product_parameter in vanished_parameters]
+        ).delete()[0]
+
+        changed_parameters = []
+        new_parameters = []
+        for key, value in incoming_parameters.items():
+            product_parameter = existing_parameters.get(key)
+            if product_parameter is None:
+                new_parameters.append(
+                    ProductParameter(
+                        product_info_id=key[0], parameter_id=key[1], value=value
+                    )
+                )
+            elif product_parameter.value != value:
+                product_parameter.value = value
+                changed_parameters.append(product_parameter)
+
+        rows += ProductParameter.objects.bulk_update(changed_parameters, ("value",))
+        ProductParameter.objects.bulk_create(new_parameters)
+        rows += len(new_parameters)
+
+        # товар с изменёнными только параметрами тоже считаем обновлённым
+        parameters_changed_id = {
+            product_parameter.product_info_id
+            for product_parameter in changed_parameters + vanished_parameters
+        }
+        parameters_changed_id.update(
+            product_parameter.product_info_id
+            for product_parameter in new_parameters
+            if product_parameter.product_info_id in kept_infos_id
+        )
+        changed_infos_id = {product_info.id for product_info in changed_infos}
+        changed_infos_id |= parameters_changed_id
+        updated += len(changed_infos_id)
+
+        created_infos_id = {
+            product_infos_id[product_info.product_id] for product_info in new_infos
+        }
+        changes["changed"] |= created_infos_id | changed_infos_id
+        changes["indexed"] |= created_infos_id | parameters_changed_id
+
+    vanished = []
+    for product_info_id, product_id, category_id in ProductInfo.objects.filter(
+        shop_id=shop.id
+    ).values_list("id", "product_id", "product__category_id"):
+        if product_id not in seen_products_id:
+            vanished.append(product_info_id)
+            changes["categories"].add(category_id)
+    changes["deleted"].update(vanished)
+    for chunk in _chunks(vanished):
+        vanished_rows, vanished = (
+            ProductInfo.objects.filter(id__in=chunk).only("id").delete()
+        )
+        deleted += vanished.get(ProductInfo._meta.label, 0)
+        rows += vanished_rows
+    profile.add_rows("product_infos", rows)
+    return {"created": created, "updated": updated, "deleted": deleted}, changes
+
+
+def _changed_categories(product_infos_id):
+    """
+    Категории сохранённых позиций
+    """
+    categories_id = set()
+    for chunk in _chunks(list(product_infos_id)):
+        categories_id.update(
+            ProductInfo.objects.filter(id__in=chunk).values_list(
+                "product__category_id", flat=True
+            )
+        )
+    return categories_id
+
+
+def iter_shop_data(shop_data):
+    """
+    Представляет загруженный целиком прайс в виде последовательности разделов,
+    которую принимает import_shop_records
+    """
+    yield "shop", shop_data["shop"]
+    yield "categories", shop_data["categories"]
+    for item in shop_data["goods"]:
+        yield "goods", item
+
+
+def _record_import_metrics(status, profile, goods):
+    IMPORTS.inc(status=status)
+    IMPORTED_GOODS.inc(goods)
+    for name, stage in profile.stages.items():
+        IMPORT_DURATION.observe(stage["time"], stage=name)
+    # этапы не вкладываются друг в друга, поэтому их сумма - время всего импорта
+    IMPORT_DURATION.observe(
+        sum(stage["time"] for stage in profile.stages.values()), stage="total"
+    )
+
+
+def import_shop_records(user, records, diff=False, progress=None, profile=None):
+    """
+    Импорт прайса из последовательности пар (раздел, значение), где товары
+    раздела goods идут по одному - так прайс можно загружать потоково.
+    progress, если указан, вызывается с числом уже разобранных товаров.
+    Время, запросы и записанные строки по этапам собираются в profile
+    """
+    if profile is None:
+        profile = ImportProfile()
+    summary = {
+        "goods": 0,
+        "categories": {"total": 0, "created": 0},
+        "products": {"total": 0, "created": 0},
+        "parameters": {"total": 0, "created": 0},
+        "products_id": set(),
+        "parameters_id": set(),
+    }
+    parameters_cache = _get_name_cache(Parameter)
+    try:
+        shop = None
+        actual_categories_id = None
+        actual_products_id = {}
+        with profile.capture_queries(), TemporaryFile("w+", encoding="utf-8") as spool:
+            batch = []
+            for key, value in records:
+                if key == "shop":
+                    # create shop
+                    with profile.stage("categories"):
+                        shop, _ = Shop.objects.get_or_create(
+                            name=value, user_id=user.id
+                        )
+                        if actual_categories_id is not None:
+                            shop.categories.add(*set(actual_categories_id.values()))
+                elif key == "categories":
+                    # create categories
+                    with profile.stage("categories"):
+                        categories_by_name, categories_created = _resolve_by_name(
+                            Category,
+                            (category["name"] for category in value),
+                            _get_name_cache(Category),
+                        )
+                        actual_categories_id = {
+                            category["id"]: categories_by_name[category["name"]]
+                            for category in value
+                        }
+                        if shop is not None:
+                            shop.categories.add(*set(actual_categories_id.values()))
+                    profile.add_rows("categories", categories_created)
+                    summary["categories"]["total"] = len(categories_by_name)
+                    summary["categories"]["created"] = categories_created
+                elif key == "goods":
+                    # create products and parameters
+                    if actual_categories_id is None:
+                        raise ValueError("Раздел goods должен следовать за categories")
+                    batch.append(value)
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        _spool_goods(
+                            spool,
+                            batch,
+                            actual_categories_id,
+                            actual_products_id,
+                            summary,
+                            parameters_cache,
+                            profile,
+                        )
+                        batch = []
+                        if progress is not None:
+                            progress(summary["goods"])
+            if shop is None or actual_categories_id is None:
+                raise ValueError("Не указаны разделы shop и categories")
+            if batch:
+                _spool_goods(
+                    spool,
+                    batch,
+                    actual_categories_id,
+                    actual_products_id,
+                    summary,
+                    parameters_cache,
+                    profile,
+                )
+                if progress is not None:
+                    progress(summary["goods"])
+
+            # create product_infos and product_parameters
+            # справочники выше дописываются пачками и не ломают текущий прайс,
+            # а сам прайс заменяется целиком в одной транзакции вместе с
+            # каталогом магазина (его строки удаляются вместе с позициями):
+            # покупатели видят либо старый, либо новый список товаров, а при
+            # ошибке старый сохраняется
+            write_product_infos = (
+                _diff_product_infos if diff else _replace_product_infos
+            )
+            with write_transaction():
+                with profile.stage("product_infos"):
+                    summary["product_infos"], changes = write_product_infos(
+                        shop, _iter_spooled_batches(spool), profile
+                    )
+                    shops = Shop.objects.filter(id=shop.id)
+                    # производные таблицы прошлого импорта не перестроены
+                    catalog_dirty = shops.values_list(
+                        "catalog_dirty", flat=True
+                    ).get()
+                    shops.update(catalog_dirty=True)
+                # после полной замены прайса или неудачного прошлого импорта
+                # производные таблицы строятся целиком, после
+                # дифференциального импорта - только у затронутых позиций
+                if changes is None or catalog_dirty:
+                    indexed = changed = categories_id = None
+                    deleted = ()
+                else:
+                    indexed, changed, deleted = (
+                        changes["indexed"],
+                        changes["changed"],
+                        changes["deleted"],
+                    )
+                with profile.stage("catalog"):
+                    profile.add_rows(
+                        "catalog", refresh_shop_catalog(shop.id, changed, deleted)
+                    )
+            # закэшированные ответы каталога больше не соответствуют прайсу,
+            # даже если поиск и фильтры ниже обновить не удастся
+            transaction.on_commit(lambda: bump_catalog_version(shop.id))
+            # поисковый индекс и счётчики фильтров строятся по уже сохранённому
+            # прайсу, каждый в своей короткой транзакции, чтобы не держать
+            # блокировку записи на всё время импорта. Флаг catalog_dirty
+            # снимается вместе с обновлением последнего из них
+            try:
+                with profile.stage("search_index"), write_transaction():
+                    profile.add_rows(
+                        "search_index", index_shop(shop.id, indexed, deleted)
+                    )
+                with profile.stage("facets"), write_transaction():
+                    if indexed is not None:
+                        categories_id = (
+                            _changed_categories(indexed) | changes["categories"]
+                        )
+                    profile.add_rows(
+                        "facets", refresh_shop_facets(shop.id, categories_id)
+                    )
+                    shops.update(catalog_dirty=False)
+            except Exception as e:
+                # прайс и каталог уже сохранены, а магазин помечен catalog_dirty -
+                # следующий импорт в любом режиме перестроит индекс и фильтры
+                # целиком
+                raise ValueError(
+                    f"Прайс сохранён, но поиск и фильтры магазина не обновлены: {e}"
+                ) from e
+            # и ответы поиска и фильтров, собранные до их обновления
+            transaction.on_commit(lambda: bump_catalog_version(shop.id))
+    except Exception as e:
+        _record_import_metrics("failed", profile, 0)
+        return {"Status": False, "Error": str(e), "timings": profile.report()}
+
+    summary["products"]["total"] = len(summary.pop("products_id"))
+    summary["parameters"]["total"] = len(summary.pop("parameters_id"))
+    _record_import_metrics("done", profile, summary["goods"])
+    timings = profile.report()
+    logger.info("Импорт прайса магазина %s: %s, этапы: %s", shop.name, summary, timings)
     return {
         "Status": True,
         "actual_products_id": actual_products_id,
         "actual_categories_id": actual_categories_id,
+        "summary": summary,
+        "timings": timings,
     }
 
 
+def import_shop(user, shop_data, diff=False, profile=None):
+    # ToDo: add format validation
+    # ToDo: add user type validation
+    return import_shop_records(
+        user, iter_shop_data(shop_data), diff=diff, profile=profile
+    )
+
+
 ##########################################
 
 
@@ -102,6 +655,9 @@ class ProductParameterSerializer(serializers.ModelSerializer):
 
 
 class ProductInfoSerializer(serializers.ModelSerializer):
+    # вложенные объекты, которые можно не запрашивать из базы
+    NESTED_FIELDS = ("product", "product_parameters")
+
     product = ProductSerializer(read_only=True)
     product_parameters = ProductParameterSerializer(read_only=True, many=True)
 
@@ -120,6 +676,68 @@ class ProductInfoSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
 
 
+##########################################
+# Быстрая сериализация каталога
+#
+# Тот же ответ, что ProductInfoSerializer(many=True), но собранный из строк
+# values() денормализованного каталога (CatalogEntry), где параметры уже лежат
+# в виде ответа, без создания моделей и вложенных сериализаторов на каждую
+# строку.
+
+CATALOG_ENTRY_COLUMNS = {
+    "id": ("id",),
+    "model": ("model",),
+    "product": ("product_name", "category_name"),
+    "shop": ("shop_id",),
+    "quantity": ("quantity",),
+    "price": ("price",),
+    "price_rrc": ("price_rrc",),
+    "product_parameters": ("parameters",),
+}
+
+
+def _ordered_fields(fields):
+    # поля идут в порядке сериализатора, а не запроса
+    return [
+        name
+        for name in ProductInfoSerializer.Meta.fields
+        if not fields or name in fields
+    ]
+
+
+def catalog_entry_columns(fields=None):
+    """
+    Столбцы values() CatalogEntry, нужные для полей fields (по умолчанию всех)
+    """
+    columns = ["id"]
+    for name in _ordered_fields(fields):
+        columns += [
+            column for column in CATALOG_ENTRY_COLUMNS[name] if column != "id"
+        ]
+    return columns
+
+
+def serialize_catalog_entries(rows, fields=None):
+    """
+    Сериализует строки values(*catalog_entry_columns(fields)) каталога
+    """
+    getters = {
+        "id": itemgetter("id"),
+        "model": itemgetter("model"),
+        "product": lambda row: {
+            "name": row["product_name"],
+            "category": row["category_name"],
+        },
+        "shop": itemgetter("shop_id"),
+        "quantity": itemgetter("quantity"),
+        "price": itemgetter("price"),
+        "price_rrc": itemgetter("price_rrc"),
+        "product_parameters": itemgetter("parameters"),
+    }
+    getters = [(name, getters[name]) for name in _ordered_fields(fields)]
+    return [{name: getter(row) for name, getter in getters} for row in rows]
+
+
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -174,19 +792,22 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ("id",)
 
 
-class ShopContactSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = User
-        fields = ["email"]
-
-
-class ShopSerializer(serializers.ModelSerializer):
-    contact = serializers.SerializerMethodField()
-
+class ImportJobSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Shop
-        fields = ("id", "name", "state", "url", "contact")
-        read_only_fields = ("id",)
-
-    def get_contact(self, obj):
-        return ShopContactSerializer(obj.user).data
\ No newline at end of file
+        model = ImportJob
+        fields = (
+            "id",
+            "url",
+            "format",
+            "diff",
+            "force",
+            "state",
+            "processed",
+            "with_report",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        )
+        read_only_fields = fields
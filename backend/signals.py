@@ -1,9 +1,29 @@
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import Signal, receiver
 from django_rest_passwordreset.views import reset_password_token_created
 
-from backend.models import ConfirmEmailToken, User
+from backend.cache import bump_catalog_version
+from backend.catalog import (
+    catalog_shops,
+    sync_category_catalog,
+    sync_parameter_catalog,
+    sync_product_catalog,
+    sync_shop_catalog,
+)
+from backend.metrics import EMAILS_SENT, SIGNAL_HANDLER_CALLS
+from backend.models import (
+    Category,
+    ConfirmEmailToken,
+    Parameter,
+    Product,
+    Shop,
+    User,
+)
+from backend.serializers import clear_name_cache
 
 new_order = Signal(
     # providing_args=["user_id"],
@@ -20,6 +40,7 @@ def new_order_signal(user_id, order_id, **kwargs):
     """
     отправяем письмо при изменении статуса заказа
     """
+    SIGNAL_HANDLER_CALLS.inc(handler="new_order_signal")
     user = User.objects.get(id=user_id)
 
     msg = EmailMultiAlternatives(
@@ -33,6 +54,7 @@ def new_order_signal(user_id, order_id, **kwargs):
         [user.email],
     )
     msg.send()
+    EMAILS_SENT.inc(kind="order")
 
 
 @receiver(new_user_registered)
@@ -40,6 +62,7 @@ def new_user_registered_signal(user_id, **kwargs):
     """
     отправляем письмо с подтрердждением почты
     """
+    SIGNAL_HANDLER_CALLS.inc(handler="new_user_registered_signal")
     # send an e-mail to the user
     token, _ = ConfirmEmailToken.objects.get_or_create(user_id=user_id)
 
@@ -54,6 +77,96 @@ def new_user_registered_signal(user_id, **kwargs):
         [token.user.email],
     )
     msg.send()
+    EMAILS_SENT.inc(kind="registration")
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Parameter)
+@receiver(post_delete, sender=Parameter)
+def name_cache_invalidation(sender, **kwargs):
+    """
+    Сбрасываем кэш справочника импорта при изменении его записей
+    """
+    SIGNAL_HANDLER_CALLS.inc(handler="name_cache_invalidation")
+    clear_name_cache(sender)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def catalog_cache_invalidation(sender, instance, **kwargs):
+    """
+    Сбрасываем кэш каталога при изменении магазина (например, из админки)
+    """
+    SIGNAL_HANDLER_CALLS.inc(handler="catalog_cache_invalidation")
+    # версия меняется после фиксации транзакции, иначе ответ, собранный по
+    # ещё старым данным, успел бы закэшироваться под новой версией
+    shop_id = instance.id
+    transaction.on_commit(lambda: bump_catalog_version(shop_id))
+
+
+@receiver(post_save, sender=User)
+def shop_contact_invalidation(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Email пользователя магазина выводится в списке магазинов
+    """
+    SIGNAL_HANDLER_CALLS.inc(handler="shop_contact_invalidation")
+    if created or instance.type != "shop":
+        return
+    if update_fields is not None and "email" not in update_fields:
+        return
+    shop = Shop.objects.filter(user_id=instance.id).first()
+    if shop is not None:
+        transaction.on_commit(lambda: bump_catalog_version(shop.id))
+
+
+@receiver(post_save, sender=Shop)
+def catalog_shop_sync(sender, instance, created, **kwargs):
+    """
+    Переносим название и статус магазина в денормализованный каталог
+    """
+    SIGNAL_HANDLER_CALLS.inc(handler="catalog_shop_sync")
+    if not created:
+        sync_shop_catalog(instance)
+
+
+CATALOG_NAME_SYNC = {
+    Category: sync_category_catalog,
+    Product: sync_product_catalog,
+    Parameter: sync_parameter_catalog,
+}
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Parameter)
+def catalog_name_sync(sender, instance, created, **kwargs):
+    """
+    Переносим изменения категорий, товаров и параметров (например, из админки)
+    в денормализованный каталог
+    """
+    SIGNAL_HANDLER_CALLS.inc(handler="catalog_name_sync")
+    if created:
+        return
+    for shop_id in CATALOG_NAME_SYNC[sender](instance):
+        transaction.on_commit(lambda shop_id=shop_id: bump_catalog_version(shop_id))
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Product)
+def catalog_deletion_invalidation(sender, instance, origin, **kwargs):
+    """
+    Строки каталога удаляются каскадом вместе с позициями прайса товара или
+    категории, поэтому кэш затронутых магазинов сбрасываем до удаления, пока
+    эти строки ещё есть
+    """
+    deleted = type(origin) if isinstance(origin, Model) else origin.model
+    if deleted is Category and sender is Product:
+        # товары удаляемой категории учтены в обработчике самой категории
+        return
+    SIGNAL_HANDLER_CALLS.inc(handler="catalog_deletion_invalidation")
+    for shop_id in catalog_shops(instance):
+        transaction.on_commit(lambda shop_id=shop_id: bump_catalog_version(shop_id))
 
 
 @receiver(reset_password_token_created)
@@ -67,6 +180,7 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
     :param kwargs:
     :return:
     """
+    SIGNAL_HANDLER_CALLS.inc(handler="password_reset_token_created")
     # send an e-mail to the user
 
     msg = EmailMultiAlternatives(
@@ -79,4 +193,5 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
         # to:
         [reset_password_token.user.email]
     )
-    msg.send()
\ No newline at end of file
+    msg.send()
+    EMAILS_SENT.inc(kind="password_reset")
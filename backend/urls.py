@@ -8,15 +8,22 @@ from backend.views import (
     BasketView,
     ConfirmAccount,
     ContactView,
+    ImportJobReportView,
+    ImportJobView,
     OrderView,
     PartnerOrderView,
     PartnerState,
     RegisterAccount,
+    export_catalog_feeds,
+    export_products,
+    export_shop_feed,
+    list_product_facets,
     list_products,
     list_shops,
     login_user,
     logout_user,
     register_user,
+    search_products,
     test_do_authorized_action,
     test_ping_view,
     test_user_list,
@@ -34,6 +41,14 @@ urlpatterns = [
     ),
     # other
     path("partner/update/", update_shop, name="update_shop"),
+    path(
+        "partner/update/<int:job_id>/", ImportJobView.as_view(), name="import_job"
+    ),
+    path(
+        "partner/update/<int:job_id>/report/",
+        ImportJobReportView.as_view(),
+        name="import_job_report",
+    ),
     path("partner/state", PartnerState.as_view(), name="partner_state"),
     path("partner/orders/", PartnerOrderView.as_view(), name="partner_orders"),
     path("user/register/", register_user, name="register_user"),
@@ -56,6 +71,11 @@ urlpatterns = [
     path("user/contact/", ContactView.as_view(), name="user-contact"),
     path("basket/", BasketView.as_view(), name="basket"),
     path("products/", list_products, name="list_products"),
+    path("products/search/", search_products, name="search_products"),
+    path("products/facets/", list_product_facets, name="list_product_facets"),
+    path("products/export/", export_products, name="export_products"),
+    path("shops/export/", export_catalog_feeds, name="export_catalog_feeds"),
+    path("shops/<int:shop_id>/export/", export_shop_feed, name="export_shop_feed"),
     path("orders/", OrderView.as_view(), name="orders"),
     path("shops/", list_shops, name="list_shops"),
 ]
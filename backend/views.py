@@ -1,36 +1,72 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from json import dumps as dump_json
 from json import loads as load_json
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.db.models import F, Q, Sum
-from requests import get
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.views import APIView, exception_handler
-from yaml import Loader
-from yaml import load as load_yaml
 
+from backend.cache import (
+    bump_catalog_version,
+    catalog_cache_key,
+    catalog_condition,
+    get_catalog_cache,
+)
+from backend.catalog import shop_directory, sync_shop_catalog
+from backend.export import (
+    EXPORT_CONTENT_TYPES,
+    EXPORT_WRITERS,
+    FEED_WRITERS,
+    catalog_query,
+    iter_catalog_feeds_yaml,
+)
+from backend.facets import (
+    facet_counts,
+    parameter_filters_query,
+    parse_parameter_filters,
+)
+from backend.feeds import (
+    FeedTimeoutError,
+    FeedTooLargeError,
+    download_feed,
+    import_shop_from_url,
+    load_feed,
+    remember_feed,
+)
+from backend.jobs import enqueue_import, record_import
+from backend.metrics import render_metrics
 from backend.models import (
     STATE_CHOICES,
     USER_TYPE_CHOICES,
+    CatalogEntry,
     ConfirmEmailToken,
     Contact,
+    ImportJob,
     Order,
     OrderItem,
-    ProductInfo,
     Shop,
     User,
 )
+from backend.profiling import ImportProfile
+from backend.search import search_product_infos
 from backend.serializers import (
     ContactSerializer,
+    ImportJobSerializer,
     OrderItemSerializer,
     OrderSerializer,
     ProductInfoSerializer,
-    ShopSerializer,
     UserSerializer,
+    catalog_entry_columns,
     import_shop,
+    serialize_catalog_entries,
 )
 from backend.signals import new_order, new_user_registered
 
@@ -110,32 +146,142 @@ def update_shop(request):
     except ValidationError as e:
         return Response({"Status": False, "Error": "Некорректный url"}, status=403)
 
-    # get data
-    try:
-        stream = get(data_url).content
-    except Exception as e:
+    diff = str(request.data.get("diff", "")).lower() in ("1", "true")
+    with_report = str(request.data.get("report", "")).lower() in ("1", "true")
+    force = str(request.data.get("force", "")).lower() in ("1", "true")
+    streaming = str(request.data.get("stream", "")).lower() in ("1", "true")
+    data_format = request.data.get("format", "yaml")
+    if data_format not in ("yaml", "ndjson"):
         return Response(
-            {"Status": False, "Error": "Возникла ошибка при запросе данных"}, status=403
+            {"Status": False, "Error": "Неподдерживаемый формат данных"}, status=403
         )
+
+    # фоновый режим: ставим задачу в очередь и сразу отдаём её id
+    if str(request.data.get("background", "")).lower() in ("1", "true"):
+        job = enqueue_import(
+            user,
+            data_url,
+            data_format,
+            diff=diff,
+            with_report=with_report,
+            force=force,
+        )
+        return Response(
+            {"Status": True, "job_id": job.id, "url": data_url, "user": user_email},
+            status=200,
+        )
+
+    # потоковый режим: прайс разбирается по мере загрузки и не держится в памяти
+    if streaming:
+        result = import_shop_from_url(
+            user, data_url, data_format, diff=diff, force=force
+        )
+        return _import_response(
+            result, user, data_url, data_format, diff, with_report
+        )
+
+    # get data
+    # без force прайс запрашивается условно и не импортируется, если не изменился
+    profile = ImportProfile()
+    shop = None if force else Shop.objects.filter(user_id=user.id).first()
     try:
-        data = load_yaml(stream, Loader=Loader)
+        with profile.stage("download"):
+            download = download_feed(data_url, shop)
+    except (FeedTooLargeError, FeedTimeoutError) as e:
+        return Response({"Status": False, "Error": str(e)}, status=403)
     except Exception as e:
         return Response(
-            {
-                "Status": False,
-                "Error": "Данные не соответствуют требованиям по формату",
-            },
-            status=403,
+            {"Status": False, "Error": "Возникла ошибка при запросе данных"}, status=403
         )
+    with download:
+        if download.is_unchanged(shop):
+            return Response(
+                {"Status": True, "unchanged": True, "url": data_url, "user": user_email},
+                status=200,
+            )
+
+        try:
+            with profile.stage("parse"):
+                data = load_feed(download.file, data_format)
+        except Exception as e:
+            return Response(
+                {
+                    "Status": False,
+                    "Error": "Данные не соответствуют требованиям по формату",
+                },
+                status=403,
+            )
 
     # save data
-    result = import_shop(user, data)
-    result["url"] = data_url
-    result["user"] = user_email
-    result["data"] = data
+    result = import_shop(user, data, diff=diff, profile=profile)
+    if result["Status"]:
+        remember_feed(user, data_url, download, data_format)
+    result["unchanged"] = False
+    return _import_response(result, user, data_url, data_format, diff, with_report)
+
+
+def _import_response(result, user, data_url, data_format, diff, with_report):
+    """
+    Отвечает на импорт кратким итогом вместо самого прайса, подробный отчёт
+    (соответствие id из прайса и id в базе) сохраняется по запросу отдельно
+    """
+    response = {
+        key: result[key]
+        for key in ("Status", "Error", "unchanged", "summary", "timings")
+        if key in result
+    }
+    response["url"] = data_url
+    response["user"] = user.email
+    if with_report:
+        job = record_import(user, data_url, data_format, diff, result)
+        response["job_id"] = job.id
     status = 200 if result["Status"] else 403
+    return Response(response, status=status)
+
+
+class ImportJobView(APIView):
+    """
+    Класс для получения статуса фоновой задачи импорта прайса
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response(
+                {"Status": False, "Error": "Нужно быть залогиненным"}, status=403
+            )
 
-    return Response(result, status=status)
+        job = ImportJob.objects.filter(id=job_id, user_id=request.user.id).first()
+        if job is None:
+            return Response(
+                {"Status": False, "Error": "Задача импорта не найдена"}, status=403
+            )
+
+        serializer = ImportJobSerializer(job)
+        return Response({"Status": True, "job": serializer.data}, status=200)
+
+
+class ImportJobReportView(APIView):
+    """
+    Класс для получения подробного отчёта об импорте прайса
+    """
+
+    def get(self, request, job_id, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response(
+                {"Status": False, "Error": "Нужно быть залогиненным"}, status=403
+            )
+
+        job = ImportJob.objects.filter(id=job_id, user_id=request.user.id).first()
+        if job is None:
+            return Response(
+                {"Status": False, "Error": "Задача импорта не найдена"}, status=403
+            )
+        if job.report is None:
+            return Response(
+                {"Status": False, "Error": "Подробный отчёт не сохранялся"}, status=403
+            )
+
+        return Response({"Status": True, "report": job.report}, status=200)
 
 
 # ToDo: сделать ответ по спецификации
@@ -244,32 +390,331 @@ def logout_user(request):
     return Response({"Status": True}, status=200)
 
 
+def _encode_cursor(values):
+    return urlsafe_b64encode(dump_json(values).encode()).decode()
+
+
+def _decode_cursor(cursor, size=1):
+    try:
+        values = load_json(urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Некорректный cursor")
+    return values
+
+
+def _page_size(params):
+    limit = params.get("limit")
+    if not limit:
+        return settings.PRODUCTS_PAGE_SIZE
+    if not limit.isdigit() or int(limit) < 1:
+        raise ValueError("limit должен быть положительным числом")
+    return min(int(limit), settings.PRODUCTS_MAX_PAGE_SIZE)
+
+
+def _product_fields(params):
+    """
+    Поля позиций в ответе: fields - список полей, expand - вложенные объекты
+    (product, product_parameters) в дополнение к ним. Без обоих параметров
+    отдаются все поля
+    """
+    fields = params.get("fields")
+    expand = params.get("expand")
+    if fields is None and expand is None:
+        return None
+
+    all_fields = ProductInfoSerializer.Meta.fields
+    nested = ProductInfoSerializer.NESTED_FIELDS
+    if fields is None:
+        selected = [name for name in all_fields if name not in nested]
+    else:
+        selected = [name for name in fields.split(",") if name]
+    if expand:
+        selected += [name for name in expand.split(",") if name]
+
+    unknown = set(selected) - set(all_fields)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+    return [name for name in all_fields if name in selected]
+
+
+# сортировки списка товаров: поле, по которому идёт постраничная выдача
+PRODUCT_ORDERINGS = {
+    "id": None,
+    "price": "price",
+    "-price": "price",
+    "name": "product_name",
+    "-name": "product_name",
+}
+
+
+def _id_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ValueError(f"{name} должен быть числом")
+    return int(value)
+
+
+def _non_negative(params, name):
+    value = params.get(name)
+    if value is None or value == "":
+        return None
+    if not value.isdigit():
+        raise ValueError(f"{name} должен быть неотрицательным числом")
+    return int(value)
+
+
+def _list_products(params):
+    query = Q(shop_state=True)
+    shop_id = _id_param(params, "shop_id")
+    category_id = _id_param(params, "category_id")
+    cursor = params.get("cursor")
+    limit = _page_size(params)
+    fields = _product_fields(params)
+    price_min = _non_negative(params, "price_min")
+    price_max = _non_negative(params, "price_max")
+    ordering = params.get("ordering") or "id"
+    if ordering not in PRODUCT_ORDERINGS:
+        raise ValueError(f"Некорректная сортировка: {ordering}")
+    field = PRODUCT_ORDERINGS[ordering]
+    descending = ordering.startswith("-")
+
+    if shop_id:
+        query = query & Q(shop_id=shop_id)
+
+    if category_id:
+        query = query & Q(category_id=category_id)
+
+    if price_min is not None:
+        query = query & Q(price__gte=price_min)
+
+    if price_max is not None:
+        query = query & Q(price__lte=price_max)
+
+    if str(params.get("in_stock", "")).lower() in ("1", "true"):
+        query = query & Q(quantity__gt=0)
+
+    parameters = params.getlist("param")
+    if parameters:
+        query = query & parameter_filters_query(parse_parameter_filters(parameters))
+
+    # страница начинается после последней записи предыдущей в порядке сортировки:
+    # (значение, id) больше (или меньше при обратной сортировке) запомненных
+    if field is None:
+        order_by = ("id",)
+        if cursor:
+            (last_id,) = _decode_cursor(cursor)
+            query = query & Q(id__gt=last_id)
+    else:
+        lookup = "lt" if descending else "gt"
+        order_by = (f"-{field}", "-id") if descending else (field, "id")
+        if cursor:
+            last_value, last_id = _decode_cursor(cursor, size=2)
+            query = query & (
+                Q(**{f"{field}__{lookup}": last_value})
+                | Q(**{field: last_value, f"id__{lookup}": last_id})
+            )
+
+    # фильтруем и отбрасываем дуликаты, лишняя запись говорит о следующей странице
+    # все данные позиции лежат в одной строке каталога, без соединений
+    columns = catalog_entry_columns(fields)
+    if field is not None and field not in columns:
+        # значение сортировки последней записи страницы нужно для cursor
+        columns.append(field)
+    rows = list(
+        CatalogEntry.objects.filter(query).order_by(*order_by).values(*columns)[
+            : limit + 1
+        ]
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if field is None:
+            next_cursor = _encode_cursor([last["id"]])
+        else:
+            next_cursor = _encode_cursor([last[field], last["id"]])
+    products = serialize_catalog_entries(rows, fields)
+    return {"Status": True, "products": products, "next": next_cursor}
+
+
 # ToDo: other error message when exception
+@catalog_condition("products")
 @api_view(["GET"])
 def list_products(request):
+    """
+    Список товаров постранично: страницы отсчитываются от id последнего
+    товара (cursor), а не смещением, поэтому глубокие страницы не требуют
+    OFFSET-сканирования и не сдвигаются при импорте прайсов.
+    Ответы кэшируются до следующего импорта или смены статуса магазина
+    """
+    cache = get_catalog_cache()
+    cache_key = catalog_cache_key(
+        "products", request.query_params, request.query_params.get("shop_id")
+    )
+    response = cache.get(cache_key)
+    if response is None:
+        try:
+            response = _list_products(request.query_params)
+        except Exception as e:
+            return Response({"Status": False, "Error": str(e)}, status=403)
+        cache.set(cache_key, response, settings.CATALOG_CACHE_TIMEOUT)
+
+    return Response(response, status=200)
+
+
+@catalog_condition("facets")
+@api_view(["GET"])
+def list_product_facets(request):
+    """
+    Значения параметров товаров с числом позиций для каждого значения
+    (для фильтра param в списке товаров)
+    """
+    shop_id = request.query_params.get("shop_id")
+    cache = get_catalog_cache()
+    cache_key = catalog_cache_key("facets", request.query_params, shop_id)
+    response = cache.get(cache_key)
+    if response is None:
+        try:
+            facets = facet_counts(shop_id, request.query_params.get("category_id"))
+        except Exception as e:
+            return Response({"Status": False, "Error": str(e)}, status=403)
+        response = {"Status": True, "facets": facets}
+        cache.set(cache_key, response, settings.CATALOG_CACHE_TIMEOUT)
+
+    return Response(response, status=200)
+
+
+@catalog_condition("export")
+@require_GET
+def export_products(request):
+    """
+    Выгрузка всего каталога (или магазина, категории) потоком в формате json
+    или ndjson. Обычное представление Django, а не DRF: параметр format в DRF
+    занят выбором рендерера
+    """
+    data_format = request.GET.get("format", "json")
+    if data_format not in EXPORT_WRITERS:
+        return JsonResponse(
+            {"Status": False, "Error": f"Неизвестный формат выгрузки: {data_format}"},
+            status=403,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    # ошибку нужно отдать до начала потока, пока не отправлен статус 200
     try:
-        query = Q(shop__state=True)
-        shop_id = request.query_params.get("shop_id")
-        category_id = request.query_params.get("category_id")
+        query = catalog_query(
+            _id_param(request.GET, "shop_id"), _id_param(request.GET, "category_id")
+        )
+    except ValueError as e:
+        return JsonResponse(
+            {"Status": False, "Error": str(e)},
+            status=403,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    return StreamingHttpResponse(
+        EXPORT_WRITERS[data_format](query),
+        content_type=EXPORT_CONTENT_TYPES[data_format],
+    )
 
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
 
-        if category_id:
-            query = query & Q(product__category_id=category_id)
+@catalog_condition("feed")
+@require_GET
+def export_shop_feed(request, shop_id):
+    """
+    Прайс включённого магазина в формате импорта (yaml или ndjson) потоком
+    """
+    data_format = request.GET.get("format", "yaml")
+    if data_format not in FEED_WRITERS:
+        return JsonResponse(
+            {"Status": False, "Error": f"Неизвестный формат выгрузки: {data_format}"},
+            status=403,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    shop = Shop.objects.filter(id=shop_id, state=True).first()
+    if shop is None:
+        return JsonResponse(
+            {"Status": False, "Error": "Магазин не найден"},
+            status=403,
+            json_dumps_params={"ensure_ascii": False},
+        )
+    return StreamingHttpResponse(
+        FEED_WRITERS[data_format](shop),
+        content_type=EXPORT_CONTENT_TYPES[data_format],
+    )
 
-        # фильтруем и отбрасываем дуликаты
-        queryset = (
-            ProductInfo.objects.filter(query)
-            .select_related("shop", "product__category")
-            .prefetch_related("product_parameters__parameter")
-            .distinct()
+
+@catalog_condition("feeds")
+@require_GET
+def export_catalog_feeds(request):
+    """
+    Прайсы всех включённых магазинов: YAML-поток с документом в формате
+    импорта на каждый магазин. Только для выгрузки - загружать обратно нужно
+    каждый документ отдельно
+    """
+    return StreamingHttpResponse(
+        iter_catalog_feeds_yaml(), content_type=EXPORT_CONTENT_TYPES["yaml"]
+    )
+
+
+def _search_products(params):
+    query = params.get("q", "")
+    shop_id = _id_param(params, "shop_id")
+    cursor = params.get("cursor")
+    limit = _page_size(params)
+    fields = _product_fields(params)
+
+    after = None
+    if cursor:
+        after = _decode_cursor(cursor, size=2)
+        # (id позиции, ранг), иначе сравнение в SQL просто ничего не найдёт
+        after_id, after_score = after
+        if not isinstance(after_id, int) or not isinstance(after_score, (int, float)):
+            raise ValueError("Некорректный cursor")
+    found = search_product_infos(query, limit + 1, after=after, shop_id=shop_id)
+    next_cursor = None
+    if len(found) > limit:
+        found = found[:limit]
+        next_cursor = _encode_cursor(list(found[-1]))
+
+    rows = CatalogEntry.objects.filter(id__in=[id_ for id_, _ in found]).values(
+        *catalog_entry_columns(fields)
+    )
+    rows = {row["id"]: row for row in rows}
+    # сохраняем порядок по релевантности
+    products = serialize_catalog_entries(
+        [rows[id_] for id_, _ in found if id_ in rows], fields
+    )
+    return {"Status": True, "products": products, "next": next_cursor}
+
+
+@catalog_condition("search")
+@api_view(["GET"])
+def search_products(request):
+    """
+    Полнотекстовый поиск товаров по названию, модели и значениям параметров,
+    лучшие совпадения первыми, постранично по cursor
+    """
+    if not request.query_params.get("q"):
+        return Response(
+            {"Status": False, "Error": "Не указан поисковый запрос"}, status=403
         )
-        serializer = ProductInfoSerializer(queryset, many=True)
-    except Exception as e:
-        return Response({"Status": False, "Error": str(e)}, status=403)
 
-    return Response({"Status": True, "products": serializer.data}, status=200)
+    cache = get_catalog_cache()
+    cache_key = catalog_cache_key(
+        "search", request.query_params, request.query_params.get("shop_id")
+    )
+    response = cache.get(cache_key)
+    if response is None:
+        try:
+            response = _search_products(request.query_params)
+        except Exception as e:
+            return Response({"Status": False, "Error": str(e)}, status=403)
+        cache.set(cache_key, response, settings.CATALOG_CACHE_TIMEOUT)
+
+    return Response(response, status=200)
 
 
 class ContactView(APIView):
@@ -563,7 +1008,9 @@ class OrderView(APIView):
                         orders = []
                         order_id = request.data["basket_id"]
                         order = Order.objects.get(id=order_id)
-                        order_items = order.ordered_items.all()
+                        order_items = order.ordered_items.select_related(
+                            "product_info__shop"
+                        )
                         for order_item in order_items:
                             current_order = Order.objects.create(
                                 user_id=request.user.id,
@@ -584,7 +1031,7 @@ class OrderView(APIView):
                             shop = order_item.product_info.shop
                             new_order.send(
                                 sender=self.__class__,
-                                user_id=shop.user.id,
+                                user_id=shop.user_id,
                                 order_id=current_order.id,
                             )
 
@@ -692,20 +1139,22 @@ class PartnerOrderView(APIView):
         )
 
 
+@catalog_condition("shops")
 @api_view(["GET"])
 def list_shops(request):
+    """
+    Список включённых магазинов (или одного магазина) из кэшированного справочника
+    """
     try:
-        query = Q(state=True)
+        shops = shop_directory()
         id = request.query_params.get("shop_id")
 
         if id:
-            query = query & Q(id=id)
-
-        queryset = Shop.objects.filter(query)
-        serializer = ShopSerializer(queryset, many=True)
+            id = int(id)
+            shops = [shop for shop in shops if shop["id"] == id]
     except Exception as e:
         return Response({"Status": False, "Error": str(e)}, status=403)
-    return Response({"Status": True, "shops": serializer.data}, status=200)
+    return Response({"Status": True, "shops": shops}, status=200)
 
 
 class PartnerState(APIView):
@@ -743,6 +1192,11 @@ class PartnerState(APIView):
         if state:
             try:
                 Shop.objects.filter(user_id=request.user.id).update(state=state)
+                shop = Shop.objects.filter(user_id=request.user.id).first()
+                # магазина может ещё не быть, если прайс не загружался
+                if shop is not None:
+                    sync_shop_catalog(shop)
+                    transaction.on_commit(lambda: bump_catalog_version(shop.id))
                 return Response({"Status": True}, status=200)
             except ValueError as error:
                 return Response({"Status": False, "Error": str(error)}, status=403)
@@ -845,3 +1299,13 @@ class ConfirmAccount(APIView):
             {"Status": False, "Error": "Не указаны все необходимые аргументы"},
             status=403,
         )
+
+
+@require_GET
+def metrics(request):
+    """
+    Метрики запросов к API, импорта прайсов и писем в текстовом формате Prometheus
+    """
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
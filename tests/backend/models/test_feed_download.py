@@ -0,0 +1,99 @@
+import threading
+from itertools import count
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend import feeds
+from backend.feeds import (
+    FeedTimeoutError,
+    FeedTooLargeError,
+    download_feed,
+    get_session,
+)
+
+with open("tests/backend/models/test_shop.yaml", "rb") as f:
+    TEST_SHOP_CONTENT = f.read()
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    failures_left = 0
+    requests_count = 0
+
+    def do_GET(self):
+        FeedHandler.requests_count += 1
+        if FeedHandler.failures_left:
+            FeedHandler.failures_left -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(TEST_SHOP_CONTENT)))
+        self.end_headers()
+        self.wfile.write(TEST_SHOP_CONTENT)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def feed_url(settings, monkeypatch):
+    settings.FEED_RETRY_BACKOFF = 0
+    monkeypatch.setattr(feeds, "_session", None)
+    FeedHandler.failures_left = 0
+    FeedHandler.requests_count = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/shop.yaml"
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_session_is_shared(feed_url):
+    assert get_session() is get_session()
+
+
+def test_download_feed(feed_url):
+    with download_feed(feed_url) as download:
+        assert download.file.read() == TEST_SHOP_CONTENT
+        assert download.etag == '"v1"'
+        assert download.content_hash == sha256(TEST_SHOP_CONTENT).hexdigest()
+        assert download.not_modified == False
+
+
+def test_download_feed_retries_server_errors(feed_url):
+    FeedHandler.failures_left = 2
+    with download_feed(feed_url) as download:
+        assert download.file.read() == TEST_SHOP_CONTENT
+    assert FeedHandler.requests_count == 3
+
+
+def test_download_feed_too_large(feed_url, settings):
+    settings.FEED_MAX_SIZE = len(TEST_SHOP_CONTENT) - 1
+    with pytest.raises(FeedTooLargeError):
+        download_feed(feed_url)
+
+
+def test_download_feed_timeout(fake_feed, settings, monkeypatch):
+    fake_feed("tests/backend/models/test_shop.yaml")
+    settings.FEED_DOWNLOAD_TIMEOUT = 10
+    # каждый вызов часов сдвигает время на 4 секунды
+    clock = count(0, 4)
+    monkeypatch.setattr(feeds, "monotonic", lambda: next(clock))
+
+    # поставщик отдаёт прайс мелкими кусками, не нарушая таймаут чтения
+    monkeypatch.setattr(feeds, "DOWNLOAD_CHUNK_SIZE", 100)
+    with pytest.raises(FeedTimeoutError):
+        download_feed("https://test-shop.com/shop.yaml")
+
+    # весь прайс одним куском укладывается в отведённое время
+    monkeypatch.setattr(feeds, "DOWNLOAD_CHUNK_SIZE", len(TEST_SHOP_CONTENT))
+    with download_feed("https://test-shop.com/shop.yaml") as download:
+        assert download.file.read() == TEST_SHOP_CONTENT
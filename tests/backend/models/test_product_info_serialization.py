@@ -0,0 +1,182 @@
+import pytest
+import yaml
+from django.db import connection
+from django.db.models import Prefetch
+from django.db.models.signals import post_delete, pre_delete
+from rest_framework.renderers import JSONRenderer
+
+from backend.catalog import refresh_shop_catalog
+from backend.facets import refresh_shop_facets
+from backend.models import (
+    CatalogEntry,
+    ParameterFacet,
+    Product,
+    ProductInfo,
+    ProductParameter,
+    Shop,
+    User,
+)
+from backend.search import SEARCH_TABLE, index_shop
+from backend.serializers import (
+    ProductInfoSerializer,
+    catalog_entry_columns,
+    import_shop,
+    serialize_catalog_entries,
+)
+
+
+def render(data):
+    return JSONRenderer().render(data)
+
+
+def serializer_data(fields=None):
+    product_infos = (
+        ProductInfo.objects.order_by("id")
+        .select_related("product__category")
+        .prefetch_related(
+            Prefetch(
+                "product_parameters",
+                queryset=ProductParameter.objects.select_related("parameter").order_by(
+                    "id"
+                ),
+            )
+        )
+    )
+    data = ProductInfoSerializer(product_infos, many=True).data
+    if fields is None:
+        return data
+    return [{name: item[name] for name in item if name in fields} for item in data]
+
+
+def catalog_data(fields=None):
+    rows = CatalogEntry.objects.order_by("id").values(*catalog_entry_columns(fields))
+    return serialize_catalog_entries(list(rows), fields)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "fields",
+    [
+        None,
+        ["id", "price", "quantity"],
+        ["id", "product"],
+        ["model", "shop", "product_parameters"],
+    ],
+)
+def test_serialize_catalog_entries_matches_serializer(fields):
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    # пустые и необычные значения сериализуются так же
+    data["goods"][0]["model"] = ""
+    data["goods"][1]["parameters"] = {}
+    data["goods"][2]["parameters"]["Описание"] = 'кавычки " и \\\\ слэш'
+    result = import_shop(user, data)
+    assert result["Status"] == True
+
+    assert render(catalog_data(fields)) == render(serializer_data(fields))
+
+
+@pytest.mark.django_db
+def test_catalog_follows_imports_and_shop_changes():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(user, data)
+    assert CatalogEntry.objects.count() == len(data["goods"])
+
+    # дифференциальный импорт тоже пересобирает каталог
+    data["goods"][0]["price"] += 1
+    data["goods"][1]["parameters"]["Цвет"] = "зелёный"
+    del data["goods"][-1]
+    result = import_shop(user, data, diff=True)
+    assert result["Status"] == True
+    assert render(catalog_data()) == render(serializer_data())
+
+    # название и статус магазина переносятся в каталог
+    shop = Shop.objects.get(user=user)
+    shop.name = "Новое название"
+    shop.state = False
+    shop.save()
+    assert set(CatalogEntry.objects.values_list("shop_name", "shop_state")) == {
+        ("Новое название", False)
+    }
+
+    # названия категорий, товаров и параметров тоже
+    product_info = ProductInfo.objects.order_by("id").first()
+    product = product_info.product
+    product.name = "Новый товар"
+    product.save()
+    product.category.name = "Новая категория"
+    product.category.save()
+    product_parameter = product_info.product_parameters.first()
+    product_parameter.parameter.name = "Новый параметр"
+    product_parameter.parameter.save()
+    assert render(catalog_data()) == render(serializer_data())
+
+    # строка каталога удаляется вместе с позицией, её товаром или категорией;
+    # обработчиков удаления позиций нет, чтобы импорт удалял их без загрузки
+    assert not post_delete.has_listeners(ProductInfo)
+    assert not pre_delete.has_listeners(ProductInfo)
+    product_info.delete()
+    Product.objects.filter(category__name="Новая категория").delete()
+    assert CatalogEntry.objects.count() == ProductInfo.objects.count() > 0
+    assert render(catalog_data()) == render(serializer_data())
+
+
+def derived_rows(shop_id):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, shop_id, name, model, parameters FROM {SEARCH_TABLE} "
+            "ORDER BY rowid"
+        )
+        search_rows = cursor.fetchall()
+    facets = sorted(
+        ParameterFacet.objects.filter(shop_id=shop_id).values_list(
+            "category_id", "parameter_id", "value", "count"
+        )
+    )
+    return render(catalog_data()), search_rows, facets
+
+
+@pytest.mark.django_db
+def test_diff_import_updates_only_changed_rows():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(user, data)
+    shop = Shop.objects.get(user=user)
+
+    # только цена: поисковый индекс и фильтры не трогаются
+    data["goods"][0]["price"] += 1
+    result = import_shop(user, data, diff=True)
+    assert result["Status"] == True
+    assert result["timings"]["catalog"]["rows"] == 1
+    assert result["timings"]["search_index"]["rows"] == 0
+    assert result["timings"]["facets"]["rows"] == 0
+
+    # параметр, новый и пропавший товары
+    data["goods"][1]["parameters"]["Цвет"] = "зелёный"
+    data["goods"].append(
+        dict(data["goods"][2], id=1, name="Новый товар", model="new/model")
+    )
+    del data["goods"][3]
+    result = import_shop(user, data, diff=True)
+    assert result["Status"] == True
+    assert result["timings"]["catalog"]["rows"] == 2
+    assert result["timings"]["search_index"]["rows"] == 2
+    assert CatalogEntry.objects.count() == len(data["goods"])
+
+    # результат совпадает с полной пересборкой
+    rows = derived_rows(shop.id)
+    index_shop(shop.id)
+    refresh_shop_facets(shop.id)
+    refresh_shop_catalog(shop.id)
+    assert derived_rows(shop.id) == rows
+    assert render(catalog_data()) == render(serializer_data())
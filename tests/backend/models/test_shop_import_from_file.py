@@ -1,9 +1,13 @@
 import pytest
 import yaml
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from backend.models import (
+    CatalogEntry,
     Category,
     Parameter,
+    ParameterFacet,
     Product,
     ProductInfo,
     ProductParameter,
@@ -11,6 +15,7 @@ from backend.models import (
     User,
 )
 
+from backend import serializers
 from backend.serializers import import_shop
 
 def test_read_test_shop_file():
@@ -84,3 +89,281 @@ def test_import_test_shop():
                 product_info_id=product_info.id, parameter_id=parameter_object.id
             ).first()
             assert product_parameter.value == str(value)
+
+
+@pytest.mark.django_db
+def test_import_test_shop_bulk_queries(django_assert_max_num_queries):
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+
+    # число запросов не должно зависеть от числа товаров и параметров;
+    # в тесте транзакции этапов - точки сохранения, по 2 запроса на этап
+    with django_assert_max_num_queries(49):
+        result = import_shop(user, data)
+    assert result["Status"] == True
+
+    # повторный импорт переиспользует справочники
+    with django_assert_max_num_queries(49):
+        result = import_shop(user, data)
+    assert result["Status"] == True
+    assert Category.objects.count() == len(data["categories"])
+    assert Product.objects.count() == len(data["goods"])
+    assert ProductInfo.objects.count() == len(data["goods"])
+    parameters = {name for item in data["goods"] for name in item["parameters"]}
+    assert Parameter.objects.count() == len(parameters)
+    assert ProductParameter.objects.count() == sum(
+        len(item["parameters"]) for item in data["goods"]
+    )
+
+
+@pytest.mark.django_db
+def test_import_test_shop_profile():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+
+    with CaptureQueriesContext(connection) as queries:
+        result = import_shop(user, data)
+    assert result["Status"] == True
+
+    timings = result["timings"]
+    for stage in ("categories", "products", "parameters", "product_infos"):
+        assert timings[stage]["time"] >= 0
+        assert timings[stage]["queries"] > 0
+    assert timings["categories"]["rows"] == len(data["categories"])
+    assert timings["products"]["rows"] == len(data["goods"])
+    assert timings["product_infos"]["rows"] == ProductInfo.objects.count() + (
+        ProductParameter.objects.count()
+    )
+    # все запросы импорта отнесены к какому-либо этапу
+    assert sum(stage["queries"] for stage in timings.values()) <= len(queries)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_test_shop_failure_keeps_old_price_list():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    result = import_shop(user, data)
+    assert result["Status"] == True
+    old_prices = dict(ProductInfo.objects.values_list("id", "price"))
+    old_parameters_count = ProductParameter.objects.count()
+
+    # ошибка в последнем товаре не должна оставить магазин пустым
+    data["goods"][0]["price"] = 1
+    data["goods"][-1]["price"] = "не число"
+    result = import_shop(user, data)
+    assert result["Status"] == False
+    assert "Error" in result
+
+    assert dict(ProductInfo.objects.values_list("id", "price")) == old_prices
+    assert ProductParameter.objects.count() == old_parameters_count
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_test_shop_catalog_with_price_list(monkeypatch):
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    result = import_shop(user, data)
+    assert result["Status"] == True
+    old_catalog = set(CatalogEntry.objects.values_list("id", "price"))
+
+    def failed_refresh_shop_catalog(*args):
+        raise RuntimeError("сбой каталога")
+
+    # каталог пишется в транзакции прайса: при его сбое остаётся старый прайс
+    monkeypatch.setattr(
+        serializers, "refresh_shop_catalog", failed_refresh_shop_catalog
+    )
+    data["goods"][0]["price"] = 1
+    result = import_shop(user, data)
+    assert result["Status"] == False
+    assert set(CatalogEntry.objects.values_list("id", "price")) == old_catalog
+    assert set(ProductInfo.objects.values_list("id", "price")) == old_catalog
+    assert Shop.objects.get(user=user).catalog_dirty == False
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_test_shop_derived_tables_after_commit(monkeypatch):
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    index_shop = serializers.index_shop
+    index_savepoints = []
+
+    def checked_index_shop(*args):
+        # транзакция индекса - внешняя, а не вложенная в транзакцию прайса
+        index_savepoints.append(list(connection.savepoint_ids))
+        return index_shop(*args)
+
+    def failed_refresh_shop_facets(*args):
+        raise RuntimeError("сбой фильтров")
+
+    monkeypatch.setattr(serializers, "index_shop", checked_index_shop)
+    monkeypatch.setattr(
+        serializers, "refresh_shop_facets", failed_refresh_shop_facets
+    )
+    result = import_shop(user, data)
+    assert index_savepoints == [[]]
+    assert result["Status"] == False
+    assert "Прайс сохранён" in result["Error"]
+    assert ProductInfo.objects.count() == len(data["goods"])
+    assert set(CatalogEntry.objects.values_list("id", flat=True)) == set(
+        ProductInfo.objects.values_list("id", flat=True)
+    )
+    assert ParameterFacet.objects.count() == 0
+    assert Shop.objects.get(user=user).catalog_dirty == True
+
+    # следующий импорт без изменений перестраивает фильтры целиком
+    monkeypatch.undo()
+    result = import_shop(user, data, diff=True)
+    assert result["Status"] == True
+    assert result["summary"]["product_infos"] == {
+        "created": 0,
+        "updated": 0,
+        "deleted": 0,
+    }
+    assert Shop.objects.get(user=user).catalog_dirty == False
+    assert ParameterFacet.objects.count() > 0
+
+
+@pytest.mark.django_db
+def test_import_test_shop_diff():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    result = import_shop(user, data, diff=True)
+    assert result["Status"] == True
+    assert result["summary"]["product_infos"] == {
+        "created": len(data["goods"]),
+        "updated": 0,
+        "deleted": 0,
+    }
+    old_infos_id = dict(ProductInfo.objects.values_list("product_id", "id"))
+
+    # без изменений ничего не пишем
+    result = import_shop(user, data, diff=True)
+    assert result["summary"]["product_infos"] == {"created": 0, "updated": 0, "deleted": 0}
+
+    changed_price = data["goods"][0]
+    changed_price["price"] += 1
+    changed_parameter = data["goods"][1]
+    name = next(iter(changed_parameter["parameters"]))
+    changed_parameter["parameters"][name] = "новое значение"
+    vanished = data["goods"].pop()
+    new_good = dict(
+        data["goods"][2], id=1, name="Новый товар", model="new/model", parameters={}
+    )
+    data["goods"].append(new_good)
+
+    result = import_shop(user, data, diff=True)
+    assert result["Status"] == True
+    assert result["summary"]["product_infos"] == {"created": 1, "updated": 2, "deleted": 1}
+
+    actual_products_id = result["actual_products_id"]
+    # неизменённые и обновлённые товары сохранили свои id
+    for item in data["goods"][:-1]:
+        product_id = actual_products_id[item["id"]]
+        assert ProductInfo.objects.get(product_id=product_id).id == old_infos_id[
+            product_id
+        ]
+
+    product_info = ProductInfo.objects.get(
+        product_id=actual_products_id[changed_price["id"]]
+    )
+    assert product_info.price == changed_price["price"]
+    product_parameter = ProductParameter.objects.get(
+        product_info__product_id=actual_products_id[changed_parameter["id"]],
+        parameter__name=name,
+    )
+    assert product_parameter.value == "новое значение"
+    assert not ProductInfo.objects.filter(
+        product__name=vanished["name"], model=vanished["model"]
+    ).exists()
+    assert ProductInfo.objects.filter(
+        product_id=actual_products_id[new_good["id"]]
+    ).exists()
+    assert ProductInfo.objects.count() == len(data["goods"])
+
+
+@pytest.mark.parametrize("diff", [False, True])
+@pytest.mark.django_db
+def test_import_test_shop_duplicate_goods(diff):
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    # другой id в прайсе, но тот же продукт (название и категория)
+    data["goods"].append(dict(data["goods"][0], id=1, model="other/model"))
+
+    result = import_shop(user, data, diff=diff)
+    assert result["Status"] == False
+    assert "повторяется" in result["Error"]
+    assert ProductInfo.objects.count() == 0
+
+
+def count_table_queries(queries, table):
+    return len([query for query in queries if f'FROM "{table}"' in query["sql"]])
+
+
+@pytest.mark.django_db
+def test_import_test_shop_shared_name_cache(settings, monkeypatch):
+    settings.IMPORT_SHARED_NAME_CACHE = True
+    monkeypatch.setattr("backend.serializers._shared_name_cache", {})
+    monkeypatch.setattr("backend.serializers.IMPORT_BATCH_SIZE", 3)
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+
+    # в пределах одного импорта к базе обращаются только пачки с новыми
+    # параметрами: поиск до создания и после него
+    batches_with_new_parameters = 0
+    parameters = set()
+    for i in range(0, len(data["goods"]), 3):
+        names = {
+            name for item in data["goods"][i : i + 3] for name in item["parameters"]
+        }
+        if names - parameters:
+            batches_with_new_parameters += 1
+        parameters |= names
+
+    with CaptureQueriesContext(connection) as queries:
+        result = import_shop(user, data)
+    assert result["Status"] == True
+    assert result["summary"]["parameters"]["created"] == len(parameters)
+    assert (
+        count_table_queries(queries, "backend_parameter")
+        == 2 * batches_with_new_parameters
+    )
+
+    # следующий импорт берёт справочники из общего кэша
+    with CaptureQueriesContext(connection) as queries:
+        result = import_shop(user, data)
+    assert result["Status"] == True
+    assert count_table_queries(queries, "backend_parameter") == 0
+    assert count_table_queries(queries, "backend_category") == 0
+
+    # изменение справочника сбрасывает кэш
+    Parameter.objects.first().delete()
+    with CaptureQueriesContext(connection) as queries:
+        result = import_shop(user, data)
+    assert result["Status"] == True
+    assert count_table_queries(queries, "backend_parameter") > 0
+    assert Parameter.objects.count() == len(parameters)
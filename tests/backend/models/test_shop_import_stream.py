@@ -0,0 +1,169 @@
+import json
+
+import pytest
+import yaml
+
+from backend.feeds import (
+    iter_ndjson_records,
+    iter_yaml_records,
+    load_yaml_feed,
+    timed_records,
+)
+from backend.models import ProductInfo, ProductParameter, User
+from backend.profiling import ImportProfile
+from backend.serializers import import_shop_records
+
+
+def load_test_shop():
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def to_ndjson(data):
+    lines = [
+        json.dumps(
+            {"shop": data["shop"], "categories": data["categories"]},
+            ensure_ascii=False,
+        )
+    ]
+    lines += [json.dumps(item, ensure_ascii=False) for item in data["goods"]]
+    return "\n".join(lines).encode("utf-8").splitlines()
+
+
+def test_iter_yaml_records_test_shop_file():
+    data = load_test_shop()
+    with open("tests/backend/models/test_shop.yaml", "rb") as f:
+        records = list(iter_yaml_records(f))
+
+    assert records[0] == ("shop", data["shop"])
+    assert records[1] == ("categories", data["categories"])
+    assert records[2:] == [("goods", item) for item in data["goods"]]
+
+
+def test_iter_yaml_records_pure_python_loader():
+    with open("tests/backend/models/test_shop.yaml", "rb") as f:
+        fast_records = list(iter_yaml_records(f))
+    with open("tests/backend/models/test_shop.yaml", "rb") as f:
+        slow_records = list(iter_yaml_records(f, loader_class=yaml.SafeLoader))
+    assert fast_records == slow_records
+
+
+@pytest.mark.parametrize("loader_class", [None, yaml.SafeLoader])
+def test_iter_yaml_records_single_document(loader_class):
+    kwargs = {"loader_class": loader_class} if loader_class else {}
+    # поток из нескольких документов, как и yaml.safe_load, не принимаем
+    feed = "shop: Магазин\n---\nshop: Другой магазин\n"
+    with pytest.raises(ValueError):
+        list(iter_yaml_records(feed.encode(), **kwargs))
+    # а один документ можно завершить явно
+    feed = "shop: Магазин\n...\n"
+    assert list(iter_yaml_records(feed.encode(), **kwargs)) == [("shop", "Магазин")]
+
+
+@pytest.mark.parametrize("loader_class", [None, yaml.SafeLoader])
+def test_iter_yaml_records_anchors(loader_class):
+    feed = """
+shop: Магазин
+categories:
+  - id: 1
+    name: &category Смартфоны
+goods:
+  - id: 1
+    category: 1
+    model: &model apple/iphone
+    name: *category
+    price: 100
+    price_rrc: 110
+    quantity: 1
+    parameters: &parameters
+      Цвет: черный
+  - id: 2
+    category: 1
+    model: *model
+    name: Другой
+    price: 100
+    price_rrc: 110
+    quantity: 1
+    parameters: *parameters
+"""
+    kwargs = {"loader_class": loader_class} if loader_class else {}
+    records = list(iter_yaml_records(feed.encode(), **kwargs))
+    data = yaml.safe_load(feed)
+    assert records == [
+        ("shop", data["shop"]),
+        ("categories", data["categories"]),
+    ] + [("goods", item) for item in data["goods"]]
+    assert records[3][1]["parameters"] == {"Цвет": "черный"}
+
+
+def test_load_yaml_feed():
+    with open("tests/backend/models/test_shop.yaml", "rb") as f:
+        assert load_yaml_feed(f) == load_test_shop()
+
+    # небезопасные теги python не исполняются
+    with pytest.raises(yaml.YAMLError):
+        load_yaml_feed("shop: !!python/object/apply:os.getcwd []")
+
+
+def test_timed_records():
+    profile = ImportProfile()
+    records = list(timed_records(iter([("shop", "test")]), profile))
+    assert records == [("shop", "test")]
+    assert profile.report()["parse"]["time"] >= 0
+
+
+def test_iter_ndjson_records():
+    data = load_test_shop()
+    records = list(iter_ndjson_records(to_ndjson(data)))
+
+    assert records[0] == ("shop", data["shop"])
+    assert records[1] == ("categories", data["categories"])
+    assert records[2:] == [("goods", item) for item in data["goods"]]
+
+
+@pytest.mark.django_db
+def test_import_shop_records_from_yaml_stream():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    data = load_test_shop()
+    with open("tests/backend/models/test_shop.yaml", "rb") as f:
+        result = import_shop_records(user, iter_yaml_records(f))
+
+    assert result["Status"] == True
+    assert len(result["actual_products_id"]) == len(data["goods"])
+    assert ProductInfo.objects.count() == len(data["goods"])
+    assert ProductParameter.objects.count() == sum(
+        len(item["parameters"]) for item in data["goods"]
+    )
+
+
+@pytest.mark.django_db
+def test_import_shop_records_from_ndjson_in_small_batches(monkeypatch):
+    monkeypatch.setattr("backend.serializers.IMPORT_BATCH_SIZE", 3)
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    data = load_test_shop()
+
+    result = import_shop_records(user, iter_ndjson_records(to_ndjson(data)))
+    assert result["Status"] == True
+    assert result["summary"]["product_infos"]["created"] == len(data["goods"])
+    assert ProductInfo.objects.count() == len(data["goods"])
+
+    result = import_shop_records(
+        user, iter_ndjson_records(to_ndjson(data)), diff=True
+    )
+    assert result["Status"] == True
+    assert result["summary"]["product_infos"] == {
+        "created": 0,
+        "updated": 0,
+        "deleted": 0,
+    }
+
+
+@pytest.mark.django_db
+def test_import_shop_records_goods_before_categories():
+    user = User.objects.create_user(email="test_user@test_mail.com", type="shop")
+    data = load_test_shop()
+    records = [("shop", data["shop"]), ("goods", data["goods"][0])]
+
+    result = import_shop_records(user, records)
+    assert result["Status"] == False
+    assert ProductInfo.objects.count() == 0
@@ -0,0 +1,143 @@
+import json
+import subprocess
+import sys
+
+import pytest
+import yaml
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from backend.metrics import SIGNAL_HANDLER_CALLS, render_metrics, reset_metrics
+from backend.models import User
+from backend.serializers import import_shop
+
+
+def metric_samples(content):
+    samples = {}
+    for line in content.decode().splitlines():
+        if line and not line.startswith("#"):
+            sample, value = line.rsplit(" ", 1)
+            samples[sample] = float(value)
+    return samples
+
+
+@pytest.mark.django_db
+def test_metrics(settings):
+    reset_metrics()
+    settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+    user = User.objects.create_user(
+        email="shop@test.com", password="test_password", type="shop"
+    )
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(user, data)
+    assert import_shop(user, {"shop": "no categories"})["Status"] == False
+
+    client = APIClient()
+    for _ in range(2):
+        client.get(reverse("list_shops"))
+    client.get(reverse("list_shops"), {"shop_id": "abc"})
+    client.post(reverse("password_reset"), {"email": user.email})
+
+    resp = client.get(reverse("metrics"))
+    assert resp.status_code == 200
+    assert resp["Content-Type"].startswith("text/plain; version=0.0.4")
+    samples = metric_samples(resp.content)
+
+    requests = 'goods_http_requests_total{view="list_shops",method="GET",status="%s"}'
+    assert samples[requests % 200] == 2
+    assert samples[requests % 403] == 1
+    duration = 'goods_http_request_duration_seconds_%s{view="list_shops"%s}'
+    assert samples[duration % ("count", "")] == 3
+    assert samples[duration % ("bucket", ',le="+Inf"')] == 3
+    queries = 'goods_http_request_db_queries_bucket{view="list_shops",le="1"}'
+    assert samples[queries] == 3
+
+    assert samples['goods_imports_total{status="done"}'] == 1
+    assert samples['goods_imports_total{status="failed"}'] == 1
+    assert samples["goods_imported_goods_total"] == len(data["goods"])
+    imports = 'goods_import_duration_seconds_count{stage="%s"}'
+    assert samples[imports % "total"] == 2
+    assert samples[imports % "product_infos"] == 1
+
+    assert samples['goods_emails_sent_total{kind="password_reset"}'] == 1
+    handler_calls = 'goods_signal_handler_calls_total{handler="%s"}'
+    assert samples[handler_calls % "password_reset_token_created"] == 1
+    assert samples[handler_calls % "catalog_cache_invalidation"] >= 1
+    reset_metrics()
+
+
+@pytest.mark.django_db
+def test_metrics_shared_dir(settings, tmp_path):
+    reset_metrics()
+    settings.METRICS_DIR = tmp_path
+    user = User.objects.create_user(email="shop@test.com", type="shop")
+    import_shop(user, {"shop": "no categories"})
+
+    # значения другого процесса, записанные в общий каталог
+    (tmp_path / "1-1.json").write_text(
+        json.dumps(
+            {
+                "goods_imports_total": [[["failed"], 2], [["done"], 1]],
+                "goods_import_duration_seconds": [
+                    [["total"], [[1, 0, 0, 0, 0, 0, 0, 0, 0, 0], 0.05, 1]]
+                ],
+                "unknown_metric": [[[], 1]],
+            }
+        ),
+        encoding="utf-8",
+    )
+
+    resp = APIClient().get(reverse("metrics"))
+    samples = metric_samples(resp.content)
+    assert samples['goods_imports_total{status="failed"}'] == 3
+    assert samples['goods_imports_total{status="done"}'] == 1
+    imports = 'goods_import_duration_seconds_%s{stage="total"%s}'
+    assert samples[imports % ("count", "")] == 2
+    assert samples[imports % ("bucket", ',le="0.1"')] >= 1
+    # свои значения процесс тоже записал в общий каталог
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    reset_metrics()
+
+
+@pytest.mark.django_db
+def test_metrics_aggregate_finished(settings, tmp_path):
+    reset_metrics()
+    settings.METRICS_DIR = tmp_path
+    # pid завершившегося процесса
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    for i in range(2):
+        (tmp_path / f"{process.pid}-{i}.json").write_text(
+            json.dumps({"goods_imports_total": [[["failed"], 2]]}), encoding="utf-8"
+        )
+
+    client = APIClient()
+    for _ in range(2):
+        samples = metric_samples(client.get(reverse("metrics")).content)
+        # значения не теряются и не учитываются дважды
+        assert samples['goods_imports_total{status="failed"}'] == 4
+
+    # файлы завершившегося процесса перенесены в общий файл, остался файл
+    # текущего процесса
+    files = sorted(path.name for path in tmp_path.glob("*.json"))
+    assert len(files) == 2
+    assert "aggregate.json" in files
+    assert not any(name.startswith(f"{process.pid}-") for name in files)
+    reset_metrics()
+
+
+def test_metrics_escaping(monkeypatch):
+    reset_metrics()
+    monkeypatch.setattr(
+        SIGNAL_HANDLER_CALLS, "documentation", 'Вызовы "обработчиков"\\\nсигналов'
+    )
+    SIGNAL_HANDLER_CALLS.inc(handler='a "b"\\\nc')
+    lines = render_metrics().splitlines()
+    # в HELP кавычки не экранируются, в значениях меток - экранируются
+    help_text = r'Вызовы "обработчиков"\\\nсигналов'
+    assert f"# HELP goods_signal_handler_calls_total {help_text}" in lines
+    assert r'goods_signal_handler_calls_total{handler="a \"b\"\\\nc"} 1' in lines
+    reset_metrics()
@@ -1,9 +1,21 @@
+import json
+from base64 import urlsafe_b64encode
+
 import pytest
 import yaml
 from django.urls import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
-from backend.models import Category, User
+from backend.cache import (
+    bump_catalog_version,
+    catalog_version,
+    get_catalog_cache,
+    get_catalog_version_cache,
+)
+from backend.models import Category, ProductInfo, Shop, User
+from backend import serializers
 from backend.serializers import import_shop
 
 
@@ -185,3 +197,649 @@ def test_list_products_special_category_and_shop():
                     item_parametr = _
             assert item_parametr is not None, item
             assert item_parametr["value"] == str(value), item
+
+
+@pytest.mark.django_db
+def test_list_products_pages():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+    params = {"limit": 2}
+    items = []
+    pages = 0
+    while True:
+        resp = client.get(url, params)
+        assert resp.status_code == 200, resp.json()["Error"]
+        resp_json = resp.json()
+        assert len(resp_json["products"]) <= 2
+        items.extend(resp_json["products"])
+        pages += 1
+        if resp_json["next"] is None:
+            break
+        params["cursor"] = resp_json["next"]
+
+    # страницы идут по id без пропусков и повторов
+    ids = [item["id"] for item in items]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(data["goods"])
+    assert pages == (len(data["goods"]) + 1) // 2
+
+
+@pytest.mark.django_db
+def test_list_products_page_is_stable_under_import():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+    resp = client.get(url, {"limit": 3})
+    first_page = [item["id"] for item in resp.json()["products"]]
+    cursor = resp.json()["next"]
+
+    # новые товары получают большие id и попадают только в конец выдачи
+    other_shop = User.objects.create_user(email="other_shop@test.com", type="shop")
+    data["shop"] = "Другой магазин"
+    import_shop(other_shop, data)
+
+    resp = client.get(url, {"limit": 3, "cursor": cursor})
+    second_page = [item["id"] for item in resp.json()["products"]]
+    assert min(second_page) > max(first_page)
+    assert second_page == sorted(second_page)
+
+
+@pytest.mark.django_db
+def test_list_products_bad_cursor():
+    client = APIClient()
+    url = reverse("list_products")
+    resp = client.get(url, {"cursor": "не курсор"})
+    assert resp.status_code == 403
+    assert resp.json()["Status"] == False
+
+    resp = client.get(url, {"limit": 0})
+    assert resp.status_code == 403
+    assert resp.json()["Status"] == False
+
+    resp = client.get(url, {"shop_id": "abc"})
+    assert resp.status_code == 403
+    assert resp.json()["Status"] == False
+
+
+# версия каталога меняется после фиксации транзакции
+@pytest.mark.django_db(transaction=True)
+def test_list_products_cache():
+    password = "test_password"
+    shop = User.objects.create_user(
+        email="shop@test.com", password=password, type="shop"
+    )
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+    params = {"shop_id": shop.shop.id}
+    first = client.get(url, params).json()
+
+    # повторный запрос отдаётся из кэша без обращения к базе
+    with CaptureQueriesContext(connection) as queries:
+        assert client.get(url, params).json() == first
+    assert len(queries) == 0
+
+    # импорт прайса сбрасывает кэш
+    data["goods"][0]["price"] += 1
+    import_shop(shop, data)
+    resp_json = client.get(url, params).json()
+    assert resp_json != first
+    assert ProductInfo.objects.filter(price=data["goods"][0]["price"]).exists()
+    assert data["goods"][0]["price"] in [item["price"] for item in resp_json["products"]]
+
+    assert client.get(url).json()["products"] != []
+
+    # как и выключение магазина
+    resp = client.post(reverse("login_user"), {"email": shop.email, "password": password})
+    header = {"Authorization": f"Token {resp.json()['token']}"}
+    resp = client.post(reverse("partner_state"), {"state": False}, headers=header)
+    assert resp.status_code == 200, resp.json()["Error"]
+    assert client.get(url, params).json()["products"] == []
+    assert client.get(url).json()["products"] == []
+
+
+@pytest.mark.django_db(transaction=True)
+def test_list_products_follows_catalog_edits():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+    products = client.get(url).json()["products"]
+
+    # переименование категории (например, из админки) сбрасывает кэш
+    product_info = ProductInfo.objects.get(id=products[0]["id"])
+    category = product_info.product.category
+    category.name = "Новая категория"
+    category.save()
+    products = client.get(url).json()["products"]
+    assert products[0]["product"]["category"] == "Новая категория"
+
+    # позиции удалённого товара пропадают из каталога
+    product_info.product.delete()
+    products = client.get(url).json()["products"]
+    assert product_info.id not in [item["id"] for item in products]
+    assert len(products) == len(data["goods"]) - 1
+
+    # и позиции удалённой категории
+    category = ProductInfo.objects.get(id=products[0]["id"]).product.category
+    category.delete()
+    products = client.get(url).json()["products"]
+    assert len(products) == ProductInfo.objects.count() > 0
+    assert category.name not in [item["product"]["category"] for item in products]
+
+
+def search(client, params):
+    resp = client.get(reverse("search_products"), params)
+    assert resp.status_code == 200, resp.json()["Error"]
+    return resp.json()
+
+
+@pytest.mark.django_db
+def test_search_products():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+    client = APIClient()
+
+    # по названию, без учёта регистра и по префиксу слова
+    items = search(client, {"q": "IPHONE"})["products"]
+    names = {item["product"]["name"] for item in items}
+    assert names == {good["name"] for good in data["goods"] if "iPhone" in good["name"]}
+
+    # все слова запроса обязательны
+    items = search(client, {"q": "iphone 128"})["products"]
+    assert [item["product"]["name"] for item in items] == [
+        "Смартфон Apple iPhone XR 128GB (синий)"
+    ]
+
+    # по модели и по значению параметра
+    items = search(client, {"q": "galaxy-note20"})["products"]
+    assert [item["model"] for item in items] == ["samsung/galaxy-note20"]
+    items = search(client, {"q": "золотистый"})["products"]
+    assert [item["model"] for item in items] == ["apple/iphone/xs-max"]
+
+    assert search(client, {"q": "несуществующий"})["products"] == []
+
+
+@pytest.mark.django_db
+def test_search_products_ranked_pages():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+    client = APIClient()
+
+    expected = search(client, {"q": "smart", "limit": 100})["products"]
+    assert len(expected) > 3
+
+    items = []
+    params = {"q": "smart", "limit": 2}
+    while True:
+        resp_json = search(client, params)
+        items.extend(resp_json["products"])
+        if resp_json["next"] is None:
+            break
+        params["cursor"] = resp_json["next"]
+    assert [item["id"] for item in items] == [item["id"] for item in expected]
+
+
+# версия каталога меняется после фиксации транзакции
+@pytest.mark.django_db(transaction=True)
+def test_search_products_follows_imports():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+    client = APIClient()
+    assert len(search(client, {"q": "sony"})["products"]) == 1
+
+    # после повторного импорта без товара он больше не находится
+    data["goods"] = [good for good in data["goods"] if "Sony" not in good["name"]]
+    import_shop(shop, data)
+    assert search(client, {"q": "sony"})["products"] == []
+    assert len(search(client, {"q": "samsung"})["products"]) == 3
+
+    # товары выключенного магазина не ищутся
+    Shop.objects.filter(id=shop.shop.id).update(state=False)
+    get_catalog_cache().clear()
+    assert search(client, {"q": "samsung"})["products"] == []
+
+
+@pytest.mark.django_db
+def test_search_products_no_query():
+    client = APIClient()
+    resp = client.get(reverse("search_products"))
+    assert resp.status_code == 403
+    assert resp.json()["Status"] == False
+
+    resp = client.get(reverse("search_products"), {"q": "%*\""})
+    assert resp.status_code == 403
+    assert resp.json()["Status"] == False
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"shop_id": "abc"},
+        {"cursor": "не курсор"},
+        # курсор правильного вида, но не из (id позиции, ранг)
+        {"cursor": urlsafe_b64encode(b'["a", "b"]').decode()},
+        {"limit": 0},
+    ],
+)
+def test_search_products_bad_params(params):
+    # некорректные параметры отклоняются так же, как в списке товаров
+    client = APIClient()
+    for name in ("search_products", "list_products"):
+        resp = client.get(reverse(name), dict(params, q="smartphone"))
+        assert resp.status_code == 403
+        assert resp.json()["Status"] == False
+
+
+def expected_facets(goods):
+    facets = {}
+    for good in goods:
+        for name, value in good["parameters"].items():
+            values = facets.setdefault(name, {})
+            values[str(value)] = values.get(str(value), 0) + 1
+    return facets
+
+
+@pytest.mark.django_db
+def test_list_products_parameter_filters():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+
+    def models(params):
+        resp = client.get(url, params)
+        assert resp.status_code == 200, resp.json()["Error"]
+        return sorted(item["model"] for item in resp.json()["products"])
+
+    def expected(**filters):
+        return sorted(
+            good["model"]
+            for good in data["goods"]
+            if all(
+                str(good["parameters"].get(name)) in values
+                for name, values in filters.items()
+            )
+        )
+
+    assert models({"param": "Цвет=черный"}) == expected(Цвет=["черный"])
+    # значения одного параметра объединяются, разные параметры пересекаются
+    assert models({"param": ["Цвет=черный", "Цвет=красный"]}) == expected(
+        Цвет=["черный", "красный"]
+    )
+    assert models(
+        {"param": ["Цвет=черный", "Цвет=красный", "Встроенная память (Гб)=256"]}
+    ) == expected(**{"Цвет": ["черный", "красный"], "Встроенная память (Гб)": ["256"]})
+    assert models({"param": "Цвет=фиолетовый"}) == []
+
+    resp = client.get(url, {"param": "без значения"})
+    assert resp.status_code == 403
+
+
+# версия каталога меняется после фиксации транзакции
+@pytest.mark.django_db(transaction=True)
+def test_list_product_facets():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    result = import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_product_facets")
+    resp = client.get(url)
+    assert resp.status_code == 200, resp.json()["Error"]
+    assert resp.json()["facets"] == expected_facets(data["goods"])
+
+    category = data["categories"][0]["id"]
+    resp = client.get(
+        url, {"category_id": result["actual_categories_id"][category]}
+    )
+    assert resp.json()["facets"] == expected_facets(
+        [good for good in data["goods"] if good["category"] == category]
+    )
+
+    # счётчики пересчитываются при импорте и суммируются по магазинам
+    other_shop = User.objects.create_user(email="other_shop@test.com", type="shop")
+    data["shop"] = "Другой магазин"
+    data["goods"] = data["goods"][:3]
+    import_shop(other_shop, data)
+    resp = client.get(url, {"shop_id": other_shop.shop.id})
+    assert resp.json()["facets"] == expected_facets(data["goods"])
+    resp = client.get(url)
+    assert resp.json()["facets"]["Цвет"]["золотистый"] == 2
+
+    # без GROUP BY по параметрам товаров
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url, {"shop_id": shop.shop.id})
+    assert not any(
+        "backend_productparameter" in query["sql"] for query in queries.captured_queries
+    )
+
+
+def all_pages(client, params):
+    url = reverse("list_products")
+    params = dict(params)
+    items = []
+    while True:
+        resp = client.get(url, params)
+        assert resp.status_code == 200, resp.json()["Error"]
+        items.extend(resp.json()["products"])
+        if resp.json()["next"] is None:
+            return items
+        params["cursor"] = resp.json()["next"]
+
+
+@pytest.mark.django_db
+def test_list_products_price_filters_and_ordering():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    # одинаковые цены проверяют постраничную выдачу при равных значениях
+    data["goods"][1]["price"] = data["goods"][2]["price"] = data["goods"][3]["price"]
+    data["goods"][0]["quantity"] = 0
+    import_shop(shop, data)
+    client = APIClient()
+    goods = data["goods"]
+
+    items = all_pages(client, {"ordering": "price", "limit": 2})
+    assert [item["price"] for item in items] == sorted(good["price"] for good in goods)
+    ids = [item["id"] for item in items]
+    assert len(set(ids)) == len(goods)
+
+    items = all_pages(client, {"ordering": "-price", "limit": 3})
+    assert [item["price"] for item in items] == sorted(
+        (good["price"] for good in goods), reverse=True
+    )
+
+    items = all_pages(client, {"ordering": "name", "limit": 4})
+    assert [item["product"]["name"] for item in items] == sorted(
+        good["name"] for good in goods
+    )
+    items = all_pages(client, {"ordering": "-name", "limit": 4})
+    assert [item["product"]["name"] for item in items] == sorted(
+        (good["name"] for good in goods), reverse=True
+    )
+
+    price_min, price_max = 50000, 120000
+    items = all_pages(
+        client,
+        {"price_min": price_min, "price_max": price_max, "ordering": "price"},
+    )
+    assert [item["price"] for item in items] == sorted(
+        good["price"] for good in goods if price_min <= good["price"] <= price_max
+    )
+
+    items = all_pages(client, {"in_stock": "true"})
+    assert len(items) == len(goods) - 1
+    assert all(item["quantity"] > 0 for item in items)
+
+    resp = client.get(reverse("list_products"), {"ordering": "quantity"})
+    assert resp.status_code == 403
+    resp = client.get(reverse("list_products"), {"price_min": "-1"})
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_list_products_sparse_fields():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+    client = APIClient()
+    url = reverse("list_products")
+
+    # без fields и expand ответ не меняется
+    with CaptureQueriesContext(connection) as queries:
+        full = client.get(url).json()["products"]
+    # одна таблица каталога без соединений
+    assert len(queries) == 1
+    assert "JOIN" not in queries.captured_queries[0]["sql"]
+    assert set(full[0]) == {
+        "id",
+        "model",
+        "product",
+        "shop",
+        "quantity",
+        "price",
+        "price_rrc",
+        "product_parameters",
+    }
+
+    # только нужные столбцы
+    get_catalog_cache().clear()
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(url, {"fields": "id,price,quantity"})
+    assert resp.status_code == 200, resp.json()["Error"]
+    items = resp.json()["products"]
+    assert items == [
+        {"id": item["id"], "price": item["price"], "quantity": item["quantity"]}
+        for item in full
+    ]
+    assert len(queries) == 1
+    assert "parameters" not in queries.captured_queries[0]["sql"]
+    assert "product_name" not in queries.captured_queries[0]["sql"]
+
+    # expand добавляет вложенные объекты к полям
+    with CaptureQueriesContext(connection) as queries:
+        items = client.get(url, {"fields": "id", "expand": "product"}).json()["products"]
+    assert items == [{"id": item["id"], "product": item["product"]} for item in full]
+    assert len(queries) == 1
+
+    items = client.get(url, {"expand": "product_parameters"}).json()["products"]
+    assert items == [
+        {key: value for key, value in item.items() if key != "product"}
+        for item in full
+    ]
+
+    # по имени сортируется и без вложенного товара в ответе
+    items = client.get(url, {"fields": "id", "ordering": "name", "limit": 2}).json()
+    assert set(items["products"][0]) == {"id"}
+    assert items["next"] is not None
+
+    resp = client.get(url, {"fields": "id,password"})
+    assert resp.status_code == 403
+
+
+@pytest.mark.django_db
+def test_search_products_sparse_fields():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    items = search(APIClient(), {"q": "sony", "fields": "model,price"})["products"]
+    good = next(good for good in data["goods"] if good["model"].startswith("sony"))
+    assert items == [{"model": good["model"], "price": good["price"]}]
+
+
+def test_catalog_versions():
+    version_cache = get_catalog_version_cache()
+    common = catalog_version()
+    # у магазина без изменений - общая версия, ключи для него не создаются
+    for shop_id in (1, "1", "abc", "²", "0"):
+        assert catalog_version(shop_id) == common
+    assert version_cache.get("catalog:version:1") is None
+
+    bump_catalog_version(1)
+    shop_version = catalog_version(1)
+    assert shop_version not in (None, common)
+    assert catalog_version() not in (shop_version, common)
+    # повторное изменение всегда даёт новую версию, ответы её не вытесняют
+    bump_catalog_version("1")
+    get_catalog_cache().clear()
+    assert catalog_version(1) not in (shop_version, None)
+
+    bump_catalog_version("abc")
+    assert version_cache.get("catalog:version:abc") is None
+
+
+# версия каталога меняется после фиксации транзакции
+@pytest.mark.django_db(transaction=True)
+def test_list_products_not_modified():
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+    other_shop = User.objects.create_user(email="other_shop@test.com", type="shop")
+    data["shop"] = "Другой магазин"
+    import_shop(other_shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+    params = {"shop_id": shop.shop.id, "limit": 5}
+    resp = client.get(url, params)
+    etag = resp.headers["ETag"]
+
+    # неизменённый список отдаётся без запросов к базе и без тела
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(url, params, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert len(queries) == 0
+
+    # у другой страницы свой ETag
+    resp = client.get(url, {"shop_id": shop.shop.id, "limit": 6})
+    assert resp.headers["ETag"] != etag
+
+    # импорт другого магазина не меняет ETag выборки по магазину
+    import_shop(other_shop, data)
+    resp = client.get(url, params, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+    data["shop"] = "Связной"
+    data["goods"][0]["price"] += 1
+    import_shop(shop, data)
+    resp = client.get(url, params, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+# прайс сохранён, а поисковый индекс обновить не удалось
+@pytest.mark.django_db(transaction=True)
+def test_list_products_not_modified_after_failed_index(monkeypatch):
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(shop, data)
+
+    client = APIClient()
+    url = reverse("list_products")
+    params = {"shop_id": shop.shop.id}
+    resp = client.get(url, params)
+    etag = resp.headers["ETag"]
+
+    def failed_index_shop(*args):
+        raise RuntimeError("сбой индекса")
+
+    monkeypatch.setattr(serializers, "index_shop", failed_index_shop)
+    data["goods"][0]["price"] += 1
+    result = import_shop(shop, data)
+    assert result["Status"] == False
+
+    resp = client.get(url, params, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert data["goods"][0]["price"] in [
+        item["price"] for item in resp.json()["products"]
+    ]
+
+
+@pytest.mark.django_db
+def test_export_products(monkeypatch):
+    shop = User.objects.create_user(email="shop@test.com", type="shop")
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    result = import_shop(shop, data)
+    # маленькие пачки, чтобы выгрузка шла в несколько частей
+    monkeypatch.setattr("backend.export.EXPORT_CHUNK_SIZE", 4)
+
+    client = APIClient()
+    expected = client.get(reverse("list_products"), {"limit": 100}).json()["products"]
+
+    url = reverse("export_products")
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.streaming
+    assert resp.headers["Content-Type"] == "application/json"
+    chunks = list(resp.streaming_content)
+    assert len(chunks) > 3
+    exported = json.loads(b"".join(chunks))
+    assert exported == {"Status": True, "products": expected}
+
+    resp = client.get(url, {"format": "ndjson"})
+    assert resp.headers["Content-Type"] == "application/x-ndjson"
+    lines = b"".join(resp.streaming_content).decode().splitlines()
+    assert [json.loads(line) for line in lines] == expected
+
+    category = result["actual_categories_id"][data["categories"][0]["id"]]
+    resp = client.get(url, {"category_id": category})
+    exported = json.loads(b"".join(resp.streaming_content))
+    assert exported["products"] == [
+        item
+        for item in expected
+        if item["product"]["category"] == data["categories"][0]["name"]
+    ]
+
+    resp = client.get(url, {"format": "xml"})
+    assert resp.status_code == 403
+    assert resp.json()["Status"] == False
+
+    # некорректный id отклоняется до начала потока
+    for params in ({"shop_id": "abc"}, {"category_id": "1a", "format": "ndjson"}):
+        resp = client.get(url, params)
+        assert resp.status_code == 403
+        assert not resp.streaming
+        assert resp.json()["Status"] == False
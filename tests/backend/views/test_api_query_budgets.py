@@ -0,0 +1,299 @@
+import json
+
+import pytest
+from django.urls import reverse
+from django_rest_passwordreset.models import ResetPasswordToken
+from rest_framework.test import APIClient
+
+from backend.metrics import (
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUEST_QUERIES,
+    collect_metrics,
+    reset_metrics,
+)
+from backend.models import (
+    ConfirmEmailToken,
+    Contact,
+    ImportJob,
+    Order,
+    OrderItem,
+    ProductInfo,
+    Shop,
+    User,
+)
+from backend.urls import urlpatterns
+
+# Бюджет SQL-запросов на один запрос к каждому маршруту backend/urls.py
+# ("МЕТОД имя маршрута"). Данные в сценариях нарочно содержат по несколько
+# позиций, заказов и товаров, чтобы N+1 выходил за бюджет.
+# Для потоковых выгрузок учитываются и запросы при отдаче тела.
+QUERY_BUDGETS = {
+    "GET test_ping_view": 0,
+    "GET test_user_list": 1,
+    "POST test_do_authorized_action": 1,
+    # прайс и производные таблицы пишутся в отдельных транзакциях, флаг
+    # catalog_dirty магазина читается, ставится и снимается
+    "POST update_shop": 38,
+    "GET import_job": 2,
+    "GET import_job_report": 2,
+    "GET partner_state": 2,
+    "POST partner_state": 4,
+    "GET partner_orders": 8,
+    "POST partner_orders": 6,
+    "POST register_user": 2,
+    "POST safe_register_user": 7,
+    "POST confirm_safe_register_user": 4,
+    "POST password_reset": 4,
+    "POST password_reset_confirm": 5,
+    "POST login_user": 5,
+    "POST logout_user": 2,
+    "GET user-contact": 2,
+    "POST user-contact": 3,
+    "GET basket": 8,
+    # по 3 запроса на каждую из 5 добавляемых позиций
+    "POST basket": 17,
+    "GET list_products": 1,
+    "GET search_products": 2,
+    "GET list_product_facets": 1,
+    "GET export_products": 1,
+    # список магазинов, категории и товары каждого магазина
+    "GET export_catalog_feeds": 3,
+    # магазин, его категории и товары
+    "GET export_shop_feed": 3,
+    "GET orders": 8,
+    # заказ, позиция и два письма на каждую из 5 позиций корзины
+    "POST orders": 26,
+    "GET list_shops": 1,
+}
+
+PASSWORD = "test_password"
+
+
+@pytest.fixture
+def api_data(fake_feed):
+    """
+    Магазин с прайсом из test_shop.yaml, покупатель с корзиной и заказами
+    """
+    fake_feed("tests/backend/models/test_shop.yaml")
+    client = APIClient()
+    shop_user = User.objects.create_user(
+        email="shop@test.com", password=PASSWORD, type="shop"
+    )
+    resp = client.post(
+        reverse("update_shop"),
+        {
+            "url": "https://test-shop.com/shop.yaml",
+            "user": shop_user.email,
+            "report": "true",
+        },
+    )
+    assert resp.status_code == 200, resp.json()["Error"]
+    shop = Shop.objects.get(user=shop_user)
+
+    buyer = User.objects.create_user(
+        email="buyer@test.com", password=PASSWORD, type="buyer"
+    )
+    contact = Contact.objects.create(
+        user=buyer, city="test_city", street="test_street", phone="test_phone"
+    )
+    product_infos = list(ProductInfo.objects.order_by("id"))
+    basket = Order.objects.create(user=buyer, state="basket")
+    for product_info in product_infos[:5]:
+        OrderItem.objects.create(order=basket, product_info=product_info, quantity=1)
+    orders = []
+    for product_info in product_infos[5:8]:
+        order = Order.objects.create(user=buyer, contact=contact, state="new")
+        OrderItem.objects.create(order=order, product_info=product_info, quantity=2)
+        orders.append(order)
+
+    inactive = User.objects.create_user(
+        email="inactive@test.com", password=PASSWORD, type="buyer", is_active=False
+    )
+    return {
+        "shop": shop,
+        "shop_user": shop_user,
+        "buyer": buyer,
+        "contact": contact,
+        "basket": basket,
+        "orders": orders,
+        "product_infos": product_infos,
+        "job": ImportJob.objects.get(user=shop_user),
+        "confirm_token": ConfirmEmailToken.objects.create(user=inactive),
+        "reset_token": ResetPasswordToken.objects.create(user=buyer),
+    }
+
+
+def _token(user):
+    client = APIClient()
+    resp = client.post(
+        reverse("login_user"), {"email": user.email, "password": PASSWORD}
+    )
+    return resp.json()["token"]
+
+
+# (метод, имя маршрута, чей токен, аргументы пути, параметры или тело запроса)
+CASES = [
+    ("GET", "test_ping_view", None, None, None),
+    ("GET", "test_user_list", None, None, None),
+    ("POST", "test_do_authorized_action", "buyer", None, None),
+    (
+        "POST",
+        "update_shop",
+        None,
+        None,
+        lambda data: {
+            "url": "https://test-shop.com/shop.yaml",
+            "user": data["shop_user"].email,
+            "force": "true",
+        },
+    ),
+    ("GET", "import_job", "shop_user", lambda data: [data["job"].id], None),
+    ("GET", "import_job_report", "shop_user", lambda data: [data["job"].id], None),
+    ("GET", "partner_state", "shop_user", None, None),
+    ("POST", "partner_state", "shop_user", None, lambda data: {"state": False}),
+    ("GET", "partner_orders", "shop_user", None, None),
+    (
+        "POST",
+        "partner_orders",
+        "shop_user",
+        None,
+        lambda data: {"order_id": str(data["orders"][0].id), "state": "confirmed"},
+    ),
+    (
+        "POST",
+        "register_user",
+        None,
+        None,
+        lambda data: {"email": "new@test.com", "password": PASSWORD, "type": "buyer"},
+    ),
+    (
+        "POST",
+        "safe_register_user",
+        None,
+        None,
+        lambda data: {"email": "new@test.com", "password": PASSWORD, "type": "buyer"},
+    ),
+    (
+        "POST",
+        "confirm_safe_register_user",
+        None,
+        None,
+        lambda data: {
+            "email": data["confirm_token"].user.email,
+            "token": data["confirm_token"].key,
+        },
+    ),
+    (
+        "POST",
+        "password_reset",
+        None,
+        None,
+        lambda data: {"email": data["buyer"].email},
+    ),
+    (
+        "POST",
+        "password_reset_confirm",
+        None,
+        None,
+        lambda data: {"token": data["reset_token"].key, "password": "new_password"},
+    ),
+    (
+        "POST",
+        "login_user",
+        None,
+        None,
+        lambda data: {"email": data["buyer"].email, "password": PASSWORD},
+    ),
+    ("POST", "logout_user", "buyer", None, None),
+    ("GET", "user-contact", "buyer", None, None),
+    (
+        "POST",
+        "user-contact",
+        "buyer",
+        None,
+        lambda data: {"city": "new_city", "street": "new_street", "phone": "1"},
+    ),
+    ("GET", "basket", "buyer", None, None),
+    (
+        "POST",
+        "basket",
+        "buyer",
+        None,
+        lambda data: {
+            "items": json.dumps(
+                [
+                    {"product_info": product_info.id, "quantity": 1}
+                    for product_info in data["product_infos"][8:13]
+                ]
+            )
+        },
+    ),
+    ("GET", "list_products", None, None, None),
+    ("GET", "search_products", None, None, lambda data: {"q": "smartphone"}),
+    ("GET", "list_product_facets", None, None, None),
+    ("GET", "export_products", None, None, None),
+    ("GET", "export_catalog_feeds", None, None, None),
+    ("GET", "export_shop_feed", None, lambda data: [data["shop"].id], None),
+    ("GET", "orders", "buyer", None, None),
+    (
+        "POST",
+        "orders",
+        "buyer",
+        None,
+        lambda data: {
+            "basket_id": str(data["basket"].id),
+            "contact_id": str(data["contact"].id),
+        },
+    ),
+    ("GET", "list_shops", None, None, None),
+]
+
+
+def test_query_budgets_cover_urls():
+    names = {pattern.name for pattern in urlpatterns}
+    assert names == {key.split(" ", 1)[1] for key in QUERY_BUDGETS}
+    assert set(QUERY_BUDGETS) == {f"{method} {name}" for method, name, *_ in CASES}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "method, name, user, args, params",
+    CASES,
+    ids=[f"{method} {name}" for method, name, *_ in CASES],
+)
+def test_query_budget(api_data, query_budget, method, name, user, args, params):
+    client = APIClient()
+    headers = {}
+    if user:
+        headers["Authorization"] = f"Token {_token(api_data[user])}"
+    url = reverse(name, args=args(api_data) if args else None)
+    params = params(api_data) if params else {}
+    if method == "GET":
+        resp = client.get(url, params, headers=headers)
+    else:
+        resp = client.post(url, params, headers=headers)
+    assert resp.status_code == 200
+    query_budget(resp, QUERY_BUDGETS[f"{method} {name}"])
+
+
+@pytest.mark.django_db
+def test_request_profile(settings):
+    reset_metrics()
+    settings.DEBUG = True
+    client = APIClient()
+    responses = [client.get(reverse("list_shops")) for _ in range(3)]
+    # справочник магазинов читается из БД только в первый раз
+    assert [resp.headers["X-DB-Queries"] for resp in responses] == ["1", "0", "0"]
+    assert responses[0].headers["Server-Timing"].startswith("db;dur=")
+
+    metrics = collect_metrics()
+    assert list(metrics[HTTP_REQUEST_DURATION.name]) == [("list_shops",)]
+    assert metrics[HTTP_REQUEST_DURATION.name][("list_shops",)].count == 3
+    queries = metrics[HTTP_REQUEST_QUERIES.name][("list_shops",)].report()
+    assert queries["sum"] == 1
+    assert queries["buckets"]["1"] == 3
+
+    settings.DEBUG = False
+    resp = client.get(reverse("list_shops"))
+    assert "X-DB-Queries" not in resp.headers
+    reset_metrics()
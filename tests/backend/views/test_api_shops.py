@@ -1,10 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from threading import Barrier
+
 import pytest
 import yaml
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APIClient
 
+from backend.db import write_transaction
+from backend.feeds import iter_ndjson_records, iter_yaml_records, load_feed
+from backend.jobs import claim_next_job, enqueue_import, run_import_job
 from backend.models import (
     Category,
+    ImportJob,
     Parameter,
     Product,
     ProductInfo,
@@ -12,6 +25,7 @@ from backend.models import (
     Shop,
     User,
 )
+from backend.serializers import import_shop, import_shop_records, iter_shop_data
 
 
 @pytest.fixture
@@ -28,10 +42,14 @@ def base_test_users():
 def test_update_shop_by_url(base_test_users):
     user = base_test_users[3]
     assert user.type == "shop"
+    password = "test_password"
+    user.set_password(password)
+    user.save()
 
     params = {
         "url": "https://raw.githubusercontent.com/Spardoks/DjangoGoodsService/refs/heads/master/tests/backend/models/test_shop.yaml",
         "user": user.email,
+        "report": "true",
     }
     client = APIClient()
     url = reverse("update_shop")
@@ -42,7 +60,10 @@ def test_update_shop_by_url(base_test_users):
     assert "Status" in resp_json
     assert "url" in resp_json
     assert "user" in resp_json
-    assert "data" in resp_json
+    assert "summary" in resp_json
+    assert "job_id" in resp_json
+    # сам прайс в ответ не возвращается
+    assert "data" not in resp_json
 
     assert resp_json["Status"] == True
     assert resp_json["url"] == params["url"]
@@ -52,13 +73,27 @@ def test_update_shop_by_url(base_test_users):
         data = yaml.safe_load(
             f,
         )
-    assert resp_json["data"] == data
+    summary = resp_json["summary"]
+    assert summary["goods"] == len(data["goods"])
+    assert summary["categories"] == {
+        "total": len(data["categories"]),
+        "created": len(data["categories"]),
+    }
+    assert summary["product_infos"]["created"] == len(data["goods"])
 
-    result = resp_json
-    assert "Status" in result
+    # подробный отчёт запрашивается отдельно
+    resp = client.post(
+        reverse("login_user"), {"email": user.email, "password": password}
+    )
+    header = {"Authorization": f"Token {resp.json()['token']}"}
+    resp = client.get(
+        reverse("import_job_report", args=[resp_json["job_id"]]), headers=header
+    )
+    assert resp.status_code == 200, resp.json()["Error"]
+
+    result = resp.json()["report"]
     assert "actual_categories_id" in result
     assert "actual_products_id" in result
-    assert result["Status"] == True
 
     assert User.objects.count() == len(base_test_users)
     assert Shop.objects.count() == 1
@@ -132,6 +167,100 @@ def test_get_shops_list():
     assert shop["contact"]["email"] == shop_user_db.email
 
 
+@pytest.mark.django_db
+def test_get_shops_list_not_modified(django_capture_on_commit_callbacks):
+    shop_user_db = User.objects.create_user(email="shop@test.com", type="shop")
+    with django_capture_on_commit_callbacks(execute=True):
+        shop_db = Shop.objects.create(
+            name="test_shop",
+            user=shop_user_db,
+            state=True,
+            url="https://test-shop.com",
+        )
+
+    client = APIClient()
+    url = reverse("list_shops")
+    resp = client.get(url)
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    assert resp.headers["Last-Modified"]
+
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.content == b""
+    resp = client.get(
+        url, headers={"If-Modified-Since": client.get(url).headers["Last-Modified"]}
+    )
+    assert resp.status_code == 304
+
+    # изменение магазина или email его пользователя меняет ETag, но только
+    # после фиксации транзакции
+    with django_capture_on_commit_callbacks() as callbacks:
+        shop_db.name = "new_name"
+        shop_db.save()
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    for callback in callbacks:
+        callback()
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.json()["shops"][0]["name"] == "new_name"
+
+    etag = resp.headers["ETag"]
+    with django_capture_on_commit_callbacks(execute=True):
+        shop_user_db.email = "new_shop@test.com"
+        shop_user_db.save()
+    resp = client.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.json()["shops"][0]["contact"]["email"] == "new_shop@test.com"
+
+
+# версия каталога меняется после фиксации транзакции
+@pytest.mark.django_db(transaction=True)
+def test_get_shops_list_queries():
+    shops = []
+    for i in range(5):
+        user = User.objects.create_user(
+            email=f"shop{i}@test.com", password="test_password", type="shop"
+        )
+        shops.append(Shop.objects.create(name=f"shop{i}", user=user, state=True))
+    Shop.objects.create(name="no_user", state=True)
+
+    client = APIClient()
+    url = reverse("list_shops")
+    # весь справочник - один запрос, повторные запросы идут из кэша
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(url)
+    assert resp.status_code == 200
+    assert len(queries) == 1
+    assert [shop["name"] for shop in resp.json()["shops"]] == [
+        "shop4",
+        "shop3",
+        "shop2",
+        "shop1",
+        "shop0",
+        "no_user",
+    ]
+    assert resp.json()["shops"][-1]["contact"] == {"email": ""}
+
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(url, {"shop_id": shops[0].id})
+    assert len(queries) == 0
+    assert [shop["name"] for shop in resp.json()["shops"]] == ["shop0"]
+
+    # выключение магазина через partner/state обновляет справочник
+    resp = client.post(
+        reverse("login_user"), {"email": "shop0@test.com", "password": "test_password"}
+    )
+    header = {"Authorization": f"Token {resp.json()['token']}"}
+    resp = client.post(reverse("partner_state"), {"state": False}, headers=header)
+    assert resp.status_code == 200
+    resp = client.get(url)
+    assert "shop0" not in [shop["name"] for shop in resp.json()["shops"]]
+
+    resp = client.get(url, {"shop_id": "abc"})
+    assert resp.status_code == 403
+
+
 @pytest.mark.django_db
 def test_change_shop_state_example():
     email = "test1@test.com"
@@ -171,3 +300,382 @@ def test_change_shop_state_example():
 
     shop_db.refresh_from_db()
     assert shop_db.state == second_state
+
+
+@pytest.mark.django_db
+def test_change_shop_state_without_shop():
+    email = "test1@test.com"
+    password = "test_password"
+    User.objects.create_user(email=email, password=password, type="shop")
+
+    client = APIClient()
+    resp = client.post(reverse("login_user"), {"email": email, "password": password})
+    header = {"Authorization": f"Token {resp.json()['token']}"}
+    # прайс ещё не загружался, магазина нет
+    resp = client.post(reverse("partner_state"), {"state": False}, headers=header)
+    assert resp.status_code == 200
+    assert resp.json()["Status"] == True
+    assert Shop.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_update_shop_by_url_streaming(base_test_users, fake_feed):
+    user = base_test_users[3]
+    fake_feed("tests/backend/models/test_shop.yaml")
+
+    params = {
+        "url": "https://test-shop.com/shop.yaml",
+        "user": user.email,
+        "stream": "true",
+    }
+    client = APIClient()
+    url = reverse("update_shop")
+    resp = client.post(url, params)
+    assert resp.status_code == 200, resp.json()["Error"]
+
+    resp_json = resp.json()
+    assert resp_json["Status"] == True
+    assert "data" not in resp_json
+    assert "parse" in resp_json["timings"]
+    assert "download" in resp_json["timings"]
+    assert "actual_products_id" not in resp_json
+
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    assert resp_json["summary"]["goods"] == len(data["goods"])
+    assert ProductInfo.objects.count() == len(data["goods"])
+    assert Shop.objects.get(user_id=user.id).name == data["shop"]
+
+
+@pytest.mark.django_db
+def test_update_shop_by_url_background_job(fake_feed):
+    email = "shop@test.com"
+    password = "test_password"
+    user = User.objects.create_user(email=email, password=password, type="shop")
+    fake_feed("tests/backend/models/test_shop.yaml")
+
+    params = {
+        "url": "https://test-shop.com/shop.yaml",
+        "user": user.email,
+        "background": "true",
+    }
+    client = APIClient()
+    url = reverse("update_shop")
+    resp = client.post(url, params)
+    assert resp.status_code == 200, resp.json()["Error"]
+    assert resp.json()["Status"] == True
+    job_id = resp.json()["job_id"]
+
+    # до запуска воркера ничего не импортировано
+    assert ProductInfo.objects.count() == 0
+    job = ImportJob.objects.get(id=job_id)
+    assert job.state == "new"
+
+    call_command("run_import_worker", "--once")
+
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    assert ProductInfo.objects.count() == len(data["goods"])
+
+    resp = client.post(reverse("login_user"), {"email": email, "password": password})
+    header = {"Authorization": f"Token {resp.json()['token']}"}
+    resp = client.get(reverse("import_job", args=[job_id]), headers=header)
+    assert resp.status_code == 200, resp.json()["Error"]
+    job = resp.json()["job"]
+    assert job["state"] == "done"
+    assert job["processed"] == len(data["goods"])
+    assert job["result"]["summary"]["goods"] == len(data["goods"])
+    assert job["result"]["summary"]["product_infos"]["created"] == len(
+        data["goods"]
+    )
+    assert job["error"] == ""
+
+
+@pytest.mark.django_db
+def test_import_job_failed(monkeypatch):
+    user = User.objects.create_user(email="shop@test.com", type="shop")
+
+    def failed_get(url, **kwargs):
+        raise ConnectionError(url)
+
+    monkeypatch.setattr("backend.feeds.get", failed_get)
+    job = enqueue_import(user, "https://test-shop.com/shop.yaml")
+
+    call_command("run_import_worker", "--once")
+
+    job.refresh_from_db()
+    assert job.state == "failed"
+    assert job.error
+    assert job.finished_at is not None
+
+
+@pytest.mark.django_db
+def test_update_shop_by_url_unchanged_feed(base_test_users, fake_feed):
+    user = base_test_users[3]
+    requests_headers = fake_feed("tests/backend/models/test_shop.yaml", etag='"v1"')
+
+    params = {"url": "https://test-shop.com/shop.yaml", "user": user.email}
+    client = APIClient()
+    url = reverse("update_shop")
+    resp = client.post(url, params)
+    assert resp.status_code == 200, resp.json()["Error"]
+    assert resp.json()["unchanged"] == False
+    assert requests_headers[-1] == {}
+
+    shop = Shop.objects.get(user_id=user.id)
+    assert shop.feed_url == params["url"]
+    assert shop.feed_etag == '"v1"'
+    assert shop.feed_hash
+    old_infos = list(ProductInfo.objects.values_list("id", flat=True))
+
+    # поставщик ответил 304 - импорт не выполняется
+    for streaming in ("false", "true"):
+        resp = client.post(url, dict(params, stream=streaming))
+        assert resp.status_code == 200, resp.json()["Error"]
+        assert resp.json()["unchanged"] == True
+        assert requests_headers[-1] == {"If-None-Match": '"v1"'}
+    assert list(ProductInfo.objects.values_list("id", flat=True)) == old_infos
+
+    # тот же прайс без ETag распознаётся по хэшу содержимого
+    Shop.objects.filter(id=shop.id).update(feed_etag="")
+    resp = client.post(url, params)
+    assert resp.json()["unchanged"] == True
+
+    # force импортирует прайс в любом случае
+    resp = client.post(url, dict(params, force="true"))
+    assert resp.status_code == 200, resp.json()["Error"]
+    assert resp.json()["unchanged"] == False
+    assert requests_headers[-1] == {}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_import_shops_command_parallel(fake_feed, tmp_path):
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    feeds = {}
+    for i in range(3):
+        shop_data = dict(data, shop=f"shop_{i}")
+        path = tmp_path / f"shop_{i}.yaml"
+        path.write_text(yaml.safe_dump(shop_data, allow_unicode=True), "utf-8")
+        user = User.objects.create_user(email=f"shop_{i}@test.com", type="shop")
+        url = f"https://test-shop.com/shop_{i}.yaml"
+        Shop.objects.create(name=f"shop_{i}", user=user, feed_url=url)
+        feeds[url] = path
+
+    fake_feed(feeds)
+    call_command("import_shops", "--workers", "2")
+
+    assert ImportJob.objects.filter(state="done").count() == len(feeds)
+    for shop in Shop.objects.all():
+        assert shop.product_infos.count() == len(data["goods"])
+        assert shop.feed_hash
+
+
+def test_import_job_url_fits_feed_url():
+    # задачу можно поставить для любого прайса, сохранённого у магазина
+    assert (
+        ImportJob._meta.get_field("url").max_length
+        >= Shop._meta.get_field("feed_url").max_length
+    )
+
+
+@pytest.mark.django_db
+def test_claim_next_job_fails_stale_jobs(settings):
+    settings.IMPORT_JOB_TIMEOUT = 60
+    user = User.objects.create_user(email="shop@test.com", type="shop")
+    # воркер остановился, не завершив задачу
+    stale = enqueue_import(user, "https://test-shop.com/shop.yaml")
+    ImportJob.objects.filter(id=stale.id).update(
+        state="running", started_at=timezone.now() - timedelta(minutes=5)
+    )
+    running = enqueue_import(User.objects.create_user(email="other@test.com"), "")
+    ImportJob.objects.filter(id=running.id).update(
+        state="running", started_at=timezone.now()
+    )
+    job = enqueue_import(user, "https://test-shop.com/shop.yaml")
+
+    assert claim_next_job().id == job.id
+    stale.refresh_from_db()
+    assert stale.state == "failed"
+    assert stale.error
+    assert stale.finished_at is not None
+    running.refresh_from_db()
+    assert running.state == "running"
+
+
+@pytest.mark.django_db
+def test_run_import_job_keeps_stale_state(settings, fake_feed):
+    fake_feed("tests/backend/models/test_shop.yaml")
+    settings.IMPORT_JOB_TIMEOUT = 60
+    user = User.objects.create_user(email="shop@test.com", type="shop")
+    enqueue_import(user, "https://test-shop.com/shop.yaml")
+    job = claim_next_job()
+    # задача выполнялась дольше IMPORT_JOB_TIMEOUT и уже признана зависшей
+    ImportJob.objects.filter(id=job.id).update(
+        started_at=timezone.now() - timedelta(minutes=5)
+    )
+    assert claim_next_job() is None
+
+    job = run_import_job(job)
+    assert job.state == "failed"
+    assert job.error == "Задача не завершилась за отведённое время"
+    job.refresh_from_db()
+    assert job.state == "failed"
+    assert job.error == "Задача не завершилась за отведённое время"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_claim_next_job_concurrent():
+    users = [
+        User.objects.create_user(email=f"shop_{i}@test.com", type="shop")
+        for i in range(2)
+    ]
+    # у первого магазина две задачи в очереди, у второго одна
+    for user in (users[0], users[0], users[1]):
+        enqueue_import(user, "https://test-shop.com/shop.yaml")
+
+    start = Barrier(4)
+
+    def claim():
+        try:
+            start.wait()
+            return claim_next_job()
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        claimed = [job for job in executor.map(lambda _: claim(), range(4)) if job]
+
+    # одновременно выполняется не больше одной задачи каждого магазина
+    assert sorted(job.user_id for job in claimed) == [users[0].id, users[1].id]
+    assert ImportJob.objects.filter(state="running").count() == 2
+    assert ImportJob.objects.filter(state="new").count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_write_transaction_mode():
+    with CaptureQueriesContext(connection) as queries:
+        with write_transaction():
+            ImportJob.objects.count()
+        with transaction.atomic():
+            ImportJob.objects.count()
+
+    # блокировку записи заранее берут только транзакции импорта
+    sql = [query["sql"] for query in queries.captured_queries]
+    begins = [query for query in sql if query.startswith("BEGIN")]
+    assert begins == ["BEGIN IMMEDIATE", "BEGIN"]
+    assert connection.transaction_mode is None
+
+
+def shop_goods(shop):
+    """
+    Прайс магазина в виде, не зависящем от id в базе
+    """
+    return sorted(
+        (
+            product_info.product.name,
+            product_info.product.category.name,
+            product_info.model,
+            product_info.price,
+            product_info.price_rrc,
+            product_info.quantity,
+            tuple(
+                sorted(
+                    (parameter.parameter.name, parameter.value)
+                    for parameter in product_info.product_parameters.all()
+                )
+            ),
+        )
+        for product_info in ProductInfo.objects.filter(shop=shop)
+    )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("data_format", ["yaml", "ndjson"])
+def test_export_shop_feed_round_trip(base_test_users, monkeypatch, data_format):
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(base_test_users[2], data)
+    shop = Shop.objects.get(user=base_test_users[2])
+    monkeypatch.setattr("backend.export.EXPORT_CHUNK_SIZE", 5)
+
+    client = APIClient()
+    url = reverse("export_shop_feed", kwargs={"shop_id": shop.id})
+    resp = client.get(url, {"format": data_format})
+    assert resp.status_code == 200
+    assert resp.streaming
+    content = b"".join(resp.streaming_content)
+
+    if data_format == "yaml":
+        feed = yaml.safe_load(content)
+        assert feed["shop"] == data["shop"]
+        assert sorted(category["name"] for category in feed["categories"]) == sorted(
+            category["name"] for category in data["categories"]
+        )
+        assert len(feed["goods"]) == len(data["goods"])
+        records = iter_shop_data(feed)
+    else:
+        records = iter_ndjson_records(content.splitlines())
+
+    # выгруженный прайс загружается обратно в другой магазин без потерь
+    Shop.objects.filter(id=shop.id).update(name="Старый магазин")
+    result = import_shop_records(base_test_users[3], records)
+    assert result["Status"] == True, result.get("Error")
+    new_shop = Shop.objects.get(user=base_test_users[3])
+    assert new_shop.name == data["shop"]
+    assert shop_goods(new_shop) == shop_goods(shop)
+
+
+@pytest.mark.django_db
+def test_export_catalog_feeds(base_test_users):
+    with open("tests/backend/models/test_shop.yaml", "r", encoding="utf-8") as f:
+        data = yaml.safe_load(
+            f,
+        )
+    import_shop(base_test_users[2], data)
+    data["shop"] = "Другой магазин"
+    data["goods"] = data["goods"][:2]
+    import_shop(base_test_users[3], data)
+    # выключенный магазин не выгружается
+    disabled = User.objects.create_user(email="test5@test.com", type="shop")
+    data["shop"] = "Выключенный магазин"
+    import_shop(disabled, data)
+    Shop.objects.filter(user=disabled).update(state=False)
+
+    client = APIClient()
+    resp = client.get(reverse("export_catalog_feeds"))
+    assert resp.status_code == 200
+    content = b"".join(resp.streaming_content)
+    feeds = list(yaml.safe_load_all(content))
+    assert [(feed["shop"], len(feed["goods"])) for feed in feeds] == [
+        ("Связной", 14),
+        ("Другой магазин", 2),
+    ]
+    # поток из нескольких документов импорт не принимает, а каждый документ -
+    # прайс в формате импорта
+    with pytest.raises(yaml.YAMLError):
+        load_feed(BytesIO(content))
+    with pytest.raises(ValueError, match="одного документа"):
+        list(iter_yaml_records(BytesIO(content)))
+    for i, feed in enumerate(feeds):
+        user = User.objects.create_user(email=f"copy{i}@test.com", type="shop")
+        feed["shop"] = f"Копия {i}"
+        assert import_shop(user, feed)["Status"] == True
+        assert Shop.objects.get(user=user).product_infos.count() == len(feed["goods"])
+
+    disabled_shop = Shop.objects.get(user=disabled)
+    resp = client.get(reverse("export_shop_feed", kwargs={"shop_id": disabled_shop.id}))
+    assert resp.status_code == 403
+    resp = client.get(
+        reverse("export_shop_feed", kwargs={"shop_id": disabled_shop.id}),
+        {"format": "csv"},
+    )
+    assert resp.status_code == 403
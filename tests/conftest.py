@@ -0,0 +1,93 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+@pytest.fixture(autouse=True)
+def catalog_cache(settings, tmp_path):
+    """
+    Отдельный кэш каталога и его версий в каталоге теста: закэшированные
+    ответы не переживают тест и не смешиваются с кэшем BASE_DIR/cache
+    разработчика
+    """
+    settings.CACHES = {
+        **settings.CACHES,
+        settings.CATALOG_CACHE: {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": tmp_path / "catalog_cache",
+        },
+        settings.CATALOG_VERSION_CACHE: {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": tmp_path / "catalog_version_cache",
+        },
+    }
+
+
+@pytest.fixture
+def query_budget(settings):
+    """
+    Проверка бюджета SQL-запросов ответа тестового клиента:
+    query_budget(response, 5). Запросы считает RequestProfileMiddleware и в
+    режиме DEBUG отдаёт их число в заголовке X-DB-Queries. Тело потокового
+    ответа строится уже после middleware, поэтому его запросы считаются здесь
+    при чтении тела
+    """
+    settings.DEBUG = True
+
+    def check(response, budget):
+        queries = int(response.headers["X-DB-Queries"])
+        if response.streaming:
+            with CaptureQueriesContext(connection) as streamed:
+                b"".join(response.streaming_content)
+            queries += len(streamed)
+        assert queries <= budget, (
+            f"{response.resolver_match.view_name}: {queries} SQL-запросов "
+            f"при бюджете {budget}"
+        )
+
+    return check
+
+
+class FakeFeedResponse:
+    def __init__(self, path, request_headers=None, etag=None):
+        with open(path, "rb") as f:
+            self.content = f.read()
+        self.headers = {"ETag": etag} if etag else {}
+        self.status_code = 200
+        if etag and (request_headers or {}).get("If-None-Match") == etag:
+            self.status_code = 304
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_feed(monkeypatch):
+    """
+    Подмена загрузки прайса по URL: fake_feed(path) отдаёт файл path по любому
+    URL, fake_feed({url: path}) - свой файл для каждого URL. С etag поставщик
+    отвечает 304 на запрос с тем же If-None-Match. Возвращает список заголовков
+    выполненных запросов
+    """
+    requests_headers = []
+
+    def install(feeds, etag=None):
+        def fake_get(url, headers=None, **kwargs):
+            requests_headers.append(headers)
+            path = feeds[url] if isinstance(feeds, dict) else feeds
+            return FakeFeedResponse(path, headers, etag)
+
+        monkeypatch.setattr("backend.feeds.get", fake_get)
+        return requests_headers
+
+    return install